@@ -1,5 +1,5 @@
-import json
 import argparse
+import io_tools
 from vllm import LLM, SamplingParams
 
 train_prompt = """# Role Definition
@@ -27,8 +27,7 @@ Your response should be concise and presented in coherent paragraphs (without st
 - General methodological tips applicable to this category of problems."""
 
 def load_data(jsonl_path):
-    with open(jsonl_path, 'r') as f:
-        return [json.loads(line) for line in f]
+    return io_tools.read_jsonl(jsonl_path)
 
 def build_messages(ori, prompt_cot):
     return [
@@ -19,6 +19,11 @@ def parse_args():
                        type=int,
                        default=32,
                        help='每个题目的扩展数量 (默认: 32)')
+    parser.add_argument('--plan_format',
+                       choices=['compact', 'expanded'],
+                       default='compact',
+                       help='compact: 每个题目一行并记录expand_count，schema只在首行存一份，由rollout客户端按需展开; '
+                            'expanded: 旧格式，每个副本一行 (默认: compact)')
     return parser.parse_args()
 
 # 常量定义
@@ -92,14 +97,28 @@ def get_config(mode):
             'method': GenVerifyPrompt
         }
 
-def generate_and_process_data(data, config):
-    """使用生成器处理大数据集"""
+# compact计划文件的格式版本，首行为 {"plan_version", "schemas": {名称: schema}}
+PLAN_VERSION = 1
+
+def generate_and_process_data(data, config, schema_ref=None):
+    """使用生成器处理大数据集；给定schema_ref时只记录schema的引用，不在每行重复写入schema"""
+    schema = SolveDict.model_json_schema()
     for item in data:
         processed_item = item
         processed_item['user_prompt'] = config['method'](processed_item)
-        processed_item['schema'] = SolveDict.model_json_schema()
+        if schema_ref is None:
+            processed_item['schema'] = schema
+        else:
+            processed_item['schema_ref'] = schema_ref
         yield processed_item
 
+def generate_plan(data, config, expand_count):
+    """compact计划：首行为共享的schema，之后每个题目一行，expand_count为需要的采样数"""
+    yield {'plan_version': PLAN_VERSION, 'schemas': {'solve': SolveDict.model_json_schema()}}
+    for item in generate_and_process_data(data, config, schema_ref='solve'):
+        item['expand_count'] = expand_count
+        yield item
+
 def main():
     """主函数"""
     # 获取命令行参数
@@ -110,23 +129,25 @@ def main():
     EXPAND_COUNT = args.expand_count
     
     # 读取原始数据
-    ori = io_tools.read_jsonl(INPUT_PATH)
+    ori = io_tools.iter_jsonl(INPUT_PATH)
     
     # 获取配置
     config = get_config(MODE)
     
-    # 处理数据
-    processed = generate_and_process_data(ori, config)
-    expended = [item for item in processed for _ in range(EXPAND_COUNT)]
-    
-    # 保存结果
-    io_tools.write_jsonl(OUTPUT_PATH, expended)
+    # 处理数据：逐条读取、处理、写出，不在内存中展开 题目数×EXPAND_COUNT 条
+    if args.plan_format == 'compact':
+        # 展开推迟到rollout客户端发请求时，文件大小与题目数成正比
+        total = (io_tools.write_jsonl(OUTPUT_PATH, generate_plan(ori, config, EXPAND_COUNT)) - 1) * EXPAND_COUNT
+    else:
+        processed = generate_and_process_data(ori, config)
+        expended = (item for item in processed for _ in range(EXPAND_COUNT))
+        total = io_tools.write_jsonl(OUTPUT_PATH, expended)
     
     # 输出统计信息
     print(f'已保存到 {OUTPUT_PATH}')
-    print(f'模式: {MODE}')
+    print(f'模式: {MODE}, 计划格式: {args.plan_format}')
     print(f'每个题目扩展了 {EXPAND_COUNT} 次')
-    print(f'总共处理了 {len(expended)} 个项目')
+    print(f'总共处理了 {total} 个项目')
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,15 +1,80 @@
 import json
+import os
+import itertools
+import hashlib
+import random
+import collections
 import asyncio
+import concurrent.futures
 import aiohttp
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Iterable, Iterator, Callable
 import traceback
 from aiohttp import ClientTimeout
 import time
-from tqdm import tqdm
 import argparse
+from llm_cache import ResponseCache, make_cache_key
+from client_metrics import RolloutMetrics, format_metrics
+import io_tools
+
+# 接口返回非200或响应体无法解析时抛出，status为None表示响应体解析失败
+class ApiError(Exception):
+    def __init__(self, status: Optional[int], message: str):
+        super().__init__(message)
+        self.status = status
+
+# 默认重试策略：指数退避 + 全抖动，只重试可恢复的错误
+DEFAULT_RETRY_POLICY = {
+    'max_retries': 3,  # 单行最多重试次数
+    'base_delay': 1.0,  # 首次退避上限（秒），之后每次翻倍
+    'max_delay': 60.0,  # 退避上限（秒）
+}
+
+# 错误分类：返回 (错误类别, 是否可重试)
+def classify_error(e: BaseException):
+    if isinstance(e, ApiError):
+        if e.status is None:
+            return 'bad_response', False
+        if e.status == 429:
+            return 'http_429', True
+        if e.status >= 500:
+            return 'http_5xx', True
+        return f'http_{e.status}', False
+    if isinstance(e, asyncio.TimeoutError):
+        return 'timeout', True
+    if isinstance(e, (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, ConnectionResetError)):
+        return 'connection', True
+    if isinstance(e, (KeyError, IndexError, TypeError)):
+        return 'bad_response', False
+    return 'other', False
+
+# 第attempt次重试前的退避时间，full jitter避免大量失败请求同时重发
+def backoff_delay(policy: Dict[str, Any], attempt: int) -> float:
+    return random.uniform(0, min(policy['max_delay'], policy['base_delay'] * (2 ** attempt)))
+
+# 默认采样参数，可通过 sampling 选项覆盖或追加（如 seed）
+DEFAULT_SAMPLING = {
+    "temperature": 1,
+    "top_p": 0.7,
+    "max_tokens": 4096,
+}
+
+def build_messages(system_prompt: str, user_prompt: str) -> List[Dict[str, str]]:
+    return [
+        {
+            "role": "system",
+            "content": system_prompt
+        },
+        {
+            "role": "user",
+            "content": user_prompt
+        }
+    ]
 
 # 异步调用API接口，发送结构化JSON请求
-async def call_api_json_async(url: str, model_name: str, system_prompt: str, user_prompt: str, schema: str, session: aiohttp.ClientSession) -> Dict[str, Any]:
+async def call_api_json_async(url: str, model_name: str, system_prompt: str, user_prompt: str, schema: str, session: aiohttp.ClientSession,
+                              n: int = 1, stream: bool = False, stop_condition: Optional[Dict[str, Any]] = None,
+                              sampling: Optional[Dict[str, Any]] = None,
+                              messages: Optional[List[Dict[str, str]]] = None) -> Dict[str, Any]:
     """
     Args:
         url: API端点URL
@@ -18,9 +83,17 @@ async def call_api_json_async(url: str, model_name: str, system_prompt: str, use
         user_prompt: 用户提示词
         schema: JSON schema格式的输出结构定义
         session: aiohttp会话对象
+        n: 服务端对同一prompt采样的条数，结果在choices中
+        stream: 以SSE流式接收，记录首token时间和解码速度，并可按stop_condition提前终止
+        stop_condition: 流式提前终止条件，见 read_sse_response
+        sampling: 采样参数，默认 DEFAULT_SAMPLING；其中的键原样放入请求体（如 logprobs / chat_template_kwargs）
+        messages: 直接给出完整的messages，此时忽略 system_prompt / user_prompt
         
     Returns:
-        API的JSON响应或错误信息
+        API的JSON响应；流式时拼成与非流式相同的结构，另含 timing 字段
+
+    Raises:
+        ApiError: 非200状态码或响应体无法解析
     """
     headers = {
         "Content-Type": "application/json"
@@ -28,16 +101,7 @@ async def call_api_json_async(url: str, model_name: str, system_prompt: str, use
     
     data = {
         "model": model_name,
-        "messages": [
-            {
-                "role": "system",
-                "content": system_prompt
-            },
-            {
-                "role": "user",
-                "content": user_prompt
-            }
-        ],
+        "messages": messages or build_messages(system_prompt, user_prompt),
         'response_format': {
             "type": "json_schema",
             "json_schema": {
@@ -46,17 +110,20 @@ async def call_api_json_async(url: str, model_name: str, system_prompt: str, use
                 "schema": schema
             },
         },
-        "temperature": 1,
-        "top_p": 0.7,
-        "max_tokens": 4096,
-        "stream": False,
-        "n": 1
+        **(sampling or DEFAULT_SAMPLING),
+        "stream": stream,
+        "n": n
     }
 
     if not schema:
         del data['response_format']
+    if stream:
+        data['stream_options'] = {"include_usage": True}
    
+    sent_at = time.monotonic()
     async with session.post(url, headers=headers, json=data) as response:
+        if response.status == 200 and stream:
+            return await read_sse_response(response, n, sent_at, stop_condition)
         if response.status == 200:
             try:
                 json_data = await response.json()  # 尝试获取.json(), 否则手动解析接口返回结果
@@ -67,95 +134,672 @@ async def call_api_json_async(url: str, model_name: str, system_prompt: str, use
                     json_data = json.loads(text)
                     return json_data
                 except json.JSONDecodeError as e:
-                    return f"请求结果JSON解析错误: {e}, 响应内容: {text}"
+                    raise ApiError(None, f"请求结果JSON解析错误: {e}, 响应内容: {text}")
         else:
             text = await response.text()
-            return f"请求结果错误: {response.status}, 响应内容: {text}"
+            raise ApiError(response.status, f"请求结果错误: {response.status}, 响应内容: {text}")
 
-# 异步批处理请求，单条请求返回结果后处理，超时设置
-async def process_async_batch(input_list: List[Dict[str, Any]], concurrency: int, url: str, model_name: str) -> List[Dict[str, Any]]:
+# 增量扫描输出文本，判断最外层JSON对象是否已经闭合
+class JsonCloseTracker:
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.started = False
+        self.closed = False
+
+    def feed(self, text: str) -> bool:
+        for ch in text:
+            if self.closed:
+                break
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == '\\':
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = self.started
+            elif ch in '{[':
+                self.depth += 1
+                self.started = True
+            elif ch in '}]' and self.started:
+                self.depth -= 1
+                self.closed = self.depth == 0
+        return self.closed
+
+# 读取SSE流，拼装成非流式响应的结构，并在满足终止条件时提前断开
+async def read_sse_response(response: aiohttp.ClientResponse, n: int, sent_at: float,
+                            stop_condition: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """
     Args:
-        input_list: 输入数据列表
-        concurrency: 并发限制
-        url: API端点URL
-        model_name: 模型名称
-        
+        response: 已返回200的流式响应
+        n: 采样条数
+        sent_at: 请求发出时刻（time.monotonic）
+        stop_condition: 提前终止条件，所有choice都满足后断开连接，服务端随之取消生成
+            {'json_closed': True,  # 输出的JSON对象（如 {analysis, final_answer}）闭合即停止
+             'stop_strings': [...],  # 出现任一字符串即停止
+             'max_chars': 20000}  # 输出超过该长度即停止（截断失控生成）
+
     Returns:
-        处理结果列表
+        {'choices': [...], 'usage': {...}, 'timing': {'ttft', 'decode_time', 'completion_tokens', 'decode_tps', 'early_stopped'}}
     """
-        
-    results = []
-    semaphore = asyncio.Semaphore(concurrency)  # 使用信号量限制并发数
-    
-    # 单条请求调用+后处理
-    async def process_single_item(row: Dict[str, Any], session: aiohttp.ClientSession) -> Dict[str, Any]:
-        """处理单个项目"""
-        user_prompt = row['user_prompt']
-        system_prompt = row.get('system_prompt', '')
-        schema = row.get('schema', '')
-        
-        async with semaphore:
-            try:
-                result = await call_api_json_async(
-                    url=url,
-                    model_name=model_name,
-                    system_prompt=system_prompt,
-                    user_prompt=user_prompt,
-                    schema=schema,
-                    session=session
-                )
-                try:
-                    return {
-                        'content': result['choices'][0]['message']['content'],
-                        'error_str': ''
-                    }
-                except Exception as e:
-                    return {
-                        'content': '',
-                        'error_str': f'{e}**\n{traceback.format_exc()}**\n{str(result)}'
-                    }
-
-            except Exception as e:
-                return {
-                    'content': '',
-                    'error_str': f'{e}**\n{traceback.format_exc()}'
-                }
-    
-    # 创建自定义超时设置
-    timeout = ClientTimeout(
+    stop_condition = stop_condition or {}
+    texts = [''] * n
+    finish_reasons = [None] * n
+    stopped = [False] * n
+    trackers = [JsonCloseTracker() for _ in range(n)]
+    chunk_count = 0
+    usage = None
+    first_token_at = None
+    early_stopped = False
+
+    async for raw_line in response.content:
+        line = raw_line.decode('utf-8').strip()
+        if not line.startswith('data:'):
+            continue
+        payload = line[len('data:'):].strip()
+        if payload == '[DONE]':
+            break
+        chunk = json.loads(payload)
+        if chunk.get('usage'):
+            usage = chunk['usage']
+        for choice in chunk.get('choices', []):
+            i = choice.get('index', 0)
+            delta = (choice.get('delta') or {}).get('content') or ''
+            if delta:
+                if first_token_at is None:
+                    first_token_at = time.monotonic()
+                chunk_count += 1
+                texts[i] += delta
+                if should_stop(texts[i], delta, trackers[i], stop_condition):
+                    stopped[i] = True
+            if choice.get('finish_reason'):
+                finish_reasons[i] = choice['finish_reason']
+                stopped[i] = True
+        if all(stopped):
+            early_stopped = any(reason is None for reason in finish_reasons)
+            if early_stopped:
+                response.close()  # 断开连接，服务端取消剩余生成
+            break
+
+    done_at = time.monotonic()
+    completion_tokens = usage['completion_tokens'] if usage and not early_stopped else chunk_count
+    decode_time = done_at - (first_token_at or done_at)
+    return {
+        'choices': [
+            {'index': i, 'message': {'role': 'assistant', 'content': texts[i]}, 'finish_reason': finish_reasons[i] or 'early_stop'}
+            for i in range(n)
+        ],
+        'usage': usage,
+        'timing': {
+            'ttft': (first_token_at or done_at) - sent_at,
+            'decode_time': decode_time,
+            'completion_tokens': completion_tokens,
+            'decode_tps': completion_tokens / decode_time if decode_time > 0 else 0.0,
+            'early_stopped': early_stopped
+        }
+    }
+
+def should_stop(text: str, delta: str, tracker: JsonCloseTracker, stop_condition: Dict[str, Any]) -> bool:
+    if stop_condition.get('json_closed') and tracker.feed(delta):
+        return True
+    # 只在新增片段附近查找停止串，避免每个token都扫描全文
+    tail = text[-(len(delta) + max((len(x) for x in stop_condition.get('stop_strings', [])), default=0)):]
+    if any(x in tail for x in stop_condition.get('stop_strings', [])):
+        return True
+    return bool(stop_condition.get('max_chars')) and len(text) >= stop_condition['max_chars']
+
+# 单条请求调用+后处理
+async def request_one(row: Dict[str, Any], session: aiohttp.ClientSession, url: str, model_name: str, n: int = 1,
+                      stream: bool = False, stop_condition: Optional[Dict[str, Any]] = None,
+                      sampling: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """
+    处理单个项目，n>1时由服务端一次采样n条，按choices顺序拆回n个结果；
+    成功时每个结果附带该请求的 usage（请求了logprobs时另带该choice的 logprobs）；
+    失败时附带错误类别、HTTP状态码和是否可重试；流式时附带该请求的 timing
+    行里有 messages 时直接发送，否则由 system_prompt / user_prompt 构造
+    """
+    user_prompt = row.get('user_prompt', '')
+    system_prompt = row.get('system_prompt', '')
+    schema = row.get('schema', '')
+
+    result = None
+    try:
+        result = await call_api_json_async(
+            url=url,
+            model_name=model_name,
+            system_prompt=system_prompt,
+            user_prompt=user_prompt,
+            schema=schema,
+            session=session,
+            n=n,
+            stream=stream,
+            stop_condition=stop_condition,
+            sampling=sampling,
+            messages=row.get('messages')
+        )
+        choices = sorted(result['choices'], key=lambda choice: choice.get('index', 0))
+        outputs = [{'content': choice['message']['content'], 'error_str': '', 'usage': result.get('usage')} for choice in choices[:n]]
+        for output, choice in zip(outputs, choices):
+            if choice.get('logprobs'):
+                output['logprobs'] = choice['logprobs']
+        if 'timing' in result:
+            for output in outputs:
+                output['timing'] = result['timing']
+        for _ in range(n - len(outputs)):
+            outputs.append({
+                'content': '',
+                'error_str': f'返回的choices数量不足: {len(choices)}/{n}',
+                'error_class': 'bad_response',
+                'retryable': False
+            })
+        return outputs
+    except Exception as e:
+        error_class, retryable = classify_error(e)
+        error_str = f'{e}**\n{traceback.format_exc()}'
+        if result is not None:
+            error_str += f'**\n{str(result)}'
+        return [{
+            'content': '',
+            'error_str': error_str,
+            'error_class': error_class,
+            'status': getattr(e, 'status', None),
+            'retryable': retryable
+        } for _ in range(n)]
+
+# 相同prompt的相邻行合并成一组，每组最多max_n条，用一次 n=len(组) 的请求完成
+def group_rows(indexed_rows: Iterable, max_n: int = 1) -> Iterator[List]:
+    """
+    Args:
+        indexed_rows: (idx, row) 迭代器
+        max_n: 每个请求的最大采样数，1表示不合并
+
+    Yields:
+        [(idx, row), ...]
+    """
+    group = []
+    for idx, row in indexed_rows:
+        if group and (len(group) >= max_n or not same_prompt(group[0][1], row)):
+            yield group
+            group = []
+        group.append((idx, row))
+    if group:
+        yield group
+
+# 给每行标注它是同一prompt连续副本中的第几个（sample_idx），已有该字段的行保持不变
+def assign_sample_idx(rows: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    prev = None
+    pos = 0
+    for row in rows:
+        pos = pos + 1 if prev is not None and same_prompt(prev, row) else 0
+        row.setdefault('sample_idx', pos)
+        prev = row
+        yield row
+
+# 前缀缓存友好的顺序：每次读入lookahead个组，按 system_prompt + user_prompt 排序后发出，
+# 共享模板头的prompt相邻，同一题的多个组连续（排序稳定），服务端的radix cache能在被淘汰前复用
+def order_by_prefix(groups: Iterator[List], lookahead: int) -> Iterator[List]:
+    if lookahead <= 1:
+        yield from groups
+        return
+    while True:
+        block = list(itertools.islice(groups, lookahead))
+        if not block:
+            return
+        block.sort(key=lambda group: prefix_key(group[0][1]))
+        yield from block
+
+def prefix_key(row: Dict[str, Any]) -> str:
+    if 'messages' in row:
+        return '\x00'.join(str(m.get('content', '')) for m in row['messages'])
+    return row.get('system_prompt', '') + '\x00' + row['user_prompt']
+
+def row_messages(row: Dict[str, Any]) -> List[Dict[str, str]]:
+    return row['messages'] if 'messages' in row else build_messages(row.get('system_prompt', ''), row['user_prompt'])
+
+def same_prompt(a: Dict[str, Any], b: Dict[str, Any]) -> bool:
+    if 'messages' in a or 'messages' in b:
+        return a.get('messages') == b.get('messages') and a.get('schema', '') == b.get('schema', '')
+    return (a['user_prompt'] == b['user_prompt']
+            and a.get('system_prompt', '') == b.get('system_prompt', '')
+            and a.get('schema', '') == b.get('schema', ''))
+
+# 创建自定义超时设置
+def make_timeout() -> ClientTimeout:
+    return ClientTimeout(
         total=10*60,  # 总超时时间（秒）
         connect=10*60,  # 连接超时（秒）
         sock_connect=10*60,  # 套接字连接超时（秒）
         sock_read=10*60  # 套接字读取超时（秒）
     )
-    async with aiohttp.ClientSession(timeout=timeout) as session:
-        # 创建所有任务
-        tasks = [process_single_item(item, session) for item in input_list]
-        # 等待所有任务完成
-        results = await asyncio.gather(*tasks)
+
+# 自适应并发窗口（AIMD）：延迟正常时加性增长，过载时乘性下降
+class AdaptiveLimiter:
+    def __init__(self, initial: int, max_limit: int, min_limit: int = 1, tolerance: float = 2.0, backoff_ratio: float = 0.7):
+        """
+        Args:
+            initial: 初始窗口
+            max_limit: 窗口上限（即 --concurrency）
+            min_limit: 窗口下限
+            tolerance: 平滑延迟超过历史最低平滑延迟的多少倍视为排队过载
+            backoff_ratio: 过载时窗口乘以该系数
+        """
+        self.limit = float(min(initial, max_limit))
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.tolerance = tolerance
+        self.backoff_ratio = backoff_ratio
+        self.latency_ewma = None  # 平滑延迟
+        self.best_latency = None  # 本次运行中平滑延迟的最低值，作为无排队时的基线
+        self.last_decrease = 0.0
+
+    def window(self) -> int:
+        return int(self.limit)
+
+    def on_success(self, latency: float, n: int = 1):
+        self.latency_ewma = latency if self.latency_ewma is None else 0.9 * self.latency_ewma + 0.1 * latency
+        if self.best_latency is None or self.latency_ewma < self.best_latency:
+            self.best_latency = self.latency_ewma
+        if self.latency_ewma > self.tolerance * self.best_latency:
+            self.decrease()
+        else:
+            # 每完成约一个窗口的采样，窗口 +1
+            self.limit = min(self.max_limit, self.limit + n / self.limit)
+
+    def on_overload(self):
+        """超时、5xx、连接中断"""
+        self.decrease()
+
+    def decrease(self):
+        # 同一批在途请求的信号只响应一次：两次下降之间至少间隔一个平滑延迟
+        now = time.monotonic()
+        if now - self.last_decrease < (self.latency_ewma or 0.0):
+            return
+        self.last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+
+# 单个推理服务端点：独立连接池，在途数不超过自身并发
+class Endpoint:
+    def __init__(self, url: str, concurrency: int, limiter: Optional[AdaptiveLimiter] = None):
+        self.url = url
+        self.concurrency = concurrency
+        self.limiter = limiter  # 为None时窗口固定为concurrency
+        self.outstanding = 0
+        self.failures = 0  # 连续失败次数
+        self.ejected_until = 0.0  # 大于当前时间表示被摘除
+        self.session = None
+        self.stats = collections.Counter()
+
+    async def open(self):
+        # 连接池大小与并发一致，aiohttp默认limit=100会悄悄卡住更高的并发
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.concurrency)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=make_timeout())
+
+    def window(self) -> int:
+        return self.limiter.window() if self.limiter else self.concurrency
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+# 多端点负载均衡：按最少在途请求分发，连续失败摘除，定时放一条探测请求
+class EndpointPool:
+    def __init__(self, urls: List[str], concurrency: int, eject_after: int = 5, probe_interval: float = 30.0,
+                 adaptive: bool = False, initial_concurrency: int = 32):
+        """
+        Args:
+            urls: 端点URL列表
+            concurrency: 每个端点的并发上限（总窗口 = 端点数 * concurrency）
+            eject_after: 连续多少次可重试错误（5xx/超时/连接中断）后摘除
+            probe_interval: 摘除后多久放一条探测请求，成功即恢复
+            adaptive: 每个端点用 AdaptiveLimiter 在 [1, concurrency] 内自动调整窗口
+            initial_concurrency: 自适应窗口的初始值
+        """
+        self.endpoints = [
+            Endpoint(url, concurrency, AdaptiveLimiter(initial_concurrency, concurrency) if adaptive else None)
+            for url in urls
+        ]
+        self.eject_after = eject_after
+        self.probe_interval = probe_interval
+
+    async def __aenter__(self):
+        for ep in self.endpoints:
+            await ep.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        for ep in self.endpoints:
+            await ep.close()
+
+    def pick(self, prefer: Optional[Endpoint] = None) -> Optional[Endpoint]:
+        """选出在途比例最低的可用端点；prefer还有空位时优先选它；被摘除的端点到期后只放行一条探测请求"""
+        now = time.monotonic()
+        candidates = []
+        for ep in self.endpoints:
+            if ep.ejected_until > now:
+                continue
+            limit = 1 if ep.ejected_until > 0 else ep.window()  # 探测中只放一条
+            if ep.outstanding < limit:
+                candidates.append(ep)
+        if not candidates:
+            return None
+        if prefer in candidates:
+            return prefer
+        return min(candidates, key=lambda ep: ep.outstanding / ep.window())
+
+    def next_probe_at(self) -> Optional[float]:
+        pending = [ep.ejected_until for ep in self.endpoints if ep.ejected_until > time.monotonic()]
+        return min(pending) if pending else None
+
+    def acquire(self, ep: Endpoint, n: int = 1):
+        ep.outstanding += n
+
+    def release(self, ep: Endpoint, n: int, result: Dict[str, Any], latency: float):
+        ep.outstanding -= n
+        if not result['error_str']:
+            if ep.ejected_until > 0:
+                print(f"端点恢复: {ep.url}")
+            ep.failures = 0
+            ep.ejected_until = 0.0
+            ep.stats['ok'] += 1
+            if ep.limiter:
+                ep.limiter.on_success(latency, n)
+            return
+        ep.stats[result['error_class']] += 1
+        if not result['retryable']:
+            return  # 请求本身的问题，不计入端点健康
+        if ep.limiter:
+            ep.limiter.on_overload()
+        ep.failures += 1
+        if ep.failures >= self.eject_after and len(self.endpoints) > 1:  # 只有一个端点时摘除没有意义
+            now = time.monotonic()
+            if ep.ejected_until <= now:  # 新摘除或探测失败，窗口内其他在途请求的失败不重复计数
+                print(f"端点连续失败{ep.failures}次，摘除{self.probe_interval}秒: {ep.url}")
+                ep.stats['ejected'] += 1
+            ep.ejected_until = now + self.probe_interval
+
+    def describe(self) -> str:
+        """各端点当前窗口与在途数，用于运行中的实时输出"""
+        return ', '.join(f'{ep.url} 窗口={ep.window()} 在途={ep.outstanding}' for ep in self.endpoints)
+
+# 端点参数：逗号分隔的字符串或列表
+def parse_urls(url) -> List[str]:
+    if isinstance(url, str):
+        url = url.split(',')
+    return [u.strip() for u in url if u.strip()]
+
+# 流式处理：惰性消费输入，固定窗口的在途请求，完成一条回调一条
+async def process_async_stream(rows: Iterable[Dict[str, Any]], concurrency: int, url, model_name: str,
+                               on_result: Callable[[int, Dict[str, Any], Dict[str, Any]], None],
+                               retry_policy: Optional[Dict[str, Any]] = None, n_per_request: int = 1,
+                               adaptive: bool = False, initial_concurrency: int = 32, report_interval: float = 60.0,
+                               stream: bool = False, stop_condition: Optional[Dict[str, Any]] = None,
+                               sampling: Optional[Dict[str, Any]] = None, cache=None, cache_seed: Optional[int] = None,
+                               metrics=None, metrics_interval: float = 10.0, prefix_lookahead: int = 0,
+                               blocking_input: bool = False) -> Dict[str, Any]:
+    """
+    Args:
+        rows: 输入数据迭代器（可以是惰性生成器，不会被一次性展开），每行有 user_prompt（可选 system_prompt / schema）
+            或直接给出 messages
+        concurrency: 每个端点的在途采样窗口大小（按条数计，n=k的请求占k个名额）
+        url: API端点URL，多个端点用逗号分隔或传列表，按最少在途请求分发
+        model_name: 模型名称
+        on_result: 回调 on_result(idx, row, result)，idx为该行在输入中的序号，result含content/error_str
+        retry_policy: 重试策略，默认 DEFAULT_RETRY_POLICY；可重试的失败按退避时间排到队尾，
+            等待期间不占用窗口，重试耗尽或不可重试时才回调失败结果
+        n_per_request: 相邻的相同prompt最多合并多少条为一个 n=k 请求，1表示每行单独请求
+        adaptive: 按延迟和错误率自动调整每个端点的窗口（AIMD），concurrency作为上限
+        initial_concurrency: 自适应窗口的初始值
+        report_interval: 每隔多少秒打印一次各端点的窗口和在途数
+        stream: 以SSE流式接收响应，统计首token时间(TTFT)和解码速度
+        stop_condition: 流式时的提前终止条件，见 read_sse_response
+        sampling: 采样参数，默认 DEFAULT_SAMPLING
+        cache: 响应缓存（llm_cache.ResponseCache 或SQLite路径），命中的行直接回调，不访问服务端；
+            key包含模型、messages、schema、采样参数和行的 sample_idx
+        cache_seed: 指定后每个请求带 seed = cache_seed + 组内首行sample_idx，使结果可复现，seed同时参与缓存key
+        metrics: 运行指标（client_metrics.RolloutMetrics 或文件前缀），传前缀时每 metrics_interval 秒
+            重写 {前缀}.json 和 {前缀}.prom；默认只在内存中统计
+        metrics_interval: 指标文件的重写间隔（秒）
+        prefix_lookahead: 大于1时每次预读这么多组、按prompt排序后发出，并把同一prompt的请求尽量发到同一端点，
+            提高服务端前缀缓存命中（命中率见指标中的 prefix_cache_hit_rate）；预读的组驻留内存
+        blocking_input: rows的next()可能阻塞（如从上游阶段的队列读取）时设为True，取数放到线程池中，
+            等待输入期间在途请求照常完成和回调
+
+    Returns:
+        统计信息 {'total', 'retries': {类别: 次数}, 'failed': {类别: 条数}, 'endpoints': {url: {类别: 次数}},
+                 'metrics': 指标快照（延迟分位数、token吞吐、按状态的响应数）}
+    """
+    policy = dict(DEFAULT_RETRY_POLICY, **(retry_policy or {}))
+    sampling = dict(sampling or DEFAULT_SAMPLING)
+    own_cache = isinstance(cache, str)
+    if own_cache:
+        cache = ResponseCache(cache)
+    if cache is not None:
+        rows = assign_sample_idx(rows)
+    if not isinstance(metrics, RolloutMetrics):
+        metrics = RolloutMetrics(metrics, interval=metrics_interval)
+    group_iter = order_by_prefix(group_rows(enumerate(rows), n_per_request), prefix_lookahead)
+    affinity = collections.OrderedDict()  # prompt -> 上次发往的端点，只保留最近的条目
+    exhausted = False
+    in_flight = {}  # task -> (group, attempt, endpoint, 发出时间)
+    retry_queue = collections.deque()  # (ready_at, group, attempt)，按入队顺序排在队尾
+    stats = {'total': 0, 'retries': collections.Counter(), 'failed': collections.Counter()}
+    if stream:
+        stats['stream'] = collections.Counter()
+
+    last_report = time.monotonic()
+    fetch = None  # blocking_input时正在线程池中执行的 next(group_iter)
+    loop = asyncio.get_running_loop()
+
+    def row_cache_key(row):
+        return make_cache_key(model_name, row_messages(row), row.get('schema', ''),
+                              sampling, sample_idx=row['sample_idx'], seed=cache_seed,
+                              stop_condition=stop_condition if stream else None)
+
+    # 缓存的读写在单独的线程中串行执行，SQLite等待其他进程的写锁时不阻塞事件循环
+    cache_io = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix='rollout-cache') if cache is not None else None
+    cache_errors = []
+
+    def check_cache_write(future):
+        if future.exception() is not None:
+            cache_errors.append(future.exception())
+
+    async def serve_from_cache(group):
+        """命中缓存的行直接回调，返回未命中的行"""
+        misses = []
+        keys = [row_cache_key(row) for _, row in group]
+        contents = await loop.run_in_executor(cache_io, lambda: [cache.get(key) for key in keys])
+        for (idx, row), content in zip(group, contents):
+            if content is None:
+                misses.append((idx, row))
+                continue
+            on_result(idx, row, {'content': content, 'error_str': '', 'cached': True})
+            stats['total'] += 1
+            metrics.on_rows(1, cached=True)
+        return misses
+
+    async with EndpointPool(parse_urls(url), concurrency, adaptive=adaptive, initial_concurrency=initial_concurrency) as pool:
+        while True:
+            # 补满窗口：先发退避已到期的重试，再从输入取新行；只有在途的行会驻留内存
+            while True:
+                ep = pool.pick()
+                if ep is None:
+                    break
+                if retry_queue and retry_queue[0][0] <= time.monotonic():
+                    _, group, attempt = retry_queue.popleft()
+                elif not exhausted:
+                    if blocking_input:
+                        if fetch is None:
+                            fetch = loop.run_in_executor(None, next, group_iter, None)
+                        if not fetch.done():
+                            break
+                        group, fetch = fetch.result(), None
+                        if group is None:
+                            exhausted = True
+                            continue
+                    else:
+                        try:
+                            group = next(group_iter)
+                        except StopIteration:
+                            exhausted = True
+                            continue
+                    attempt = 0
+                    if cache is not None:
+                        group = await serve_from_cache(group)
+                        if not group:
+                            continue
+                else:
+                    break
+                if prefix_lookahead > 1 and len(pool.endpoints) > 1:
+                    key = prefix_key(group[0][1])
+                    ep = pool.pick(prefer=affinity.pop(key, None))
+                    affinity[key] = ep
+                    if len(affinity) > 4096:
+                        affinity.popitem(last=False)
+                pool.acquire(ep, len(group))
+                metrics.on_dispatch(len(group))
+                request_sampling = sampling
+                if cache_seed is not None:
+                    request_sampling = dict(sampling, seed=cache_seed + group[0][1]['sample_idx'])
+                task = asyncio.ensure_future(request_one(group[0][1], ep.session, ep.url, model_name, n=len(group),
+                                                         stream=stream, stop_condition=stop_condition, sampling=request_sampling))
+                in_flight[task] = (group, attempt, ep, time.monotonic())
+
+            if not in_flight and not retry_queue and exhausted:
+                break
+
+            # 没有请求完成时，也要在下一条重试到期或下一次端点探测时醒来
+            wake_times = [t for t in (retry_queue[0][0] if retry_queue else None, pool.next_probe_at(), metrics.next_write_at())
+                          if t is not None]
+            wait_timeout = max(0.0, min(wake_times) - time.monotonic()) if wake_times else None
+            waitables = set(in_flight) | ({fetch} if fetch is not None else set())
+            if not waitables:
+                await asyncio.sleep(wait_timeout or 0.0)
+                continue
+            done, _ = await asyncio.wait(waitables, timeout=wait_timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task is fetch:
+                    continue
+                group, attempt, ep, sent_at = in_flight.pop(task)
+                results = task.result()
+                pool.release(ep, len(group), results[0], time.monotonic() - sent_at)
+                metrics.on_complete(len(group), time.monotonic() - sent_at, results[0])
+                if results[0]['error_str'] and results[0]['retryable'] and attempt < policy['max_retries']:
+                    # 整组一起重试
+                    stats['retries'][results[0]['error_class']] += 1
+                    retry_queue.append((time.monotonic() + backoff_delay(policy, attempt), group, attempt + 1))
+                    continue
+                if stream and 'timing' in results[0]:
+                    timing = results[0]['timing']
+                    stats['stream']['requests'] += 1
+                    stats['stream']['ttft'] += timing['ttft']
+                    stats['stream']['decode_time'] += timing['decode_time']
+                    stats['stream']['completion_tokens'] += timing['completion_tokens']
+                    stats['stream']['early_stopped'] += timing['early_stopped']
+                for (idx, row), result in zip(group, results):
+                    if result['error_str']:
+                        stats['failed'][result['error_class']] += 1
+                    elif cache is not None:
+                        cache_io.submit(cache.put, row_cache_key(row), result['content']).add_done_callback(check_cache_write)
+                    on_result(idx, row, result)
+                    stats['total'] += 1
+                metrics.on_rows(len(group))
+
+            update_gauges(metrics, pool, retry_queue, cache)
+            metrics.maybe_write()
+            if time.monotonic() - last_report >= report_interval:
+                last_report = time.monotonic()
+                lat = metrics.latency.summary()
+                print(f"[{time.strftime('%H:%M:%S')}] 已完成{stats['total']}条 | 延迟p50/p95/p99 "
+                      f"{lat['p50']:.1f}/{lat['p95']:.1f}/{lat['p99']:.1f}秒 | {pool.describe()}")
+
+        if cache is not None:
+            # 等待排队中的写入完成
+            await loop.run_in_executor(cache_io, cache.flush)
+            cache_io.shutdown()
+            if cache_errors:
+                raise cache_errors[0]
+            stats['cache'] = dict(cache.stats, hit_rate=cache.hit_rate())
+            if own_cache:
+                cache.close()
+        stats['endpoints'] = {}
+        for ep in pool.endpoints:
+            stats['endpoints'][ep.url] = dict(ep.stats, window=ep.window()) if ep.limiter else dict(ep.stats)
+        update_gauges(metrics, pool, retry_queue, None)
+    metrics.maybe_write(force=True)
+    stats['metrics'] = metrics.snapshot()
+    return stats
+
+# 指标中的瞬时量：每个端点的在途数和窗口、等待重试的组数、缓存命中率
+def update_gauges(metrics: RolloutMetrics, pool: EndpointPool, retry_queue, cache):
+    for ep in pool.endpoints:
+        metrics.set_gauge(f'rollout_endpoint_outstanding{{url="{ep.url}"}}', ep.outstanding)
+        metrics.set_gauge(f'rollout_endpoint_window{{url="{ep.url}"}}', ep.window())
+    metrics.set_gauge('rollout_retry_queue', len(retry_queue))
+    if cache is not None:
+        metrics.set_gauge('rollout_cache_hit_rate', cache.hit_rate())
+
+# 汇总信息：按错误类别统计重试次数和最终失败条数
+def format_stats(stats: Dict[str, Any]) -> str:
+    lines = [f"完成{stats['total']}条，最终失败{sum(stats['failed'].values())}条"]
+    for error_class, count in sorted(stats['retries'].items()):
+        lines.append(f"  重试 {error_class}: {count}次")
+    for error_class, count in sorted(stats['failed'].items()):
+        lines.append(f"  失败 {error_class}: {count}条")
+    if stats.get('stream', {}).get('requests'):
+        st = stats['stream']
+        lines.append(f"  流式: 平均TTFT {st['ttft'] / st['requests']:.3f}秒, "
+                     f"单请求解码速度 {st['completion_tokens'] / max(st['decode_time'], 1e-9):.1f} token/秒, "
+                     f"提前终止 {st['early_stopped']}个请求")
+    if 'cache' in stats:
+        cs = stats['cache']
+        lines.append(f"  缓存: 命中{cs['hits']}条, 未命中{cs['misses']}条, 命中率{cs['hit_rate']:.2%}, 写入{cs['writes']}条, 淘汰{cs['evicted']}条")
+    endpoints = stats.get('endpoints', {})
+    if len(endpoints) > 1 or any('window' in ep_stats for ep_stats in endpoints.values()):
+        for url, ep_stats in endpoints.items():
+            lines.append(f"  端点 {url}: " + ', '.join(f'{k}={v}' for k, v in sorted(ep_stats.items())))
+    if stats.get('metrics', {}).get('requests'):
+        lines.append(format_metrics(stats['metrics']))
+    return '\n'.join(lines)
+
+# 异步批处理请求，单条请求返回结果后处理，超时设置
+async def process_async_batch(input_list: List[Dict[str, Any]], concurrency: int, url: str, model_name: str,
+                              **engine_options) -> List[Dict[str, Any]]:
+    """
+    Args:
+        input_list: 输入数据列表
+        concurrency: 并发限制
+        url: API端点URL
+        model_name: 模型名称
+        engine_options: 透传给 process_async_stream 的选项（retry_policy / n_per_request 等）
         
+    Returns:
+        处理结果列表，与input_list一一对应
+    """
+    results = [None] * len(input_list)
+
+    def collect(idx, row, result):
+        results[idx] = result
+
+    stats = await process_async_stream(input_list, concurrency, url, model_name, collect, **engine_options)
+    if stats['retries'] or stats['failed']:
+        print(format_stats(stats))
     return results
 
 # 异步主函数，控制并发数量
-async def async_main(data_list: List[Dict[str, Any]], url: str, model_name: str, concurrency: int):
-
-    messages = [{'user_prompt': item['user_prompt'], 'schema': item.get('schema', ''), 'system_prompt': item.get('system_prompt', '')} for item in data_list]  # get ori question
-    
-    # print(f'--------------------------------   one sample  --------------------------------')
-    # print(json.dumps(messages[0], indent=4, ensure_ascii=False))
+async def async_main(data_list: List[Dict[str, Any]], url: str, model_name: str, concurrency: int, **engine_options):
 
-    # 使用异步处理批量请求
+    # 直接在原始数据上发请求，不再额外复制一份messages
     results = await process_async_batch(
-        input_list=messages,
+        input_list=data_list,
         concurrency=concurrency,
         url=url,
-        model_name=model_name
+        model_name=model_name,
+        **engine_options
     )
 
-    # print(f'--------------------------------   one sample output  --------------------------------')
-    # print(json.dumps(results[0], indent=4, ensure_ascii=False))
-
     # 保存结果
     for item, result in zip(data_list, results):
         item['llm_output'] = result['content']
@@ -163,6 +807,171 @@ async def async_main(data_list: List[Dict[str, Any]], url: str, model_name: str,
     
     return data_list
 
+# 读取rollout输入，兼容两种格式：
+# 1. 逐行展开的旧格式，每个副本一行，原样产出
+# 2. PreRollout的compact计划：首行 {"plan_version", "schemas"}，之后每个题目一行并带 expand_count / schema_ref，
+#    在这里按需展开为 expand_count 行（sample_idx 为副本序号），schema 对象在所有副本间共享
+def iter_plan_rows(path: str) -> Iterator[Dict[str, Any]]:
+    records = io_tools.iter_jsonl(path)
+    first = next(records, None)
+    if first is None:
+        return
+    if 'plan_version' not in first:
+        yield first
+        yield from records
+        return
+    schemas = first.get('schemas', {})
+    for record in records:
+        expand_count = record.pop('expand_count', 1)
+        schema_ref = record.pop('schema_ref', None)
+        if schema_ref is not None:
+            record['schema'] = schemas[schema_ref]
+        for copy_idx in range(expand_count):
+            row = dict(record)
+            row['sample_idx'] = copy_idx
+            yield row
+
+# 稳定的请求id：行号 + prompt内容哈希，输入文件不变则id不变
+def make_request_id(idx: int, row: Dict[str, Any]) -> str:
+    if row.get('request_id'):
+        return row['request_id']
+    key = json.dumps([row.get('system_prompt', ''), row['user_prompt']], ensure_ascii=False)
+    return f'{idx}-{hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]}'
+
+# 完成日志：每条结果落盘后追加一行，用于断点续跑
+class RolloutJournal:
+    """journal.jsonl 只追加不改写，每行 {"request_id", "row_idx", "ok"}，同一id以最后一条为准"""
+
+    def __init__(self, output_dir: str, resume: bool = False):
+        self.path = f'{output_dir}/journal.jsonl'
+        self.done = self.load_done(self.path) if resume else {}
+        if resume:
+            io_tools.truncate_partial_line(self.path)
+        self.f = open(self.path, 'a' if resume else 'w')
+
+    @staticmethod
+    def load_done(path: str) -> Dict[str, int]:
+        """返回已成功完成的 request_id -> row_idx"""
+        done = {}
+        if not os.path.exists(path):
+            return done
+        # 被中断时可能写了一半的行，跳过
+        for record in io_tools.iter_jsonl(path, on_error=lambda line, e: None):
+            if record['ok']:
+                done[record['request_id']] = record['row_idx']
+            else:
+                done.pop(record['request_id'], None)
+        return done
+
+    def record(self, item: Dict[str, Any]):
+        ok = not item['error_info']
+        self.f.write(json.dumps({'request_id': item['request_id'], 'row_idx': item['row_idx'], 'ok': ok}) + '\n')
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+# 按行号分片写出，结果完成即落盘
+class ShardWriter:
+    """第idx行写入 batch_{idx // shard_size}.jsonl，分片写满即关闭文件句柄"""
+
+    def __init__(self, output_dir: str, shard_size: int = 500, resume: bool = False, done_counts: Optional[Dict[int, int]] = None):
+        self.output_dir = output_dir
+        self.shard_size = shard_size
+        self.resume = resume
+        self.files = {}
+        self.counts = dict(done_counts or {})
+
+    def shard_path(self, shard_id: int) -> str:
+        return f'{self.output_dir}/batch_{shard_id}.jsonl'
+
+    def write(self, idx: int, item: Dict[str, Any]):
+        shard_id = idx // self.shard_size
+        if shard_id not in self.files:
+            # 续跑时追加到已有分片，结束后再统一去重
+            if self.resume:
+                io_tools.truncate_partial_line(self.shard_path(shard_id))
+            self.files[shard_id] = open(self.shard_path(shard_id), 'ab' if self.resume else 'wb')
+            self.counts.setdefault(shard_id, 0)
+        f = self.files[shard_id]
+        f.write(io_tools.dumps_bytes(item) + b'\n')
+        f.flush()
+        self.counts[shard_id] += 1
+        if self.counts[shard_id] == self.shard_size:
+            f.close()
+
+    def close(self):
+        for f in self.files.values():
+            if not f.closed:
+                f.close()
+
+    def compact(self, shard_ids: Iterable[int]):
+        """续跑后分片里可能有同一id的失败记录和重跑记录，保留每个id的最后一条并按row_idx排序"""
+        for shard_id in shard_ids:
+            path = self.shard_path(shard_id)
+            if not os.path.exists(path):
+                continue
+            latest = {}
+            for item in io_tools.iter_jsonl(path, on_error=lambda line, e: None):
+                latest[item['request_id']] = item
+            tmp_path = path + '.tmp'
+            io_tools.write_jsonl(tmp_path, sorted(latest.values(), key=lambda x: x['row_idx']))
+            os.replace(tmp_path, path)
+
+# 流式rollout：惰性读取输入，结果完成即按行号写入对应分片
+async def stream_rollout(input_file: str, output_dir: str, url: str, model_name: str = '', concurrency: int = 500,
+                         shard_size: int = 500, resume: bool = False, **engine_options) -> Dict[str, Any]:
+    """
+    输入可以是逐行展开的jsonl或PreRollout的compact计划（见 iter_plan_rows），按展开后的行号计。
+    输出分片与原批处理一致：第i个分片为第 [i*shard_size, (i+1)*shard_size) 行，
+    分片内按完成顺序写入，每行带 row_idx / request_id 字段用于恢复原始顺序。
+    resume=True 时跳过journal中已成功的请求，只重发缺失或失败(error_info非空)的行。
+    engine_options 透传给 process_async_stream（retry_policy / n_per_request 等）。
+
+    Returns:
+        统计信息，见 process_async_stream，另含输入总行数 rows
+    """
+    if resume and not os.path.exists(f'{output_dir}/journal.jsonl'):
+        print(f"未找到 {output_dir}/journal.jsonl，按全新任务处理")
+        resume = False
+    journal = RolloutJournal(output_dir, resume=resume)
+    done_counts = {}
+    for row_idx in journal.done.values():
+        done_counts[row_idx // shard_size] = done_counts.get(row_idx // shard_size, 0) + 1
+    writer = ShardWriter(output_dir, shard_size, resume=resume, done_counts=done_counts)
+    seen = {'rows': 0, 'skipped': 0}
+
+    def pending_rows():
+        # sample_idx 在跳过已完成行之前标注，续跑时与首次运行一致
+        for idx, row in enumerate(assign_sample_idx(iter_plan_rows(input_file))):
+            seen['rows'] = idx + 1
+            request_id = make_request_id(idx, row)
+            if request_id in journal.done:
+                seen['skipped'] += 1
+                continue
+            row['row_idx'] = idx
+            row['request_id'] = request_id
+            yield row
+
+    def on_result(idx, row, result):
+        row['llm_output'] = result['content']
+        row['error_info'] = result['error_str']
+        if 'timing' in result:
+            row['timing'] = result['timing']
+        writer.write(row['row_idx'], row)
+        journal.record(row)
+
+    try:
+        stats = await process_async_stream(pending_rows(), concurrency, url, model_name, on_result, **engine_options)
+    finally:
+        writer.close()
+        journal.close()
+
+    if resume:
+        print(f"续跑：跳过已完成{seen['skipped']}条，重发{seen['rows'] - seen['skipped']}条")
+        writer.compact(range((seen['rows'] + shard_size - 1) // shard_size))
+    stats['rows'] = seen['rows']
+    return stats
 
 """
 interface function
@@ -174,80 +983,88 @@ Args:
             'system_prompt': '',  # 可选
             'schema': SolveDict.model_json_schema()  # 可选
         }]
-    url: API端点URL
+    url: API端点URL，多个端点用逗号分隔或传列表，concurrency为每个端点的并发
     model_name: 模型名称，默认''
+    engine_options: 透传给 process_async_stream
+        retry_policy: 重试策略，默认 DEFAULT_RETRY_POLICY
+        n_per_request: 相邻的相同prompt最多合并多少条为一个 n=k 请求，默认1
+        adaptive: 按延迟和错误率自动调整并发窗口，concurrency作为上限
+        stream / stop_condition: SSE流式接收与提前终止条件
+        sampling: 采样参数，默认 DEFAULT_SAMPLING
+        cache / cache_seed: 响应缓存（SQLite路径）及可选的固定种子
+        metrics / metrics_interval: 运行指标文件前缀及重写间隔，默认只在内存中统计
+        prefix_lookahead: 预读并按prompt排序的组数，提高服务端前缀缓存命中
 """
-def get_llm_outputs(data_list: List[Dict[str, Any]], url: str='http://10.202.2.46:7373/v1/chat/completions', model_name: str='', concurrency: int = 500):
-    return asyncio.run(async_main(data_list, url, model_name, concurrency))
+def get_llm_outputs(data_list: List[Dict[str, Any]], url: str='http://10.202.2.46:7373/v1/chat/completions', model_name: str='', concurrency: int = 500,
+                    **engine_options):
+    return asyncio.run(async_main(data_list, url, model_name, concurrency, **engine_options))
 
 if __name__ == "__main__":
-    from async_client_sglang import get_llm_outputs
-    import json
-
     parser = argparse.ArgumentParser()
     parser.add_argument('--input_file', type=str, default='/mnt/new_pfs/liming_team/auroraX/mxd/a_x1/data/Test/comp-math-24-25-rollout.jsonl')
     parser.add_argument('--output_dir', type=str, default='/mnt/new_pfs/liming_team/auroraX/mxd/a_x1/TestRes/Merge14BBase0528')
-    parser.add_argument('--batch_size', type=int, default=8)
-    parser.add_argument('--llm_url', type=str, default='http://10.204.23.16:7373/v1/chat/completions')
+    parser.add_argument('--batch_size', type=int, default=8, help='至少输出的分片文件数（不足时补空文件），不再限制处理的数据量')
+    parser.add_argument('--shard_size', type=int, default=500, help='每个输出分片 batch_{i}.jsonl 的行数')
+    parser.add_argument('--llm_url', type=str, default='http://10.204.23.16:7373/v1/chat/completions', help='多个端点用逗号分隔')
+    parser.add_argument('--concurrency', type=int, default=500, help='每个端点的在途采样窗口大小')
+    parser.add_argument('--resume', action='store_true', help='断点续跑：跳过journal中已完成的请求')
+    parser.add_argument('--max_retries', type=int, default=DEFAULT_RETRY_POLICY['max_retries'], help='可重试错误(5xx/超时/连接中断)的最大重试次数')
+    parser.add_argument('--retry_base_delay', type=float, default=DEFAULT_RETRY_POLICY['base_delay'], help='首次重试退避上限（秒）')
+    parser.add_argument('--retry_max_delay', type=float, default=DEFAULT_RETRY_POLICY['max_delay'], help='重试退避上限（秒）')
+    parser.add_argument('--adaptive', action='store_true', help='按延迟/错误率自动调整每个端点的并发窗口（AIMD），--concurrency作为上限')
+    parser.add_argument('--initial_concurrency', type=int, default=32, help='自适应并发窗口的初始值')
+    parser.add_argument('--sse', action='store_true', help='以SSE流式接收响应，记录TTFT和解码速度，支持提前终止')
+    parser.add_argument('--early_stop_json', action='store_true', help='流式时输出的JSON对象闭合即断开（需--sse）')
+    parser.add_argument('--stop_strings', type=str, default='', help='流式时出现任一字符串即断开，多个用 || 分隔（需--sse）')
+    parser.add_argument('--max_output_chars', type=int, default=0, help='流式时输出超过该字符数即断开，0表示不限（需--sse）')
+    parser.add_argument('--cache_path', type=str, default='', help='响应缓存SQLite文件，命中的行不再请求服务端；为空不启用')
+    parser.add_argument('--cache_max_gb', type=float, default=10, help='响应缓存大小上限（GB），超过后按最近访问淘汰')
+    parser.add_argument('--cache_seed', type=int, default=None, help='指定后请求带固定seed（按sample_idx偏移），结果可复现并参与缓存key')
+    parser.add_argument('--metrics_path', type=str, default='', help='运行指标文件前缀，定期重写 {前缀}.json 和 {前缀}.prom；默认 {output_dir}/metrics')
+    parser.add_argument('--metrics_interval', type=float, default=10, help='运行指标文件的重写间隔（秒）')
+    parser.add_argument('--prefix_lookahead', type=int, default=0, help='预读多少组请求按prompt排序后发出，并按prompt粘滞到端点以提高前缀缓存命中；0表示按输入顺序')
+    parser.add_argument('--n_per_request', type=int, default=1, help='相邻的相同prompt合并为一个 n=k 请求，k超过该值时拆成多块；1表示每行单独请求')
     args = parser.parse_args()
     
     INPUT_FILE = args.input_file
     LLM_URL = args.llm_url
     OUTPUT_DIR = args.output_dir
+    STOP_CONDITION = {
+        'json_closed': args.early_stop_json,
+        'stop_strings': [x for x in args.stop_strings.split('||') if x],
+        'max_chars': args.max_output_chars,
+    }
+    CACHE = ResponseCache(args.cache_path, max_bytes=int(args.cache_max_gb * 1024 ** 3)) if args.cache_path else None
+    ENGINE_OPTIONS = {
+        'cache': CACHE,
+        'cache_seed': args.cache_seed,
+        'n_per_request': args.n_per_request,
+        'adaptive': args.adaptive,
+        'initial_concurrency': args.initial_concurrency,
+        'stream': args.sse,
+        'stop_condition': STOP_CONDITION,
+        'metrics': args.metrics_path or os.path.join(OUTPUT_DIR, 'metrics'),
+        'metrics_interval': args.metrics_interval,
+        'prefix_lookahead': args.prefix_lookahead,
+    }
+    RETRY_POLICY = {
+        'max_retries': args.max_retries,
+        'base_delay': args.retry_base_delay,
+        'max_delay': args.retry_max_delay,
+    }
 
-    with open(INPUT_FILE, 'r') as f:
-        data_list = [json.loads(line) for line in f]
-
-    
-    batch_size = args.batch_size
-    total_items = len(data_list)
-    
-    # 按照最大500条进行分批
-    max_batch_size = 500
-    
-    # 计算每批的数量
-    batches = []
-    for i in range(batch_size):
-        start = i * max_batch_size
-        end = min((i + 1) * max_batch_size, total_items)
-        
-        # 如果start已经超过总数据量，则为空批次
-        if start >= total_items:
-            batches.append((0, 0))
-        else:
-            batches.append((start, end))
-    
-    # 输出批次分配信息
-    non_empty_batches = [(i, start, end) for i, (start, end) in enumerate(batches) if start != end]
-    empty_batches = [i for i, (start, end) in enumerate(batches) if start == end]
-    
-    print(f"总数据量：{total_items}条，最大批次大小：{max_batch_size}条")
-    print(f"分配到{len(non_empty_batches)}个非空批次，{len(empty_batches)}个空批次")
-    for i, start, end in non_empty_batches:
-        print(f"  批次{i+1}: {start}-{end} ({end-start}条)")
-    if empty_batches:
-        print(f"  空批次: {[i+1 for i in empty_batches]}")
-    
-    for i, (start, end) in enumerate(batches):
-        if start == end:
-            # 处理空批次
-            print(f"第{i+1}批为空批次，跳过处理...")
-            output_file = f'{OUTPUT_DIR}/batch_{i}.jsonl'
-            # 创建空文件
-            with open(output_file, 'w') as f:
-                pass  # 创建空文件
-            continue
-            
-        # 执行多进程处理
-        print(f"开始多进程处理第{i+1}批数据...({start}到{end}，共{end-start}条)")
-        start_time = time.time()
-        cur_batch = data_list[start:end]
-        tmp_res = get_llm_outputs(cur_batch, url=LLM_URL)
-        end_time = time.time()
-        print(f"多进程处理完成，耗时：{end_time - start_time:.2f}秒")
-        
-        print("保存结果...")
-        output_file = f'{OUTPUT_DIR}/batch_{i}.jsonl'
-        with open(output_file, 'w') as f:
-            for item in tqdm(tmp_res, desc="保存进度", ncols=100):
-                f.write(json.dumps(item, ensure_ascii=False) + '\n')
+    # 整个数据集只有一个调度器：窗口持续补满，不在分片边界等待最慢的请求；
+    # 输出按行号分片，与请求调度顺序无关
+    print(f"开始处理: {INPUT_FILE} -> {OUTPUT_DIR}/batch_*.jsonl (每分片{args.shard_size}条，每端点并发窗口{args.concurrency})")
+    start_time = time.time()
+    stats = asyncio.run(stream_rollout(INPUT_FILE, OUTPUT_DIR, LLM_URL, concurrency=args.concurrency, shard_size=args.shard_size,
+                                       resume=args.resume, retry_policy=RETRY_POLICY, **ENGINE_OPTIONS))
+    total_items = stats['rows']
+    num_shards = (total_items + args.shard_size - 1) // args.shard_size
+    # 保持至少batch_size个分片文件，兼容下游按文件数检查的逻辑
+    for i in range(num_shards, args.batch_size):
+        open(f'{OUTPUT_DIR}/batch_{i}.jsonl', 'w').close()
+    print(f"处理完成，共{total_items}条，{max(num_shards, args.batch_size)}个分片，耗时：{time.time() - start_time:.2f}秒")
+    print(format_stats(stats))
+    if CACHE is not None:
+        CACHE.close()
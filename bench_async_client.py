@@ -0,0 +1,150 @@
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import resource
+import tempfile
+import subprocess
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, List, Iterator
+
+from async_client_sglang import process_async_stream, stream_rollout
+import io_tools
+
+# 客户端压测：本地启动 mock_openai_server.py，用 async_client_sglang 的调度器驱动，
+# 报告 请求/秒、条/秒、延迟分位数和峰值内存，用于在笔记本上发现客户端吞吐的回退
+# 每个场景：mock服务的参数 + 客户端的参数
+SCENARIOS = {
+    'baseline': {'server': {}, 'client': {}},
+    'n_grouping': {'server': {}, 'client': {'n_per_request': 8}},
+    'sse': {'server': {}, 'client': {'stream': True}},
+    'errors': {'server': {'error_rate': 0.1}, 'client': {'retry_policy': {'base_delay': 0.01, 'max_delay': 0.1}}},
+    'adaptive': {'server': {'capacity': 64}, 'client': {'adaptive': True}},
+}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_mock_server(port: int, server_config: Dict[str, Any]) -> subprocess.Popen:
+    """mock服务放在单独进程，避免和被测客户端抢同一个事件循环"""
+    cmd = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mock_openai_server.py'), '--port', str(port)]
+    for key, value in server_config.items():
+        cmd += [f'--{key}', str(value)]
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f'mock服务启动失败: {proc.stderr.read().decode()}')
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/health', timeout=1)
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError('mock服务启动超时')
+
+
+def make_rows(num_prompts: int, k: int, prompt_chars: int) -> Iterator[Dict[str, Any]]:
+    """num_prompts个题目，每个连续重复k次，与PreRollout的输出形状一致"""
+    for i in range(num_prompts):
+        user_prompt = f'problem {i}: ' + 'x' * prompt_chars
+        for _ in range(k):
+            yield {'question': f'problem {i}', 'answer': str(i), 'user_prompt': user_prompt,
+                   'schema': {'type': 'object', 'properties': {'analysis': {'type': 'string'}, 'final_answer': {'type': 'string'}}}}
+
+
+def run_scenario(name: str, args_dict: Dict[str, Any]) -> Dict[str, Any]:
+    """在子进程里运行一个场景，峰值内存(ru_maxrss)只包含该场景"""
+    scenario = SCENARIOS[name]
+    port = free_port()
+    server = start_mock_server(port, dict(scenario['server'], **json.loads(args_dict['server_overrides'])))
+    url = f'http://127.0.0.1:{port}/v1/chat/completions'
+    options = dict(scenario['client'])
+    try:
+        start = time.perf_counter()
+        if args_dict['end_to_end']:
+            # 经过文件读写的完整路径：输入jsonl -> stream_rollout -> 分片输出
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                input_file = os.path.join(tmp_dir, 'input.jsonl')
+                io_tools.write_jsonl(input_file, make_rows(args_dict['num_prompts'], args_dict['k'], args_dict['prompt_chars']))
+                start = time.perf_counter()
+                stats = asyncio.run(stream_rollout(input_file, tmp_dir, url, concurrency=args_dict['concurrency'],
+                                                   report_interval=1e9, **options))
+        else:
+            rows = make_rows(args_dict['num_prompts'], args_dict['k'], args_dict['prompt_chars'])
+            stats = asyncio.run(process_async_stream(rows, args_dict['concurrency'], url, '', lambda idx, row, result: None,
+                                                     report_interval=1e9, **options))
+        elapsed = time.perf_counter() - start
+    finally:
+        server.kill()
+        server.wait()
+    metrics = stats['metrics']
+    return {
+        'scenario': name,
+        'rows': stats['total'],
+        'failed': sum(stats['failed'].values()),
+        'elapsed': elapsed,
+        'rows_per_s': stats['total'] / elapsed,
+        'requests_per_s': metrics['requests'] / elapsed,
+        'latency_p50': metrics['latency']['p50'],
+        'latency_p95': metrics['latency']['p95'],
+        'latency_p99': metrics['latency']['p99'],
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], tolerance: float) -> List[str]:
+    """和基线结果比较：吞吐下降或p99/内存上升超过tolerance比例即视为回退"""
+    regressions = []
+    for r in results:
+        base = baseline.get(r['scenario'])
+        if base is None:
+            continue
+        if r['rows_per_s'] < base['rows_per_s'] * (1 - tolerance):
+            regressions.append(f"{r['scenario']}: 条/秒 {base['rows_per_s']:.1f} -> {r['rows_per_s']:.1f}")
+        if r['latency_p99'] > base['latency_p99'] * (1 + tolerance):
+            regressions.append(f"{r['scenario']}: p99 {base['latency_p99']:.3f}秒 -> {r['latency_p99']:.3f}秒")
+        if r['peak_rss_mb'] > base['peak_rss_mb'] * (1 + tolerance):
+            regressions.append(f"{r['scenario']}: 峰值内存 {base['peak_rss_mb']:.0f}MB -> {r['peak_rss_mb']:.0f}MB")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='async_client_sglang 客户端压测（本地mock服务）')
+    parser.add_argument('--scenarios', type=str, default=','.join(SCENARIOS), help=f'逗号分隔，可选: {",".join(SCENARIOS)}')
+    parser.add_argument('--num_prompts', type=int, default=500, help='题目数')
+    parser.add_argument('--k', type=int, default=16, help='每个题目的采样数')
+    parser.add_argument('--prompt_chars', type=int, default=2000, help='每个prompt的字符数')
+    parser.add_argument('--concurrency', type=int, default=500, help='客户端每端点并发窗口')
+    parser.add_argument('--server_overrides', type=str, default='{}', help='覆盖所有场景的mock服务参数，JSON格式，如 {"ttft_mean": 0.2}')
+    parser.add_argument('--end_to_end', action='store_true', help='经过输入/输出文件的完整 stream_rollout 路径')
+    parser.add_argument('--output', type=str, default='', help='结果保存为JSON')
+    parser.add_argument('--baseline', type=str, default='', help='之前保存的结果JSON，用于检测回退')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='回退判定的相对阈值')
+    args = parser.parse_args()
+
+    results = []
+    for name in args.scenarios.split(','):
+        # 每个场景一个新进程，保证峰值内存互不影响
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            r = pool.submit(run_scenario, name, vars(args)).result()
+        results.append(r)
+        print(f"{r['scenario']:>12}: {r['rows']}条 {r['elapsed']:.2f}秒 | {r['rows_per_s']:.1f} 条/秒, {r['requests_per_s']:.1f} 请求/秒 | "
+              f"延迟p50/p95/p99 {r['latency_p50']:.3f}/{r['latency_p95']:.3f}/{r['latency_p99']:.3f}秒 | "
+              f"峰值内存 {r['peak_rss_mb']:.0f}MB | 失败{r['failed']}条", flush=True)
+
+    if args.output:
+        io_tools.write_json(args.output, results)
+    if args.baseline:
+        regressions = compare(results, {r['scenario']: r for r in io_tools.read_json(args.baseline)}, args.tolerance)
+        for line in regressions:
+            print(f'回退: {line}')
+        sys.exit(1 if regressions else 0)
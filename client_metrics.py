@@ -0,0 +1,205 @@
+import os
+import json
+import math
+import time
+import collections
+from typing import Dict, Any, Optional
+
+
+# 对数分桶的延迟直方图：内存固定，支持分位数和Prometheus累计桶
+class LatencyHistogram:
+    def __init__(self, min_value: float = 0.001, max_value: float = 3600.0, growth: float = 1.2):
+        """
+        Args:
+            min_value: 第一个桶的上界（秒）
+            max_value: 最大桶的上界（秒），更大的值落入溢出桶
+            growth: 相邻桶上界的比例，决定分位数的相对误差
+        """
+        self.bounds = []
+        bound = min_value
+        while bound < max_value:
+            self.bounds.append(bound)
+            bound *= growth
+        self.bounds.append(max_value)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        if value <= self.bounds[0]:
+            i = 0
+        else:
+            i = min(len(self.bounds), int(math.ceil(math.log(value / self.bounds[0]) / math.log(self.bounds[1] / self.bounds[0]))))
+            # 浮点误差修正，保证 bounds[i-1] < value <= bounds[i]
+            while i < len(self.bounds) and value > self.bounds[i]:
+                i += 1
+            while i > 0 and value <= self.bounds[i - 1]:
+                i -= 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """返回第q分位所在桶的上界"""
+        if self.count == 0:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= target and c:
+                return self.bounds[min(i, len(self.bounds) - 1)]
+        return self.bounds[-1]
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            'count': self.count,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+        }
+
+
+# rollout客户端的运行指标：在途数、延迟分布、token吞吐、按状态的错误数
+class RolloutMetrics:
+    def __init__(self, path: Optional[str] = None, interval: float = 10.0):
+        """
+        Args:
+            path: 指标文件前缀，定期重写 {path}.json 和 {path}.prom（Prometheus文本格式）；为None时只在内存中统计
+            interval: 重写间隔（秒）
+        """
+        self.path = path
+        self.interval = interval
+        self.started_at = time.monotonic()
+        self.last_write = 0.0
+        self.in_flight = 0
+        self.requests = 0
+        self.rows = 0
+        self.cache_hits = 0
+        self.latency = LatencyHistogram()
+        self.ttft = LatencyHistogram()
+        self.tokens = collections.Counter()  # prompt / completion / cached
+        self.status = collections.Counter()  # '200' / 'http_503' / 'timeout' ...
+        self.gauges = {}
+
+    def on_dispatch(self, n: int = 1):
+        self.in_flight += n
+
+    def on_complete(self, n: int, latency: float, result: Dict[str, Any]):
+        """一个请求（n条采样）结束，result为该请求的第一个结果"""
+        self.in_flight -= n
+        self.requests += 1
+        self.latency.observe(latency)
+        if result['error_str']:
+            self.status[str(result.get('status') or result['error_class'])] += 1
+            return
+        self.status['200'] += 1
+        usage = result.get('usage') or {}
+        self.tokens['prompt'] += usage.get('prompt_tokens', 0)
+        # 流式提前终止或服务端未返回usage时，按收到的chunk数估计completion token
+        if 'completion_tokens' in usage:
+            self.tokens['completion'] += usage['completion_tokens']
+        elif 'timing' in result:
+            self.tokens['completion'] += result['timing']['completion_tokens']
+        self.tokens['cached'] += (usage.get('prompt_tokens_details') or {}).get('cached_tokens', 0) or 0
+        if 'timing' in result:
+            self.ttft.observe(result['timing']['ttft'])
+
+    def on_rows(self, n: int = 1, cached: bool = False):
+        self.rows += n
+        if cached:
+            self.cache_hits += n
+
+    def set_gauge(self, name: str, value: float):
+        self.gauges[name] = value
+
+    def snapshot(self) -> Dict[str, Any]:
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+        errors = sum(c for s, c in self.status.items() if s != '200')
+        return {
+            'elapsed': elapsed,
+            'in_flight': self.in_flight,
+            'requests': self.requests,
+            'rows': self.rows,
+            'cache_hits': self.cache_hits,
+            'requests_per_s': self.requests / elapsed,
+            'rows_per_s': self.rows / elapsed,
+            'prompt_tokens_per_s': self.tokens['prompt'] / elapsed,
+            'completion_tokens_per_s': self.tokens['completion'] / elapsed,
+            'tokens': dict(self.tokens),
+            'prefix_cache_hit_rate': self.tokens['cached'] / self.tokens['prompt'] if self.tokens['prompt'] else 0.0,
+            'error_rate': errors / self.requests if self.requests else 0.0,
+            'status': dict(self.status),
+            'latency': self.latency.summary(),
+            'ttft': self.ttft.summary(),
+            'gauges': dict(self.gauges),
+        }
+
+    def maybe_write(self, force: bool = False):
+        if self.path is None:
+            return
+        now = time.monotonic()
+        if not force and now - self.last_write < self.interval:
+            return
+        self.last_write = now
+        snap = self.snapshot()
+        write_atomic(f'{self.path}.json', json.dumps(snap, ensure_ascii=False, indent=2))
+        write_atomic(f'{self.path}.prom', self.to_prometheus(snap))
+
+    def next_write_at(self) -> Optional[float]:
+        return self.last_write + self.interval if self.path is not None else None
+
+    def to_prometheus(self, snap: Dict[str, Any]) -> str:
+        lines = [
+            '# TYPE rollout_in_flight gauge',
+            f'rollout_in_flight {snap["in_flight"]}',
+            '# TYPE rollout_requests_total counter',
+            f'rollout_requests_total {snap["requests"]}',
+            '# TYPE rollout_rows_total counter',
+            f'rollout_rows_total {snap["rows"]}',
+            '# TYPE rollout_cache_hits_total counter',
+            f'rollout_cache_hits_total {snap["cache_hits"]}',
+            '# TYPE rollout_prefix_cache_hit_rate gauge',
+            f'rollout_prefix_cache_hit_rate {snap["prefix_cache_hit_rate"]}',
+            '# TYPE rollout_tokens_total counter',
+        ]
+        for kind, count in sorted(snap['tokens'].items()):
+            lines.append(f'rollout_tokens_total{{kind="{kind}"}} {count}')
+        lines.append('# TYPE rollout_responses_total counter')
+        for status, count in sorted(snap['status'].items()):
+            lines.append(f'rollout_responses_total{{status="{status}"}} {count}')
+        for name, hist in (('rollout_request_latency_seconds', self.latency), ('rollout_ttft_seconds', self.ttft)):
+            lines.append(f'# TYPE {name} histogram')
+            cumulative = 0
+            for bound, count in zip(hist.bounds, hist.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{le="{bound:.6g}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{le="+Inf"}} {hist.count}')
+            lines.append(f'{name}_sum {hist.sum}')
+            lines.append(f'{name}_count {hist.count}')
+        for name, value in sorted(snap['gauges'].items()):
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+# 汇总信息：运行结束时打印
+def format_metrics(snap: Dict[str, Any]) -> str:
+    lat = snap['latency']
+    lines = [
+        f"  请求: {snap['requests']}个, {snap['requests_per_s']:.2f} 请求/秒, {snap['rows_per_s']:.2f} 条/秒, 错误率 {snap['error_rate']:.2%}",
+        f"  延迟: p50 {lat['p50']:.2f}秒, p95 {lat['p95']:.2f}秒, p99 {lat['p99']:.2f}秒",
+        f"  吞吐: prompt {snap['prompt_tokens_per_s']:.1f} token/秒, completion {snap['completion_tokens_per_s']:.1f} token/秒, "
+        f"服务端前缀缓存命中 {snap['prefix_cache_hit_rate']:.2%}",
+    ]
+    if snap['ttft']['count']:
+        lines.append(f"  TTFT: p50 {snap['ttft']['p50']:.3f}秒, p95 {snap['ttft']['p95']:.3f}秒, p99 {snap['ttft']['p99']:.3f}秒")
+    lines.append('  状态: ' + ', '.join(f'{s}={c}' for s, c in sorted(snap['status'].items())))
+    return '\n'.join(lines)
+
+
+def write_atomic(path: str, text: str):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
@@ -0,0 +1,294 @@
+import re
+import ast
+import math
+from typing import Any, List, Optional, Tuple
+
+# 规则判等：在调用LLM判定之前，用确定性的LaTeX归一化和数值比较处理简单情形
+# 规则与 evaluate_2_equiv.get_eval_prompt 一致：忽略排版/空格/\left\right/多余的+号，
+# 区间比较端点与开闭，集合（显式的 \{...\}）忽略顺序并去重，∞ / \infty / +∞ 视为同一对象
+# 只有两边都能完整解析且类型相同时才给出 True/False，否则返回 None 交给LLM
+
+
+class Unparseable(Exception):
+    pass
+
+
+# 去掉不影响含义的排版命令
+_DROP_PATTERNS = [
+    r'\\left', r'\\right', r'\\displaystyle', r'\\!', r'\\,', r'\\;', r'\\:', r'\\ ', r'~',
+    r'\^\{\\circ\}', r'\^\\circ', r'°',
+]
+_TEXT_COMMANDS = ['text', 'mathrm', 'mathbf', 'textbf', 'mathit', 'operatorname']
+# 角度单位：归一化时去掉，30^\circ 与 30° 可按字符串判等，但与弧度的数值比较没有意义
+_DEGREE_RE = re.compile(r'\\circ|°')
+
+
+def read_group(s: str, i: int) -> Tuple[str, int]:
+    """读取位置i开始的一个LaTeX参数：{...} 或单个字符/命令，返回 (内容, 结束位置)"""
+    while i < len(s) and s[i] == ' ':
+        i += 1
+    if i >= len(s):
+        raise Unparseable('缺少参数')
+    if s[i] == '{':
+        depth = 0
+        for j in range(i, len(s)):
+            if s[j] == '{':
+                depth += 1
+            elif s[j] == '}':
+                depth -= 1
+                if depth == 0:
+                    return s[i + 1:j], j + 1
+        raise Unparseable('括号不匹配')
+    if s[i] == '\\':
+        m = re.match(r'\\[a-zA-Z]+', s[i:])
+        if m:
+            return m.group(0), i + len(m.group(0))
+    return s[i], i + 1
+
+
+def unwrap_command(s: str, name: str) -> str:
+    """\\name{x} -> x，支持嵌套括号"""
+    token = '\\' + name
+    while True:
+        i = s.find(token + '{')
+        if i < 0:
+            return s
+        content, end = read_group(s, i + len(token))
+        s = s[:i] + content + s[end:]
+
+
+def normalize_latex(s: str) -> str:
+    """字符串层面的归一化，结果相同即判定等价"""
+    s = str(s).strip()
+    s = s.replace('$', '').replace('\\(', '').replace('\\)', '').replace('\\[', '').replace('\\]', '')
+    s = unwrap_command(s, 'boxed')
+    for name in _TEXT_COMMANDS:
+        s = unwrap_command(s, name)
+    for pattern in _DROP_PATTERNS:
+        s = re.sub(pattern, '', s)
+    s = s.replace('\\dfrac', '\\frac').replace('\\tfrac', '\\frac')
+    s = s.replace('\\cdot', '*').replace('\\times', '*').replace('−', '-')
+    s = s.replace('\\infin', '\\infty').replace('∞', '\\infty')
+    s = re.sub(r'\\infty(?![a-zA-Z])', r'\\infty ', s)
+    s = s.replace('\\lbrace', '\\{').replace('\\rbrace', '\\}')
+    s = re.sub(r'\s+', '', s)
+    s = s.replace('+\\infty', '\\infty')
+    s = s.rstrip('.')
+    # 只有一个等号、左边是单个变量、右边是纯数字时去掉 "x="；右边含变量时可能是方程（y=x 与 x 不等价）
+    m = re.match(r'^[a-zA-Z]=([+-]?(?:\d+(?:\.\d*)?|\.\d+))$', s)
+    if m:
+        s = m.group(1)
+    # 开头多余的+号
+    if s.startswith('+'):
+        s = s[1:]
+    return s
+
+
+def split_top_level(s: str, sep: str) -> List[str]:
+    """按不在任何括号内的分隔符切分"""
+    parts = []
+    depth = 0
+    start = 0
+    i = 0
+    while i < len(s):
+        c = s[i]
+        if s.startswith('\\{', i):
+            depth += 1
+            i += 2
+            continue
+        if s.startswith('\\}', i):
+            depth -= 1
+            i += 2
+            continue
+        if c in '([{':
+            depth += 1
+        elif c in ')]}':
+            depth -= 1
+        elif depth == 0 and s.startswith(sep, i):
+            parts.append(s[start:i])
+            start = i + len(sep)
+            i += len(sep)
+            continue
+        i += 1
+    parts.append(s[start:])
+    return parts
+
+
+def latex_to_python(s: str) -> str:
+    """把只含数字、分式、根式、\\pi、乘方的LaTeX转成python表达式，遇到变量或其他命令即放弃"""
+    out = []
+    i = 0
+    while i < len(s):
+        if s.startswith('\\frac', i):
+            if out and out[-1][-1].isdigit():
+                # 2\frac{1}{2} 可能是带分数 5/2，也可能是乘积 1
+                raise Unparseable('数字后紧跟分式')
+            a, i = read_group(s, i + 5)
+            b, i = read_group(s, i)
+            out.append(f'(({latex_to_python(a)})/({latex_to_python(b)}))')
+        elif s.startswith('\\sqrt', i):
+            i += 5
+            index = None
+            if i < len(s) and s[i] == '[':
+                end = s.find(']', i)
+                if end < 0:
+                    raise Unparseable('根式不完整')
+                index = latex_to_python(s[i + 1:end])
+                i = end + 1
+            a, i = read_group(s, i)
+            out.append(f'sqrt({latex_to_python(a)})' if index is None else f'root({latex_to_python(a)},{index})')
+        elif s.startswith('\\pi', i):
+            out.append('pi')
+            i += 3
+        elif s.startswith('\\infty', i):
+            out.append('inf')
+            i += 6
+        elif s[i] == '\\':
+            raise Unparseable(f'不支持的命令: {s[i:i + 10]}')
+        elif s[i] == '{':
+            out.append('(')
+            i += 1
+        elif s[i] == '}':
+            out.append(')')
+            i += 1
+        elif s[i] == '^':
+            out.append('**')
+            i += 1
+        elif s[i].isalpha():
+            raise Unparseable(f'含变量: {s[i]}')
+        else:
+            out.append(s[i])
+            i += 1
+    expr = ''.join(out)
+    # 隐式乘法：2\pi、2\sqrt{3}、(a)(b)、\pi 2
+    expr = re.sub(r'(\d|\))(?=[(a-z])', r'\1*', expr)
+    expr = re.sub(r'(pi|inf)(?=[(\d])', r'\1*', expr)
+    expr = re.sub(r'\)(?=\d)', ')*', expr)
+    return expr
+
+
+def _eval_node(node) -> float:
+    if isinstance(node, ast.Expression):
+        return _eval_node(node.body)
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+        return float(node.value)
+    if isinstance(node, ast.Name) and node.id in ('pi', 'inf'):
+        return math.pi if node.id == 'pi' else math.inf
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.UAdd, ast.USub)):
+        v = _eval_node(node.operand)
+        return -v if isinstance(node.op, ast.USub) else v
+    if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow)):
+        a, b = _eval_node(node.left), _eval_node(node.right)
+        try:
+            if isinstance(node.op, ast.Add):
+                return a + b
+            if isinstance(node.op, ast.Sub):
+                return a - b
+            if isinstance(node.op, ast.Mult):
+                return a * b
+            if isinstance(node.op, ast.Div):
+                return a / b
+            if abs(b) > 1000:
+                raise Unparseable('指数过大')
+            return math.pow(a, b)
+        except (ZeroDivisionError, OverflowError, ValueError) as e:
+            raise Unparseable(str(e))
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords:
+        args = [_eval_node(arg) for arg in node.args]
+        try:
+            if node.func.id == 'sqrt' and len(args) == 1:
+                return math.sqrt(args[0])
+            if node.func.id == 'root' and len(args) == 2:
+                return math.copysign(abs(args[0]) ** (1 / args[1]), args[0]) if args[1] % 2 == 1 else args[0] ** (1 / args[1])
+        except (ZeroDivisionError, OverflowError, ValueError) as e:
+            raise Unparseable(str(e))
+    raise Unparseable('不支持的表达式')
+
+
+def eval_scalar(s: str) -> float:
+    if not s:
+        raise Unparseable('空表达式')
+    if '%' in s:
+        raise Unparseable('百分号含义不确定')
+    try:
+        tree = ast.parse(latex_to_python(s), mode='eval')
+    except SyntaxError as e:
+        raise Unparseable(str(e))
+    value = _eval_node(tree)
+    if isinstance(value, complex) or math.isnan(value):
+        raise Unparseable('非实数')
+    return value
+
+
+def parse_interval(s: str) -> Tuple[bool, float, float, bool]:
+    parts = split_top_level(s[1:-1], ',')
+    if len(parts) != 2:
+        raise Unparseable('区间端点数不为2')
+    lo, hi = eval_scalar(parts[0]), eval_scalar(parts[1])
+    return (s[0] == '[', lo, hi, s[-1] == ']')
+
+
+def parse_value(s: str) -> Tuple[str, Any]:
+    """把归一化后的字符串解析为 ('num', x) / ('interval', [区间...]) / ('set', [元素...])，集合只认显式的 \\{...\\}"""
+    if s.startswith('\\{') and s.endswith('\\}'):
+        return 'set', sorted_unique(eval_scalar(x) for x in split_top_level(s[2:-2], ',') if x)
+    pieces = split_top_level(s, '\\cup')
+    if all(len(p) >= 2 and p[0] in '([' and p[-1] in ')]' for p in pieces) and all(len(split_top_level(p[1:-1], ',')) == 2 for p in pieces):
+        return 'interval', sorted(parse_interval(p) for p in pieces)
+    if len(pieces) > 1:
+        raise Unparseable('无法解析的并集')
+    if len(split_top_level(s, ',')) > 1:
+        # 不带 \{\} 的逗号列表可能是有序的（数对、坐标），也可能是千分位
+        raise Unparseable('逗号列表')
+    return 'num', eval_scalar(s)
+
+
+def close(a: float, b: float) -> bool:
+    if math.isinf(a) or math.isinf(b):
+        return a == b
+    return math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-12)
+
+
+def sorted_unique(values) -> List[float]:
+    out = []
+    for v in sorted(values):
+        if not out or not close(out[-1], v):
+            out.append(v)
+    return out
+
+
+def values_equal(a: Tuple[str, Any], b: Tuple[str, Any]) -> bool:
+    if a[0] != b[0]:
+        return False
+    if a[0] == 'num':
+        return close(a[1], b[1])
+    if len(a[1]) != len(b[1]):
+        return False
+    if a[0] == 'set':
+        return all(close(x, y) for x, y in zip(a[1], b[1]))
+    return all(x[0] == y[0] and x[3] == y[3] and close(x[1], y[1]) and close(x[2], y[2]) for x, y in zip(a[1], b[1]))
+
+
+def check_equiv(gt: str, answer: str) -> Tuple[Optional[bool], str]:
+    """
+    Args:
+        gt: ground truth
+        answer: 待评价的答案
+
+    Returns:
+        (判定结果, 判定路径)。结果为None表示规则无法判定，需要交给LLM；
+        路径为 rule_exact / rule_num / rule_interval / rule_set / undecided
+    """
+    a, b = normalize_latex(gt), normalize_latex(answer)
+    if a == b and a:
+        return True, 'rule_exact'
+    if _DEGREE_RE.search(str(gt)) or _DEGREE_RE.search(str(answer)):
+        return None, 'undecided'
+    try:
+        va, vb = parse_value(a), parse_value(b)
+    except Unparseable:
+        return None, 'undecided'
+    if va[0] != vb[0]:
+        # 3 与 \{3\}、(1,2) 与 \{1,2\} 等，是否算等价由LLM按题意判断
+        return None, 'undecided'
+    return values_equal(va, vb), f'rule_{va[0]}'
@@ -0,0 +1,141 @@
+import os
+import sys
+import time
+import queue
+import argparse
+import traceback
+import multiprocessing as mp
+from typing import Any, Dict, List, Tuple
+
+import io_tools
+from evaluate_2_equiv import (add_eval_args, make_judge_backend, judge_rows, write_eval_results, detail_path, detail_rows,
+                              rule_verdicts, dedupe_pending)
+from llm_cache import ResponseCache
+
+# EVAL模式的多卡评测：主进程先做规则判等，剩下的行在整个输入上按 (ground truth, 归一化答案) 去重，
+# 去重后的答案切成小块，每张卡一个常驻worker（模型只加载一次），所有worker从同一个队列取块，
+# 先做完的卡自动多取，最慢的卡不再决定整体完成时间；判定结果再展开回每一行，
+# 输出与单进程运行 evaluate_2_equiv.py --mode EVAL 完全相同，相同的答案在不同块中也只判定一次
+
+
+def make_chunks(rows: List[Dict[str, Any]], size: int) -> List[Tuple[int, int, List[Dict[str, Any]]]]:
+    """每块 size 行，返回 [(块号, 起始行号, 行)]；只有最后一块可能不满"""
+    return [(chunk_id, start, rows[start:start + size]) for chunk_id, start in enumerate(range(0, len(rows), size))]
+
+
+def worker(device: str, args_dict: Dict[str, Any], tasks, results) -> None:
+    """常驻worker：绑定一张卡，判定后端和判定库在所有块之间复用，收到None时退出"""
+    # 必须在加载模型之前设置
+    os.environ['CUDA_VISIBLE_DEVICES'] = device
+    args = argparse.Namespace(**args_dict)
+    backend = make_judge_backend(args)
+    store = ResponseCache(args.verdict_store) if args.verdict_store else None
+    chunk_id = None
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            chunk_id, start, rows = task
+            results.put(('done', device, chunk_id, judge_rows(args, rows, backend, store)))
+    except Exception:
+        results.put(('error', device, chunk_id, traceback.format_exc()))
+    finally:
+        if store is not None:
+            store.close()
+
+
+def judge_unique(args, unique: List[Dict[str, Any]], devices: List[str]):
+    """
+    多个worker判定去重后的答案
+
+    Returns:
+        (每个答案的 (判定结果, 判定路径), {答案序号: 原始判定输出}, {答案序号: 判定token数}, 每张卡处理的块数)
+    """
+    chunks = make_chunks(unique, args.k * args.chunk_groups)
+    per_device = {device: 0 for device in devices}
+    verdicts = [None] * len(unique)
+    judge_outputs, judge_tokens = {}, {}
+    if not chunks:
+        return verdicts, judge_outputs, judge_tokens, per_device
+    print(f"去重后{len(unique)}个答案，切成{len(chunks)}块（每块{args.chunk_groups} x k={args.k}个），{len(devices)}个worker: {devices}")
+
+    ctx = mp.get_context('spawn')
+    tasks, results = ctx.Queue(), ctx.Queue()
+    for chunk in chunks:
+        tasks.put(chunk)
+    for _ in devices:
+        tasks.put(None)
+    worker_args = vars(args)
+    procs = [ctx.Process(target=worker, args=(device, worker_args, tasks, results), daemon=True) for device in devices]
+    for p in procs:
+        p.start()
+
+    finished = 0
+    start_time = time.time()
+    try:
+        while finished < len(chunks):
+            try:
+                status, device, chunk_id, payload = results.get(timeout=5)
+            except queue.Empty:
+                dead = [device for device, p in zip(devices, procs) if not p.is_alive() and p.exitcode != 0]
+                if dead:
+                    raise RuntimeError(f"worker异常退出: 设备{dead}")
+                continue
+            if status == 'error':
+                raise RuntimeError(f"设备{device}处理第{chunk_id}块时出错:\n{payload}")
+            per_device[device] += 1
+            chunk_verdicts, outputs, tokens = payload
+            _, start, chunk_rows = chunks[chunk_id]
+            verdicts[start:start + len(chunk_rows)] = chunk_verdicts
+            judge_outputs.update((start + i, output) for i, output in outputs.items())
+            judge_tokens.update((start + i, n) for i, n in tokens.items())
+            finished += 1
+            print(f"已完成 {finished}/{len(chunks)} 块，用时{time.time() - start_time:.1f}秒", flush=True)
+    finally:
+        for p in procs:
+            if p.is_alive():
+                p.terminate()
+            p.join()
+    return verdicts, judge_outputs, judge_tokens, per_device
+
+
+def run(args) -> Dict[str, int]:
+    """返回每张卡处理的块数"""
+    rows = io_tools.read_jsonl(args.input)
+    if len(rows) % args.k:
+        print(f"警告: 输入共{len(rows)}行，不是k={args.k}的整数倍，最后一组只有{len(rows) % args.k}行")
+    devices = [d.strip() for d in args.devices.split(',') if d.strip()]
+    verdicts = rule_verdicts(rows, args.rules)
+    pending = [i for i, (verdict, _) in enumerate(verdicts) if verdict is None]
+    groups = list(dedupe_pending(rows, pending).values())
+    print(f"共{len(rows)}行，规则判定{len(rows) - len(pending)}行")
+
+    # 每个答案用其首次出现的行交给worker，判定结果展开回所有相同答案的行
+    unique_verdicts, outputs, tokens, per_device = judge_unique(args, [rows[group[0]] for group in groups], devices)
+    judge_outputs, judge_tokens = {}, {}
+    for j, group in enumerate(groups):
+        for i in group:
+            verdicts[i] = unique_verdicts[j]
+            if j in outputs:
+                judge_outputs[i] = outputs[j]
+            if j in tokens:
+                judge_tokens[i] = tokens[j]
+    io_tools.write_jsonl(detail_path(args.output), detail_rows(rows, verdicts, judge_outputs))
+    write_eval_results(args, rows, verdicts, judge_outputs, judge_tokens)
+    return per_device
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='EVAL模式多卡评测：全局去重后切块，常驻worker共享任务队列')
+    parser.add_argument('--input', type=str, required=True, help='待评测数据集（jsonl）路径')
+    parser.add_argument('--output', type=str, required=True, help='准确率输出文件，另存 _detail.jsonl 明细')
+    parser.add_argument('--devices', type=str, default='0', help='逗号分隔的GPU编号，每个编号一个worker')
+    parser.add_argument('--chunk_groups', type=int, default=8, help='每块包含 chunk_groups x k 个去重后的答案，越小负载越均衡，越大单次推理批越大')
+    add_eval_args(parser)
+    args = parser.parse_args()
+    if args.mode != 'EVAL':
+        sys.exit('eval_launcher 只支持 EVAL 模式')
+    per_device = run(args)
+    print(f"评测完成，准确率结果已保存到 {args.output}，逐行判定明细保存到 {detail_path(args.output)}")
+    print("各设备处理的块数: " + ', '.join(f'{device}: {n}' for device, n in per_device.items()))
@@ -0,0 +1,186 @@
+import argparse
+import warnings
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import io_tools
+import equiv_rules
+
+# 评测指标：输入逐行的判定结果和题目id（行不需要按k组连续排列），按题目聚合，全部用NumPy向量化计算
+# - avg@k: 每题k个rollout的平均正确率，再对题目求平均
+# - pass@k: 无偏估计 1 - C(n-c, k) / C(n, k)（n为该题rollout数，c为正确数），k > n 的题目不参与
+# - maj@k: 每题出现次数最多的归一化答案是否正确（并列时取先出现的答案）
+# - 各指标对题目做bootstrap重采样，给出置信区间
+
+# bootstrap每批的元素数上限（批数 x 题目数），控制内存
+BOOTSTRAP_BATCH_ELEMS = 1 << 24
+
+
+def factorize(values: Iterable[Hashable]) -> Tuple[np.ndarray, int]:
+    """按首次出现的顺序编号，返回 (每个值的编号, 不同值的个数)"""
+    table = {}
+    codes = np.fromiter((table.setdefault(v, len(table)) for v in values), dtype=np.int64)
+    return codes, len(table)
+
+
+def question_ids(rows: Sequence[Dict[str, Any]], k: int, by_question: bool = False) -> List[Hashable]:
+    """
+    题目id：优先用 question_id，没有时按行号每k行一组
+    by_question=True 时没有 question_id 的行按题目文本分组（行不连续时使用；数据集中重复的题目会被合并为一题）
+    """
+    if by_question:
+        return [row.get('question_id', row.get('question', i // k)) for i, row in enumerate(rows)]
+    return [row.get('question_id', i // k) for i, row in enumerate(rows)]
+
+
+def pass_at_k(n: np.ndarray, c: np.ndarray, k: int) -> np.ndarray:
+    """
+    无偏的pass@k：1 - prod_{j=n-c+1}^{n} (1 - k/j)，用累加的对数一次算完所有题目
+    n < k 的题目返回NaN
+    """
+    n = np.asarray(n, dtype=np.int64)
+    c = np.asarray(c, dtype=np.int64)
+    result = np.full(len(n), np.nan)
+    if len(n) == 0:
+        return result
+    # log_terms[j] = sum_{i=k+1}^{j} log(1 - k/i)，j <= k 时为0
+    j = np.arange(int(n.max()) + 1, dtype=np.float64)
+    terms = np.zeros_like(j)
+    terms[k + 1:] = np.log1p(-k / j[k + 1:])
+    log_terms = np.cumsum(terms)
+    valid = n >= k
+    ratio = np.zeros(len(n))
+    # n - c >= k 时 C(n-c, k) / C(n, k) = exp(log_terms[n] - log_terms[n-c])，否则为0
+    has_fail = valid & (n - c >= k)
+    ratio[has_fail] = np.exp(log_terms[n[has_fail]] - log_terms[n[has_fail] - c[has_fail]])
+    result[valid] = 1.0 - ratio[valid]
+    return result
+
+
+def majority_correct(q_codes: np.ndarray, answer_codes: np.ndarray, verdicts: np.ndarray, num_questions: int) -> np.ndarray:
+    """每题出现最多的答案是否正确；同一答案取其首次出现的行的判定"""
+    pair = q_codes * (int(answer_codes.max()) + 1) + answer_codes
+    uniq, first, counts = np.unique(pair, return_index=True, return_counts=True)
+    pair_q = q_codes[first]
+    # 同题内按出现次数降序、首次出现位置升序，每题的第一个即为多数答案
+    order = np.lexsort((first, -counts, pair_q))
+    head = np.ones(len(order), dtype=bool)
+    head[1:] = pair_q[order][1:] != pair_q[order][:-1]
+    winners = order[head]
+    result = np.zeros(num_questions, dtype=bool)
+    result[pair_q[winners]] = verdicts[first[winners]]
+    return result
+
+
+def bootstrap_ci(per_question: Dict[str, np.ndarray], num_boot: int = 1000, alpha: float = 0.05,
+                 seed: int = 0) -> Dict[str, List[float]]:
+    """对题目有放回重采样，各指标用同一组重采样下标，返回 {指标: [下界, 上界]}"""
+    if not per_question or num_boot <= 0:
+        return {}
+    num_questions = len(next(iter(per_question.values())))
+    if num_questions == 0:
+        return {name: [float('nan'), float('nan')] for name in per_question}
+    rng = np.random.default_rng(seed)
+    batch = max(1, BOOTSTRAP_BATCH_ELEMS // num_questions)
+    samples = {name: [] for name in per_question}
+    for start in range(0, num_boot, batch):
+        idx = rng.integers(0, num_questions, size=(min(batch, num_boot - start), num_questions))
+        for name, values in per_question.items():
+            if np.isnan(values).any():
+                # 部分题目没有该指标（rollout数不足k），重采样时可能整批都是NaN
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore', RuntimeWarning)
+                    samples[name].append(np.nanmean(values[idx], axis=1))
+            else:
+                samples[name].append(values[idx].mean(axis=1))
+    ci = {}
+    for name, parts in samples.items():
+        means = np.concatenate(parts)
+        ci[name] = [float(np.nanquantile(means, alpha / 2)), float(np.nanquantile(means, 1 - alpha / 2))]
+    return ci
+
+
+def compute_metrics(verdicts: Sequence[bool], qids: Sequence[Hashable], answers: Optional[Sequence[str]] = None,
+                    ks: Sequence[int] = (1,), num_boot: int = 1000, alpha: float = 0.05, seed: int = 0) -> Dict[str, Any]:
+    """
+    Args:
+        verdicts: 逐行判定结果
+        qids: 逐行的题目id，同一题目的行不需要相邻
+        answers: 逐行归一化后的答案，用于maj@k；为None时不计算
+        ks: 需要计算pass@k的k值，大于最少rollout数的k只在rollout数足够的题目上计算，没有题目满足时不输出
+        num_boot: bootstrap次数，0表示不计算置信区间
+        alpha: 置信区间的显著性水平
+
+    Returns:
+        {'questions', 'rollouts', 'samples_per_question': [最少, 最多],
+         'avg@k' / 'pass@{k}' / 'maj@k': {'mean', 'ci', 'questions'},
+         'per_question': {'qid': [...], 'n': [...], 'correct': [...], 'avg': [...]}}
+    """
+    verdicts = np.asarray(verdicts, dtype=bool)
+    q_codes, num_questions = factorize(qids)
+    n = np.bincount(q_codes, minlength=num_questions)
+    c = np.bincount(q_codes, weights=verdicts, minlength=num_questions).astype(np.int64)
+    per_question = {'avg@k': c / np.maximum(n, 1)}
+    for k in ks:
+        if not (n >= k).any():
+            continue
+        per_question[f'pass@{k}'] = pass_at_k(n, c, k)
+    if answers is not None and len(verdicts):
+        answer_codes, _ = factorize(answers)
+        per_question['maj@k'] = majority_correct(q_codes, answer_codes, verdicts, num_questions).astype(np.float64)
+
+    ci = bootstrap_ci(per_question, num_boot, alpha, seed)
+    first = np.full(num_questions, len(qids), dtype=np.int64)
+    np.minimum.at(first, q_codes, np.arange(len(q_codes)))
+    metrics = {
+        'questions': num_questions,
+        'rollouts': int(len(verdicts)),
+        'samples_per_question': [int(n.min()), int(n.max())] if num_questions else [0, 0],
+    }
+    for name, values in per_question.items():
+        valid = ~np.isnan(values)
+        metrics[name] = {
+            'mean': float(values[valid].mean()) if valid.any() else float('nan'),
+            'ci': ci.get(name),
+            'questions': int(valid.sum()),
+        }
+    metrics['per_question'] = {
+        'qid': [qids[i] for i in first],
+        'n': n.tolist(),
+        'correct': c.tolist(),
+        'avg': per_question['avg@k'].tolist(),
+    }
+    return metrics
+
+
+def format_metrics(metrics: Dict[str, Any]) -> str:
+    lo, hi = metrics['samples_per_question']
+    lines = [f"{metrics['questions']}个题目，{metrics['rollouts']}条rollout，每题{lo}~{hi}条"]
+    for name, value in metrics.items():
+        if isinstance(value, dict) and 'mean' in value:
+            ci = f" [{value['ci'][0]:.4f}, {value['ci'][1]:.4f}]" if value.get('ci') else ''
+            partial = f" ({value['questions']}题)" if value['questions'] != metrics['questions'] else ''
+            lines.append(f"  {name}: {value['mean']:.4f}{ci}{partial}")
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='由评测明细（_detail.jsonl）重新计算 avg@k / pass@k / maj@k 及置信区间')
+    parser.add_argument('--detail', type=str, required=True, help='evaluate_2_equiv / eval_launcher 输出的 _detail.jsonl')
+    parser.add_argument('--input', type=str, default='', help='评测输入（与明细逐行对应），从中读取 question_id（及 --group_by_question 时的 question）')
+    parser.add_argument('--k', type=int, default=32, help='没有 question_id 时按每k行一组')
+    parser.add_argument('--group_by_question', action='store_true', help='没有 question_id 时按题目文本分组，重复的题目会合并')
+    parser.add_argument('--pass_k', type=str, default='1,8,32', help='逗号分隔的pass@k的k值')
+    parser.add_argument('--bootstrap', type=int, default=1000, help='bootstrap次数，0表示不计算置信区间')
+    parser.add_argument('--output', type=str, default='', help='指标汇总JSON路径，为空只打印')
+    args = parser.parse_args()
+
+    rows = io_tools.read_jsonl(args.detail)
+    qids = question_ids(io_tools.read_jsonl(args.input) if args.input else rows, args.k, args.group_by_question)
+    metrics = compute_metrics([bool(row['verdict']) for row in rows], qids,
+                              [equiv_rules.normalize_latex(row['final_answer']) for row in rows],
+                              ks=[int(x) for x in args.pass_k.split(',') if x], num_boot=args.bootstrap)
+    print(format_metrics(metrics))
+    if args.output:
+        io_tools.write_json(args.output, metrics)
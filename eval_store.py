@@ -0,0 +1,171 @@
+import os
+import argparse
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# 逐rollout的评测结果，列式存储：分析时只读取需要的列，不必重新解析jsonl、按位置拼接或重跑判定
+# 装了pyarrow时写Parquet（<前缀>.parquet），否则写NumPy的npz（<前缀>.npz）：
+# 字符串列存为 utf-8字节拼接 + offsets，列表列再多一层offsets；npz按列惰性读取
+#
+# 列：
+#   row_index      输入中的行号
+#   question_id    题目id（见 eval_metrics.question_ids）
+#   rollout_index  该行是题目的第几个rollout（按出现顺序）
+#   answer         ground truth
+#   final_answer   待评价的答案
+#   verdict        判定结果
+#   path           判定路径 rule_* / store / llm / llm_logprob
+#   votes          思考模式下每次采样的判定（'true' / 'false' / 'error'），其他路径为空列表
+#   judge_score    logprob判定的score，其他路径为NaN
+#   judge_tokens   本次运行为该答案生成的判定token数，去重后共享同一判定的行值相同；规则和判定库命中为0
+
+STRING_COLUMNS = ['question_id', 'answer', 'final_answer', 'path']
+LIST_COLUMNS = ['votes']
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+def build_columns(rows: Sequence[Dict[str, Any]], verdicts: Sequence, judge_outputs: Dict[int, Any],
+                  judge_tokens: Dict[int, int], qids: Sequence) -> Dict[str, Any]:
+    """
+    Args:
+        rows: 评测输入的行
+        verdicts: 每行的 (判定结果, 判定路径)
+        judge_outputs: {行号: 原始判定输出}，思考模式为判定列表，logprob模式为 logprob_score 的结果
+        judge_tokens: {行号: 判定token数}
+        qids: 每行的题目id
+    """
+    seen = {}
+    rollout_index = np.empty(len(rows), dtype=np.int32)
+    for i, qid in enumerate(qids):
+        rollout_index[i] = seen.get(qid, 0)
+        seen[qid] = rollout_index[i] + 1
+    votes, scores = [], np.full(len(rows), np.nan)
+    for i in range(len(rows)):
+        output = judge_outputs.get(i)
+        if isinstance(output, dict):
+            votes.append([])
+            if output.get('score') is not None:
+                scores[i] = output['score']
+        else:
+            votes.append([str(x) for x in output or []])
+    return {
+        'row_index': np.arange(len(rows), dtype=np.int64),
+        'question_id': [str(qid) for qid in qids],
+        'rollout_index': rollout_index,
+        'answer': [str(row['answer']) for row in rows],
+        'final_answer': [str(row['final_answer']) for row in rows],
+        'verdict': np.array([verdict for verdict, _ in verdicts], dtype=bool),
+        'path': [path for _, path in verdicts],
+        'votes': votes,
+        'judge_score': scores,
+        'judge_tokens': np.array([judge_tokens.get(i, 0) for i in range(len(rows))], dtype=np.int64),
+    }
+
+
+def encode_strings(values: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """字符串列 -> (utf-8字节拼接, offsets)，第i个字符串为 data[offsets[i]:offsets[i+1]]"""
+    encoded = [v.encode('utf-8') for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def decode_strings(data: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    raw = data.tobytes()
+    bounds = offsets.tolist()
+    return np.array([raw[bounds[i]:bounds[i + 1]].decode('utf-8') for i in range(len(bounds) - 1)], dtype=object)
+
+
+def object_array(values: Sequence[Any]) -> np.ndarray:
+    """逐个赋值，避免等长的list被numpy展开成二维数组"""
+    out = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        out[i] = value
+    return out
+
+
+def results_path(prefix: str, fmt: str = 'auto') -> str:
+    if fmt == 'auto':
+        fmt = 'parquet' if pq is not None else 'npz'
+    return f'{prefix}.{fmt}'
+
+
+def write_results(prefix: str, columns: Dict[str, Any], fmt: str = 'auto') -> str:
+    """写出列式结果，fmt为 auto / parquet / npz，返回实际写出的路径"""
+    path = results_path(prefix, fmt)
+    tmp_path = path + '.tmp'
+    if path.endswith('.parquet'):
+        if pq is None:
+            raise ImportError('写Parquet需要pyarrow: pip install pyarrow')
+        pq.write_table(pa.table({name: pa.array(values) for name, values in columns.items()}), tmp_path)
+    else:
+        arrays = {}
+        for name, values in columns.items():
+            if name in STRING_COLUMNS:
+                arrays[f'{name}.data'], arrays[f'{name}.offsets'] = encode_strings(values)
+            elif name in LIST_COLUMNS:
+                # 两层offsets：list_offsets按元素切分每行，元素本身按字符串列存储
+                list_offsets = np.zeros(len(values) + 1, dtype=np.int64)
+                np.cumsum([len(v) for v in values], out=list_offsets[1:])
+                arrays[f'{name}.list_offsets'] = list_offsets
+                arrays[f'{name}.data'], arrays[f'{name}.offsets'] = encode_strings([x for v in values for x in v])
+            else:
+                arrays[name] = np.asarray(values)
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_results(path: str, columns: Optional[List[str]] = None) -> Dict[str, np.ndarray]:
+    """
+    读取列式结果，columns为None时读取全部列；字符串列返回object数组，列表列返回每行一个list的object数组
+
+    Examples:
+        >>> res = load_results('Eval/equiv_results_rollouts.parquet', ['question_id', 'verdict'])
+    """
+    if path.endswith('.parquet'):
+        if pq is None:
+            raise ImportError('读取Parquet需要pyarrow: pip install pyarrow')
+        table = pq.read_table(path, columns=columns)
+        out = {}
+        for name in table.column_names:
+            if name in STRING_COLUMNS + LIST_COLUMNS:
+                out[name] = object_array(table.column(name).to_pylist())
+            else:
+                out[name] = table.column(name).to_numpy()
+        return out
+    with np.load(path) as npz:
+        names = sorted({key.split('.')[0] for key in npz.files})
+        out = {}
+        for name in columns or names:
+            if name in STRING_COLUMNS:
+                out[name] = decode_strings(npz[f'{name}.data'], npz[f'{name}.offsets'])
+            elif name in LIST_COLUMNS:
+                items = decode_strings(npz[f'{name}.data'], npz[f'{name}.offsets'])
+                bounds = npz[f'{name}.list_offsets'].tolist()
+                out[name] = object_array([list(items[bounds[i]:bounds[i + 1]]) for i in range(len(bounds) - 1)])
+            else:
+                out[name] = npz[name]
+        return out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='查看列式评测结果')
+    parser.add_argument('path', type=str, help='.parquet 或 .npz')
+    parser.add_argument('--columns', type=str, default='', help='逗号分隔的列名，默认全部')
+    parser.add_argument('--head', type=int, default=5, help='打印前几行')
+    args = parser.parse_args()
+
+    res = load_results(args.path, [c for c in args.columns.split(',') if c] or None)
+    num_rows = len(next(iter(res.values()))) if res else 0
+    print(f'{args.path}: {num_rows}行, 列: {list(res)}')
+    for i in range(min(args.head, num_rows)):
+        print({name: values[i] for name, values in res.items()})
@@ -1,21 +1,21 @@
-import json
 import os
+import io_tools
 res_dir = '/mnt/new_pfs/liming_team/auroraX/mxd/a_x1/rollout_verify/tmp1'
 all_res_name = [f for f in os.listdir(res_dir) if f.endswith('jsonl')]
 all_res_name.sort()
 
 reduce_res = []
 cnt = 0
+
+def on_error(line, e):
+    global cnt
+    cnt += 1
+    return {'final_answer': 'error'}
+
 for i in range(len(all_res_name)):
-    with open(os.path.join(res_dir, all_res_name[i]), 'r') as f:
-        for line in f:
-            try:reduce_res.append(json.loads(line))
-            except:
-                cnt += 1
-                reduce_res.append({
-                    'final_answer': 'error'
-                })
-ori = [json.loads(line) for line in open('/mnt/new_pfs/liming_team/auroraX/mxd/a_x1/new_0513/data/v1_50_32.jsonl')]
+    # 空行也记为error行，保持与输入文件逐行对应
+    reduce_res.extend(io_tools.iter_jsonl(os.path.join(res_dir, all_res_name[i]), on_error=on_error, skip_blank=False))
+ori = io_tools.read_jsonl('/mnt/new_pfs/liming_team/auroraX/mxd/a_x1/new_0513/data/v1_50_32.jsonl')
 post_res = []
 for i in range(len(reduce_res)):
     post_res.append({
@@ -25,8 +25,6 @@ for i in range(len(reduce_res)):
     })
 
 output_path = '/mnt/new_pfs/liming_team/auroraX/mxd/a_x1/new_0513/data/v1_50_32_xg/post_res.jsonl'
-with open(output_path, 'w') as f:
-    for item in post_res:
-        f.write(json.dumps(item, ensure_ascii=False) + '\n')
+io_tools.write_jsonl(output_path, post_res)
 
 print(f'{output_path} saved, cnt: {len(post_res)}')
\ No newline at end of file
@@ -1,10 +1,17 @@
+import os
 import json
+import math
+import hashlib
 import argparse
-from vllm import LLM, SamplingParams
+import io_tools
+import equiv_rules
+import eval_metrics
+import eval_store
+from llm_cache import ResponseCache
+from judge_backends import make_backend, served_model
 
 def load_data(jsonl_path):
-    with open(jsonl_path, 'r') as f:
-        return [json.loads(line) for line in f]
+    return io_tools.read_jsonl(jsonl_path)
 
 def build_messages_eval(ori, prompt_cot):
     """构造EVAL模式的messages"""
@@ -51,24 +58,6 @@ def verify2judge_marco(tripo):
     # 可以添加更复杂的评判逻辑，比如检查回答质量
     return any(len(item.strip()) > 50 for item in tripo if item != 'error')
 
-def compute_avg_k(ori, k, mode):
-    """计算平均准确率"""
-    if mode == 'EVAL':
-        _pre = [verify2judge_eval(item) for item in ori]
-    elif mode == 'MARCO':
-        _pre = [verify2judge_marco(item) for item in ori]
-    else:
-        raise ValueError(f"不支持的模式: {mode}")
-    
-    batches = [_pre[i:i+k] for i in range(0, len(_pre), k)]
-    accs = []
-    for batch in batches:
-        if len(batch) == 0:
-            accs.append(0)
-        else:
-            accs.append(sum(batch) / len(batch))
-    return accs
-
 def get_eval_prompt():
     """获取EVAL模式的prompt"""
     return """你是一名"数学表达式等价性判定专家"。
@@ -126,50 +115,54 @@ Your response should be concise and presented in coherent paragraphs (without st
 {question}
 """
 
+def detail_path(output):
+    """EVAL模式逐行判定明细的路径：与输出文件同目录，文件名加 _detail.jsonl"""
+    return os.path.splitext(output)[0] + '_detail.jsonl'
+
+def metrics_path(output):
+    """EVAL模式指标汇总（avg@k / pass@k / maj@k 及置信区间）的路径"""
+    return os.path.splitext(output)[0] + '_metrics.json'
+
+def rule_verdicts(ori, use_rules=True):
+    """先用规则判等，返回每行的 (判定结果, 判定路径)，结果为None的行需要LLM判定"""
+    if not use_rules:
+        return [(None, 'undecided')] * len(ori)
+    return [equiv_rules.check_equiv(meta['answer'], meta['final_answer']) for meta in ori]
+
+# MARCO模式的生成采样，pipeline.py 的GenMarco阶段共用
+MARCO_MAX_TOKENS = 1024
+
+def marco_sampling_params():
+    return dict(temperature=1, top_p=0.95, top_k=20, max_tokens=MARCO_MAX_TOKENS)
+
 def main(args):
     print(f"正在读取数据: {args.input}")
     print(f"使用模式: {args.mode}")
     
     # 1. 读取数据
     ori = load_data(args.input)
+    if args.mode == 'EVAL':
+        return main_eval(args, ori)
     print(f"正在构造prompt")
     
     # 2. 根据模式构造prompt和messages
-    if args.mode == 'EVAL':
-        prompt = get_eval_prompt()
-        messages = build_messages_eval(ori, prompt)
-        extract_func = extract_answer_eval
-        max_tokens = 10000
-        sampling_params = SamplingParams(temperature=0.6, top_p=0.95, top_k=20, max_tokens=max_tokens, n=3)
-    elif args.mode == 'MARCO':
+    if args.mode == 'MARCO':
         prompt = get_marco_prompt()
         messages = build_messages_marco(ori, prompt)
         extract_func = extract_answer_marco
-        max_tokens = 1024
-        sampling_params = SamplingParams(temperature=1, top_p=0.95, top_k=20, max_tokens=max_tokens)
+        max_tokens = MARCO_MAX_TOKENS
+        sampling_params = marco_sampling_params()
     else:
         raise ValueError(f"不支持的模式: {args.mode}. 支持的模式: EVAL, MARCO")
 
     # 3. 加载模型
-    model_path = args.model_path
-    llm = LLM(model=model_path, max_model_len=max_tokens)
+    backend = make_backend(args.backend, args.model_path, max_tokens, **backend_options(args))
 
     # 4. 推理
-    outputs = llm.chat(messages, sampling_params)
+    outputs = backend.chat(messages, sampling_params)
 
     # 5. 处理输出
-    if args.mode == 'EVAL':
-        # EVAL模式：解析输出并计算准确率
-        model_res = [extract_func(item.outputs) for item in outputs]
-        ultra_acc = compute_avg_k(model_res, args.k, args.mode)
-        
-        # 保存准确率结果
-        with open(args.output, 'w') as f:
-            for item in ultra_acc:
-                f.write(str(item) + '\n')
-        print(f"EVAL模式评测完成，准确率结果已保存到 {args.output}")
-        
-    elif args.mode == 'MARCO':
+    if args.mode == 'MARCO':
         # MARCO模式：直接保存生成结果
         results = []
         for i, output in enumerate(outputs):
@@ -182,18 +175,245 @@ def main(args):
             results.append(result)
         
         # 保存生成结果到jsonl文件
-        with open(args.output, 'w', encoding='utf-8') as f:
-            for result in results:
-                f.write(json.dumps(result, ensure_ascii=False) + '\n')
+        io_tools.write_jsonl(args.output, results)
         print(f"MARCO模式生成完成，结果已保存到 {args.output}")
 
+# EVAL模式的判定采样：思考模式，每个样本最多 EVAL_MAX_TOKENS 个token
+EVAL_MAX_TOKENS = 10000
+
+def eval_sampling_params(n):
+    return dict(temperature=0.6, top_p=0.95, top_k=20, max_tokens=EVAL_MAX_TOKENS, n=n)
+
+def count_tokens(item):
+    return sum(len(c.token_ids) for c in item.outputs)
+
+def judge_parallel(backend, messages, budget):
+    """每对一次采样budget个判定，返回 (每对的判定列表, 每对生成的token数)"""
+    outputs = backend.chat(messages, eval_sampling_params(budget))
+    return [extract_answer_eval(item.outputs) for item in outputs], [count_tokens(item) for item in outputs]
+
+def judge_sequential(backend, messages, budget):
+    """
+    逐轮投票：每轮对仍未判定的对各采样1个判定，出现 false 即可确定结果（verify2judge_eval 中任一false即为False），
+    其余的对继续下一轮，直到用完budget。结论与一次采样budget个完全一致，但判错的答案只花一条思考链
+    """
+    answers = [[] for _ in messages]
+    tokens = [0] * len(messages)
+    active = list(range(len(messages)))
+    for _ in range(budget):
+        if not active:
+            break
+        outputs = backend.chat([messages[i] for i in active], eval_sampling_params(1))
+        for i, item in zip(active, outputs):
+            answers[i].extend(extract_answer_eval(item.outputs))
+            tokens[i] += count_tokens(item)
+        active = [i for i in active if 'false' not in answers[i]]
+    return answers, tokens
+
+# logprob判定：关闭思考，只解码几个token，读取 true / false 的概率
+LOGPROB_MAX_TOKENS = 3
+LOGPROB_TOP_K = 20
+LOGPROB_MAX_MODEL_LEN = 4096
+
+def logprob_score(completion, temperature=1.0):
+    """
+    在前几个解码位置中找第一个候选里出现 true/false 的位置（允许空格、反引号、大小写差异），
+    返回 {'text', 'p_true', 'p_false', 'score'}，score = sigmoid((log p_true - log p_false) / temperature)，
+    temperature=1 时即 p_true / (p_true + p_false)；都没出现时 score 为None
+    """
+    result = {'text': completion.text, 'p_true': 0.0, 'p_false': 0.0, 'score': None}
+    for position in completion.logprobs or []:
+        probs = {'true': 0.0, 'false': 0.0}
+        for logprob in position.values():
+            word = (logprob.decoded_token or '').strip().strip('`').lower()
+            if word in probs:
+                probs[word] += math.exp(logprob.logprob)
+        if probs['true'] or probs['false']:
+            result['p_true'], result['p_false'] = probs['true'], probs['false']
+            if not probs['false']:
+                result['score'] = 1.0
+            elif not probs['true']:
+                result['score'] = 0.0
+            else:
+                result['score'] = 1 / (1 + math.exp(-(math.log(probs['true']) - math.log(probs['false'])) / temperature))
+            break
+    return result
+
+def judge_logprob(backend, messages, temperature=1.0):
+    """每对一次贪心短解码，返回 (每对的logprob_score结果, 每对生成的token数)"""
+    sampling_params = dict(temperature=0, max_tokens=LOGPROB_MAX_TOKENS, logprobs=LOGPROB_TOP_K)
+    outputs = backend.chat(messages, sampling_params, chat_template_kwargs={'enable_thinking': False})
+    return [logprob_score(item.outputs[0], temperature) for item in outputs], [count_tokens(item) for item in outputs]
+
+def judge_max_model_len(args):
+    return LOGPROB_MAX_MODEL_LEN if args.judge == 'logprob' else EVAL_MAX_TOKENS
+
+def backend_options(args):
+    return dict(fake_delay=args.fake_delay, llm_url=args.llm_url, model_name=args.model_name, concurrency=args.concurrency)
+
+def make_judge_backend(args):
+    """EVAL模式的判定后端，模型在第一次判定时才加载"""
+    return make_backend(args.backend, args.model_path, judge_max_model_len(args), **backend_options(args))
+
+def run_judge(args, messages, backend):
+    """按 --judge 选择判定方式，返回 (每对的判定结果, 每对的原始判定输出, 每对生成的token数)"""
+    if args.judge == 'logprob':
+        scores, tokens = judge_logprob(backend, messages, args.logprob_temperature)
+        print(f"LLM判定{len(messages)}个答案，logprob模式，共生成{sum(tokens)}个token，"
+              f"{sum(s['score'] is None for s in scores)}个未读到true/false概率")
+        return [s['score'] is not None and s['score'] >= args.logprob_threshold for s in scores], scores, tokens
+    judge = judge_sequential if args.voting == 'sequential' else judge_parallel
+    all_answers, tokens = judge(backend, messages, args.vote_budget)
+    print(f"LLM判定{len(messages)}个答案，{args.voting}投票，共生成{sum(tokens)}个token")
+    return [verify2judge_eval(answers) for answers in all_answers], all_answers, tokens
+
+def judge_signature(args):
+    """判定结果只在模型、prompt和判定方式都相同时复用；http后端用服务实际加载的模型，不用 --model_path"""
+    return {
+        'model': served_model(args.llm_url) if args.backend == 'http' else os.path.abspath(args.model_path),
+        'prompt': hashlib.sha1(get_eval_prompt().encode('utf-8')).hexdigest(),
+        'judge': (f'logprob_t{args.logprob_temperature}_th{args.logprob_threshold}' if args.judge == 'logprob'
+                  else f'think_n{args.vote_budget}'),
+    }
+
+def verdict_key(signature, gt, answer_norm):
+    key = json.dumps([signature, gt, answer_norm], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+def dedupe_pending(ori, pending):
+    """规则未判定的行按 (ground truth, 归一化后的答案) 去重，返回 {key: [行号...]}，保持首次出现的顺序"""
+    groups = {}
+    for i in pending:
+        key = (ori[i]['answer'], equiv_rules.normalize_latex(ori[i]['final_answer']))
+        groups.setdefault(key, []).append(i)
+    return groups
+
+def judge_rows(args, ori, backend, store=None):
+    """
+    EVAL模式的判定：规则能判定的行直接出结果；剩下的行去重后先查判定库，只把没见过的答案交给LLM
+    backend / store 由调用方持有，eval_launcher 的常驻worker在多个分块之间复用
+
+    Returns:
+        (每行的 (判定结果, 判定路径), {行号: 原始判定输出}, {行号: 本次为该答案生成的判定token数})
+    """
+    verdicts = rule_verdicts(ori, args.rules)
+    pending = [i for i, (verdict, _) in enumerate(verdicts) if verdict is None]
+    groups = dedupe_pending(ori, pending)
+    signature = judge_signature(args)
+
+    judge_outputs = {}
+    judge_tokens = {}
+    to_judge = []
+    for key, rows in groups.items():
+        cached = store.get(verdict_key(signature, *key)) if store is not None else None
+        if cached is None:
+            to_judge.append(key)
+            continue
+        record = json.loads(cached)
+        for i in rows:
+            verdicts[i] = (record['verdict'], 'store')
+            judge_outputs[i] = record['judge_outputs']
+    print(f"规则判定{len(ori) - len(pending)}条，剩余{len(pending)}条去重后{len(groups)}个答案，"
+          f"判定库命中{len(groups) - len(to_judge)}个，交给LLM判定{len(to_judge)}个")
+
+    if to_judge:
+        prompt = get_eval_prompt()
+        # 每个去重后的答案用其首次出现的行构造prompt
+        messages = build_messages_eval([ori[groups[key][0]] for key in to_judge], prompt)
+        path = 'llm_logprob' if args.judge == 'logprob' else 'llm'
+        for key, verdict, answers, tokens in zip(to_judge, *run_judge(args, messages, backend)):
+            for i in groups[key]:
+                verdicts[i] = (verdict, path)
+                judge_outputs[i] = answers
+                judge_tokens[i] = tokens
+            if store is not None:
+                # 每条单独提交，共用判定库的其他worker不必等到本批判定结束
+                store.put(verdict_key(signature, *key), json.dumps({'verdict': verdict, 'judge_outputs': answers}, ensure_ascii=False))
+    if store is not None:
+        # 本批命中的访问时间写回，长时间的判定期间不持有写锁
+        store.flush()
+    return verdicts, judge_outputs, judge_tokens
+
+def detail_rows(ori, verdicts, judge_outputs, offset=0):
+    """逐行判定明细，offset为这些行在整个输入文件中的起始行号"""
+    for i, (meta, (verdict, path)) in enumerate(zip(ori, verdicts)):
+        yield {
+            'index': offset + i,
+            'answer': meta['answer'],
+            'final_answer': meta['final_answer'],
+            'verdict': verdict,
+            'path': path,
+            'judge_outputs': judge_outputs.get(i),
+        }
+
+def write_eval_results(args, ori, verdicts, judge_outputs, judge_tokens):
+    """
+    按题目聚合指标（题目id见 eval_metrics.question_ids，行不需要按k组连续）：
+    准确率文件每题一行avg@k，题目按首次出现的顺序；完整指标写入 _metrics.json；
+    逐rollout的判定写入列式结果 _rollouts.parquet / .npz（见 eval_store）
+    """
+    qids = eval_metrics.question_ids(ori, args.k, args.group_by_question)
+    metrics = eval_metrics.compute_metrics(
+        [verdict for verdict, _ in verdicts], qids,
+        [equiv_rules.normalize_latex(meta['final_answer']) for meta in ori],
+        ks=[int(x) for x in args.pass_k.split(',') if x], num_boot=args.bootstrap)
+    with open(args.output, 'w') as f:
+        for item in metrics['per_question']['avg']:
+            f.write(str(item) + '\n')
+    io_tools.write_json(metrics_path(args.output), metrics)
+    print(eval_metrics.format_metrics(metrics))
+    if args.results_format != 'none':
+        path = eval_store.write_results(os.path.splitext(args.output)[0] + '_rollouts',
+                                        eval_store.build_columns(ori, verdicts, judge_outputs, judge_tokens, qids),
+                                        args.results_format)
+        print(f"逐rollout结果已保存到 {path}")
+    return metrics
+
+def main_eval(args, ori):
+    store = ResponseCache(args.verdict_store) if args.verdict_store else None
+    try:
+        verdicts, judge_outputs, judge_tokens = judge_rows(args, ori, make_judge_backend(args), store)
+    finally:
+        if store is not None:
+            store.close()
+
+    write_eval_results(args, ori, verdicts, judge_outputs, judge_tokens)
+    io_tools.write_jsonl(detail_path(args.output), detail_rows(ori, verdicts, judge_outputs))
+    print(f"EVAL模式评测完成，准确率结果已保存到 {args.output}，逐行判定明细保存到 {detail_path(args.output)}")
+
+def add_eval_args(parser):
+    """评测参数，evaluate_2_equiv 和 eval_launcher 共用"""
+    parser.add_argument('--model_path', type=str, default='/mnt/new_pfs/liming_team/auroraX/LLM/Qwen3-4B', help='模型路径')
+    parser.add_argument('--mode', type=str, choices=['EVAL', 'MARCO'], default='EVAL', help='评测模式: EVAL(等价性判定) 或 MARCO(数学问题分析)')
+    parser.add_argument('--k', type=int, default=32, help='每题的rollout数；数据没有 question_id 字段时按每k行一组')
+    parser.add_argument('--group_by_question', action='store_true',
+                        help='没有 question_id 时按 question 文本分组（行不按k组连续时使用），数据集中重复的题目会合并为一题')
+    parser.add_argument('--pass_k', type=str, default='1,8,32', help='逗号分隔的pass@k的k值（无偏估计）')
+    parser.add_argument('--bootstrap', type=int, default=1000, help='指标置信区间的bootstrap次数，0表示不计算')
+    parser.add_argument('--results_format', type=str, choices=['auto', 'parquet', 'npz', 'none'], default='auto',
+                        help='逐rollout列式结果的格式，auto 装了pyarrow时用parquet，否则npz')
+    parser.add_argument('--verdict_store', type=str, default='', help='EVAL模式的判定库（SQLite），跨运行/分片复用相同 (ground truth, 答案) 的判定结果；为空不启用')
+    parser.add_argument('--judge', type=str, choices=['think', 'logprob'], default='think',
+                        help='EVAL模式的判定方式: think 思考模式采样判定并投票; logprob 关闭思考，读取true/false的概率')
+    parser.add_argument('--logprob_threshold', type=float, default=0.5, help='logprob判定中 score >= 阈值 判为等价')
+    parser.add_argument('--logprob_temperature', type=float, default=1.0, help='logprob判定的温度校准，score = sigmoid(logit差 / 温度)')
+    parser.add_argument('--voting', type=str, choices=['parallel', 'sequential'], default='parallel',
+                        help='EVAL模式的投票方式: parallel 一次采样vote_budget个; sequential 逐个采样，出现false即停止')
+    parser.add_argument('--vote_budget', type=int, default=3, help='EVAL模式每个答案最多的判定采样数')
+    parser.add_argument('--no_rules', dest='rules', action='store_false', help='EVAL模式不使用规则判等，全部交给LLM')
+    parser.add_argument('--backend', type=str, choices=['vllm', 'http', 'fake'], default='vllm',
+                        help='推理后端: vllm 进程内加载模型; http 请求已在运行的OpenAI兼容服务; fake CPU上的假后端，只用于测试分发逻辑')
+    parser.add_argument('--llm_url', type=str, default='', help='http后端的服务地址（.../v1/chat/completions），多个用逗号分隔')
+    parser.add_argument('--model_name', type=str, default='', help='http后端请求中的model字段')
+    parser.add_argument('--concurrency', type=int, default=64, help='http后端每个端点的在途请求窗口')
+    parser.add_argument('--fake_delay', type=float, default=0.0, help='fake后端每条消息的模拟耗时（秒）')
+    return parser
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('--input', type=str, required=True, help='待评测数据集（jsonl）路径')
     parser.add_argument('--output', type=str, required=True, help='输出文件名')
-    parser.add_argument('--model_path', type=str, default='/mnt/new_pfs/liming_team/auroraX/LLM/Qwen3-4B', help='模型路径')
-    parser.add_argument('--mode', type=str, choices=['EVAL', 'MARCO'], default='EVAL', help='评测模式: EVAL(等价性判定) 或 MARCO(数学问题分析)')
-    parser.add_argument('--k', type=int, default=32, help='计算平均准确率时使用的k值')
+    add_eval_args(parser)
     args = parser.parse_args()
     main(args) 
 
@@ -213,5 +433,7 @@ if __name__ == "__main__":
 #   --mode MARCO
 
 # 输出格式说明:
-# EVAL模式: 输出文本文件，每行一个准确率数值
+# EVAL模式: 输出文本文件，每题一行avg@k；另存 <output去掉扩展名>_metrics.json（avg@k / pass@k / maj@k 及95%置信区间）和 _detail.jsonl，
+#           每行 {"index", "answer", "final_answer", "verdict", "path": rule_*/llm, "judge_outputs"}；
+#           以及 _rollouts.parquet / .npz（列式，eval_store.load_results 按列读取）
 # MARCO模式: 输出jsonl文件，每行包含 {"index": 序号, "question": "原始问题", "generated_response": "生成的分析"}
\ No newline at end of file
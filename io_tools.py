@@ -0,0 +1,211 @@
+import io
+import os
+import gzip
+import json
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+# 有orjson时用orjson编解码（比标准库快数倍），没有时退回json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# .zst 压缩文件需要zstandard，只在读写 .zst 时才要求安装
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 超过该大小的未压缩文件才值得多进程解析
+PARALLEL_MIN_BYTES = 64 * 1024 ** 2
+
+
+def loads(data) -> Any:
+    """解析一行JSON，接受str或bytes"""
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass  # orjson不接受NaN/Infinity等标准库能解析的写法
+    return json.loads(data)
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    """
+    序列化为UTF-8字节，不转义非ASCII字符，与 json.dumps(ensure_ascii=False) 一致；
+    注意用orjson时 NaN / Infinity 写成 null，标准库写成 NaN / Infinity，读回来是None而不是float
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass  # 超过64位的整数等orjson不支持的类型
+    return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+
+def dumps(obj: Any) -> str:
+    return dumps_bytes(obj).decode('utf-8')
+
+
+# 按扩展名打开文件（二进制）：.gz 用gzip，.zst 用zstandard，其他为普通文件
+def open_binary(path: str, mode: str = 'rb'):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode)
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError(f'读写 {path} 需要安装 zstandard: pip install zstandard')
+        f = open(path, mode)
+        if 'r' in mode:
+            # stream_reader默认读完第一帧就结束，追加写入的文件有多个帧
+            return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True, closefd=True))
+        # 追加模式每次打开写入一个新的zstd帧，读取时依靠 read_across_frames 拼接
+        return zstandard.ZstdCompressor(level=3).stream_writer(f, closefd=True)
+    return open(path, mode)
+
+
+# 续跑前截掉被中断时写了一半的末行，否则追加的第一条记录会接在它后面、两条一起无法解析
+def truncate_partial_line(path: str):
+    """把未压缩文件截断到最后一个换行符之后，文件不存在或以换行结尾时不做改动"""
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb+') as f:
+        end = pos = f.seek(0, os.SEEK_END)
+        while pos > 0:
+            step = min(1 << 16, pos)
+            f.seek(pos - step)
+            i = f.read(step).rfind(b'\n')
+            if i >= 0:
+                pos = pos - step + i + 1
+                break
+            pos -= step
+        if pos != end:
+            f.truncate(pos)
+
+
+# 惰性逐行读取jsonl，避免整文件载入内存
+def iter_jsonl(path: str, on_error: Optional[Callable[[bytes, Exception], Any]] = None,
+               skip_blank: bool = True) -> Iterator[Dict[str, Any]]:
+    """
+    Args:
+        path: jsonl文件路径，支持 .gz / .zst
+        on_error: 解析失败时调用 on_error(line, e)，返回值不为None时代替该行产出；默认直接抛出异常
+        skip_blank: 跳过空行；为False时空行按解析失败处理，产出的行与文件的行一一对应
+    """
+    with open_binary(path, 'rb') as f:
+        for line in f:
+            if skip_blank and not line.strip():
+                continue
+            if on_error is None:
+                yield loads(line)
+                continue
+            try:
+                yield loads(line)
+            except ValueError as e:
+                replacement = on_error(line, e)
+                if replacement is not None:
+                    yield replacement
+
+
+def _parse_range(path: str, start: int, end: int) -> List[Any]:
+    """解析文件 [start, end) 字节区间内的行，区间边界已对齐到行首"""
+    items = []
+    with open(path, 'rb') as f:
+        f.seek(start)
+        for line in f.read(end - start).splitlines():
+            if line.strip():
+                items.append(loads(line))
+    return items
+
+
+def _split_ranges(path: str, parts: int) -> List[tuple]:
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, 'rb') as f:
+        for i in range(1, parts):
+            f.seek(size * i // parts)
+            f.readline()
+            bounds.append(max(f.tell(), bounds[-1]))
+    bounds.append(size)
+    return [(bounds[i], bounds[i + 1]) for i in range(parts) if bounds[i] < bounds[i + 1]]
+
+
+def read_jsonl(path: str, workers: int = 0) -> List[Dict[str, Any]]:
+    """
+    一次性读取jsonl为列表
+
+    Args:
+        path: jsonl文件路径，支持 .gz / .zst
+        workers: 大于1且文件为未压缩的大文件时，按字节区间切分后用多进程并行解析，结果保持原顺序
+    """
+    if workers > 1 and not path.endswith(('.gz', '.zst')) and os.path.getsize(path) >= PARALLEL_MIN_BYTES:
+        ranges = _split_ranges(path, workers * 4)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            chunks = pool.map(_parse_range, [path] * len(ranges), [r[0] for r in ranges], [r[1] for r in ranges])
+            return [item for chunk in chunks for item in chunk]
+    return list(iter_jsonl(path))
+
+
+# 带缓冲的jsonl写入：攒够buffer_size行后一次写出
+class JsonlWriter:
+    def __init__(self, path: str, mode: str = 'w', buffer_size: int = 1000):
+        """
+        Args:
+            path: 输出路径，.gz / .zst 结尾时压缩写出
+            mode: 'w' 覆盖或 'a' 追加
+            buffer_size: 缓冲的行数
+        """
+        self.path = path
+        self.f = open_binary(path, mode + 'b')
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.count = 0
+
+    def write(self, item: Any):
+        self.buffer.append(dumps_bytes(item))
+        self.count += 1
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def write_all(self, items: Iterable[Any]):
+        for item in items:
+            self.write(item)
+
+    def flush(self):
+        if self.buffer:
+            self.f.write(b'\n'.join(self.buffer) + b'\n')
+            self.buffer = []
+        self.f.flush()
+
+    def close(self):
+        self.flush()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_jsonl(path: str, items: Iterable[Any], mode: str = 'w') -> int:
+    """写出jsonl，items可以是生成器（不会一次性展开），返回写出的行数"""
+    with JsonlWriter(path, mode) as writer:
+        writer.write_all(items)
+    return writer.count
+
+
+def read_txt(path: str) -> List[str]:
+    """按行读取文本文件，去掉行尾换行"""
+    with open_binary(path, 'rb') as f:
+        return [line.decode('utf-8').rstrip('\r\n') for line in f]
+
+
+def read_json(path: str) -> Any:
+    with open_binary(path, 'rb') as f:
+        return loads(f.read())
+
+
+def write_json(path: str, obj: Any, indent: int = 2):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(obj, f, ensure_ascii=False, indent=indent)
@@ -0,0 +1,150 @@
+import math
+import time
+import asyncio
+import json
+import hashlib
+import urllib.request
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+import equiv_rules
+
+# 判定模型的推理后端：统一为 chat(messages, sampling, chat_template_kwargs) 接口，
+# 返回与 vllm.LLM.chat 相同形状的结果（item.outputs[i].text / token_ids / logprobs），
+# evaluate_2_equiv 的解析逻辑不需要关心具体后端
+# sampling 为普通dict：temperature / top_p / top_k / max_tokens / n / logprobs
+
+
+class VllmBackend:
+    """进程内的vLLM，第一次调用时才加载模型，同一进程内的多次调用复用"""
+
+    def __init__(self, model_path: str, max_model_len: int):
+        self.model_path = model_path
+        self.max_model_len = max_model_len
+        self.llm = None
+
+    def chat(self, messages: List[List[Dict[str, str]]], sampling: Dict[str, Any],
+             chat_template_kwargs: Optional[Dict[str, Any]] = None) -> List[Any]:
+        from vllm import LLM, SamplingParams
+        if self.llm is None:
+            self.llm = LLM(model=self.model_path, max_model_len=self.max_model_len)
+        if chat_template_kwargs:
+            return self.llm.chat(messages, SamplingParams(**sampling), chat_template_kwargs=chat_template_kwargs)
+        return self.llm.chat(messages, SamplingParams(**sampling))
+
+
+class HttpBackend:
+    """
+    已在运行的OpenAI兼容服务（SGLang/vLLM serve），经 async_client_sglang 的调度器发送，
+    与rollout共用同一套并发窗口、重试和多端点负载均衡；进程内不加载模型，启动几乎没有开销
+    """
+
+    def __init__(self, url: str, model_name: str = '', concurrency: int = 64):
+        self.url = url
+        self.model_name = model_name
+        self.concurrency = concurrency
+
+    @staticmethod
+    def request_sampling(sampling: Dict[str, Any], chat_template_kwargs: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """vLLM的采样参数转成请求体：n 由调度器按行合并，logprobs=k 对应 OpenAI 的 logprobs + top_logprobs"""
+        body = {key: value for key, value in sampling.items() if key not in ('n', 'logprobs')}
+        if sampling.get('logprobs'):
+            body['logprobs'] = True
+            body['top_logprobs'] = sampling['logprobs']
+        if chat_template_kwargs:
+            body['chat_template_kwargs'] = chat_template_kwargs
+        return body
+
+    @staticmethod
+    def to_completion(result: Dict[str, Any], n: int) -> SimpleNamespace:
+        """接口返回的一个choice转成vLLM输出的形状，error_str/error_class 原样带上"""
+        logprobs = None
+        if result.get('logprobs'):
+            logprobs = [{rank: SimpleNamespace(decoded_token=c['token'], logprob=c['logprob'])
+                         for rank, c in enumerate(position.get('top_logprobs') or [position])}
+                        for position in result['logprobs'].get('content') or []]
+        # usage是整个n=k请求的，平均分给每个choice
+        completion_tokens = ((result.get('usage') or {}).get('completion_tokens') or 0) // n
+        return SimpleNamespace(text=result['content'], token_ids=range(completion_tokens), logprobs=logprobs,
+                               error_str=result['error_str'], error_class=result.get('error_class', ''))
+
+    def chat(self, messages: List[List[Dict[str, str]]], sampling: Dict[str, Any],
+             chat_template_kwargs: Optional[Dict[str, Any]] = None) -> List[Any]:
+        from async_client_sglang import process_async_batch
+        n = sampling.get('n', 1)
+        # 每条消息展开成n行，相邻的n行由调度器合并成一个 n=k 请求
+        rows = [{'messages': message} for message in messages for _ in range(n)]
+        results = asyncio.run(process_async_batch(rows, self.concurrency, self.url, self.model_name,
+                                                  sampling=self.request_sampling(sampling, chat_template_kwargs),
+                                                  n_per_request=n))
+        # 重试后仍失败的请求（4xx、超时等）没有模型输出，不能当成模型答错：空文本会被解析为 'error' 票、
+        # 判为false并写入判定库，之后的运行一直回放。整批报错，已写入判定库的批次下次直接命中
+        failed = [result for result in results if result['error_str']]
+        if failed:
+            raise RuntimeError(f"{self.url} 有{len(failed)}/{len(results)}条请求失败"
+                               f"（{failed[0].get('error_class', '')}）: {failed[0]['error_str'][:500]}")
+        return [SimpleNamespace(outputs=[self.to_completion(result, n) for result in results[i * n:(i + 1) * n]])
+                for i in range(len(messages))]
+
+
+class FakeBackend:
+    """
+    CPU上的假后端，用于测试任务分发和合并逻辑：按规则判等给出 true/false（规则无法判定时按内容哈希），
+    每条消息sleep delay秒模拟推理耗时
+    """
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+
+    def judge_word(self, content: str) -> str:
+        gt = content.split('# ground truth\n', 1)[-1].split('\n', 1)[0]
+        answer = content.split('# current answer\n', 1)[-1].split('\n', 1)[0]
+        verdict, _ = equiv_rules.check_equiv(gt, answer)
+        if verdict is None:
+            verdict = int(hashlib.md5(content.encode('utf-8')).hexdigest(), 16) % 2 == 0
+        return 'true' if verdict else 'false'
+
+    def chat(self, messages: List[List[Dict[str, str]]], sampling: Dict[str, Any],
+             chat_template_kwargs: Optional[Dict[str, Any]] = None) -> List[Any]:
+        thinking = (chat_template_kwargs or {}).get('enable_thinking', True)
+        results = []
+        for message in messages:
+            if self.delay:
+                time.sleep(self.delay)
+            word = self.judge_word(message[-1]['content'])
+            text = f'<think>fake</think>\n\n{word}' if thinking else word
+            logprobs = None
+            if sampling.get('logprobs'):
+                p = 0.9 if word == 'true' else 0.1
+                logprobs = [{0: SimpleNamespace(decoded_token='true', logprob=math.log(p)),
+                             1: SimpleNamespace(decoded_token='false', logprob=math.log(1 - p))}]
+            outputs = [SimpleNamespace(text=text, token_ids=[0] * len(text), logprobs=logprobs)
+                       for _ in range(sampling.get('n', 1))]
+            results.append(SimpleNamespace(outputs=outputs))
+        return results
+
+
+def served_model(url: str) -> str:
+    """
+    服务实际加载的模型（/v1/models 的id），多个模型时按名字排序后拼接。
+    url 可以是服务根地址或 .../v1/chat/completions；用于产物和判定库的key，yaml/参数中的模型路径可能与服务不一致
+    """
+    root = url.split('/v1/', 1)[0]
+    with urllib.request.urlopen(root + '/v1/models', timeout=10) as resp:
+        ids = sorted(m['id'] for m in json.loads(resp.read())['data'])
+    if not ids:
+        raise RuntimeError(f'{root}/v1/models 没有返回模型')
+    return ','.join(ids)
+
+
+def make_backend(name: str, model_path: str, max_model_len: int, fake_delay: float = 0.0,
+                 llm_url: str = '', model_name: str = '', concurrency: int = 64):
+    if name == 'vllm':
+        return VllmBackend(model_path, max_model_len)
+    if name == 'http':
+        if not llm_url:
+            raise ValueError('http后端需要 --llm_url')
+        return HttpBackend(llm_url, model_name, concurrency)
+    if name == 'fake':
+        return FakeBackend(fake_delay)
+    raise ValueError(f'未知的推理后端: {name}')
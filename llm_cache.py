@@ -0,0 +1,130 @@
+import json
+import time
+import sqlite3
+import threading
+import hashlib
+from typing import Dict, Any, Optional
+
+
+# 缓存key：模型、messages、schema、采样参数（以及提前终止条件）的内容哈希
+def make_cache_key(model_name: str, messages: list, schema: Any, sampling: Dict[str, Any],
+                   sample_idx: Optional[int] = None, seed: Optional[int] = None,
+                   stop_condition: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Args:
+        model_name: 模型名称
+        messages: 发给接口的messages
+        schema: JSON schema，没有时为''
+        sampling: 采样参数（temperature / top_p / max_tokens 等）
+        sample_idx: 同一prompt的第几个采样。temperature>0时同一prompt的k个采样各占一个key，
+            否则重跑时k个rollout会命中同一条结果
+        seed: 显式指定的随机种子，参与key
+        stop_condition: 流式提前终止条件（max_chars / stop_strings 等），提前截断的输出与完整生成不能共用key
+
+    Returns:
+        sha256十六进制串
+    """
+    key = {
+        'model': model_name,
+        'messages': messages,
+        'schema': schema or '',
+        'sampling': sampling,
+    }
+    if sampling.get('temperature', 1) > 0:
+        key['sample_idx'] = sample_idx or 0
+    if seed is not None:
+        key['seed'] = seed
+    if stop_condition:
+        key['stop_condition'] = stop_condition
+    return hashlib.sha256(json.dumps(key, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+# 磁盘上的响应缓存：SQLite单文件，按总大小做LRU淘汰
+# 多个进程可以共用同一文件：每次put单独提交，读不写库（访问时间先记在内存里，攒够一批再在一个短事务里写回），
+# 写锁只在一次写入期间持有；同一对象可以在多个线程中使用
+class ResponseCache:
+    def __init__(self, path: str, max_bytes: int = 10 * 1024 ** 3, commit_every: int = 200):
+        """
+        Args:
+            path: SQLite文件路径
+            max_bytes: 缓存内容总大小上限，超过后按最近访问时间淘汰到90%
+            commit_every: 命中多少次后把攒下的访问时间写回一次
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.commit_every = commit_every
+        self.lock = threading.Lock()
+        # 其他进程正在写入时等待其提交（每次写入都很短），而不是立即报 database is locked
+        self.conn = sqlite3.connect(path, timeout=120, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_last_access ON responses(last_access)')
+        self.total_bytes = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        self.conn.commit()
+        self.touched = {}  # key -> 最近访问时间，尚未写回
+        self.stats = {'hits': 0, 'misses': 0, 'writes': 0, 'evicted': 0}
+
+    def get(self, key: str) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute('SELECT value FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+            self.stats['hits'] += 1
+            self.touched[key] = time.time()
+            if len(self.touched) >= self.commit_every:
+                self._flush_touched()
+                self.conn.commit()
+            return row[0]
+
+    def put(self, key: str, value: str):
+        size = len(value.encode('utf-8'))
+        with self.lock:
+            old = self.conn.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            self.conn.execute(
+                'INSERT OR REPLACE INTO responses (key, value, size, last_access) VALUES (?, ?, ?, ?)',
+                (key, value, size, time.time())
+            )
+            self.touched.pop(key, None)
+            self.total_bytes += size - (old[0] if old else 0)
+            self.stats['writes'] += 1
+            if self.total_bytes > self.max_bytes:
+                self._flush_touched()
+                self.evict(int(self.max_bytes * 0.9))
+            self.conn.commit()
+
+    def flush(self):
+        """写回攒下的访问时间"""
+        with self.lock:
+            self._flush_touched()
+            self.conn.commit()
+
+    def _flush_touched(self):
+        if self.touched:
+            self.conn.executemany('UPDATE responses SET last_access = ? WHERE key = ?',
+                                  [(t, key) for key, t in self.touched.items()])
+            self.touched = {}
+
+    def evict(self, target_bytes: int):
+        """按最近访问时间从旧到新删除，直到总大小不超过target_bytes"""
+        cursor = self.conn.execute('SELECT key, size FROM responses ORDER BY last_access ASC')
+        to_delete = []
+        for key, size in cursor:
+            if self.total_bytes <= target_bytes:
+                break
+            to_delete.append((key,))
+            self.total_bytes -= size
+        self.conn.executemany('DELETE FROM responses WHERE key = ?', to_delete)
+        self.stats['evicted'] += len(to_delete)
+
+    def hit_rate(self) -> float:
+        lookups = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / lookups if lookups else 0.0
+
+    def close(self):
+        self.flush()
+        self.conn.close()
@@ -0,0 +1,204 @@
+import json
+import math
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+import collections
+from typing import Dict, Any, List
+from aiohttp import web
+
+# 本地模拟的OpenAI兼容推理服务，用于在没有GPU的机器上测试和压测 async_client_sglang.py
+# 延迟模型：排队（超过capacity的请求等待） + 首token时间(ttft) + 输出token数 / 解码速度
+DEFAULT_MOCK_CONFIG = {
+    'model_name': 'mock-model',
+    'capacity': 256,          # 同时解码的请求数上限，超出的请求排队，模拟服务端饱和
+    'ttft_dist': 'lognormal',  # fixed / uniform / exponential / lognormal
+    'ttft_mean': 0.05,        # 首token时间均值（秒）
+    'ttft_sigma': 0.5,        # lognormal的sigma，uniform时为 ±比例
+    'tokens_per_s': 2000.0,   # 单请求解码速度，0表示不模拟解码耗时
+    'output_tokens': 64,      # 每个采样的输出token数均值（几何分布抖动）
+    'error_rate': 0.0,        # 返回 error_status 的概率
+    'error_status': 503,
+    'timeout_rate': 0.0,      # 挂起 hang_seconds 不返回的概率，用于测试客户端超时
+    'hang_seconds': 3600.0,
+    'prefix_block_chars': 256,  # 前缀缓存的块大小（字符），用于模拟 cached_tokens
+    'prefix_cache_blocks': 100000,  # 前缀缓存容量（块数），超出后按LRU淘汰
+}
+
+
+def sample_delay(dist: str, mean: float, sigma: float, rng: random.Random) -> float:
+    if mean <= 0:
+        return 0.0
+    if dist == 'fixed':
+        return mean
+    if dist == 'uniform':
+        return rng.uniform(mean * (1 - sigma), mean * (1 + sigma))
+    if dist == 'exponential':
+        return rng.expovariate(1 / mean)
+    if dist == 'lognormal':
+        # 均值保持为mean
+        return rng.lognormvariate(0, sigma) * mean / math.exp(sigma ** 2 / 2)
+    raise ValueError(f'未知的延迟分布: {dist}')
+
+
+def sample_output_tokens(mean: int, rng: random.Random) -> int:
+    if mean <= 1:
+        return 1
+    # 几何分布，均值为mean
+    p = 1 / mean
+    n = 1
+    while rng.random() > p and n < mean * 20:
+        n += 1
+    return n
+
+
+def make_content(body: Dict[str, Any], choice_idx: int, tokens: int) -> str:
+    """有 response_format 时输出满足 analysis/final_answer 结构的JSON，否则输出纯文本"""
+    filler = ' '.join(['step'] * max(tokens - 8, 0))
+    if body.get('response_format'):
+        return json.dumps({'analysis': filler, 'final_answer': str(choice_idx)}, ensure_ascii=False)
+    return f'{filler} \\boxed{{{choice_idx}}}'
+
+
+def make_logprobs(content: str, top_logprobs: int, rng: random.Random) -> Dict[str, Any]:
+    """按4字符1个token切分，每个位置给出实际token和几个 true/false 候选的对数概率"""
+    positions = []
+    for i in range(0, len(content), 4):
+        token = content[i:i + 4]
+        p = rng.uniform(0.5, 0.99)
+        candidates = [{'token': token, 'logprob': math.log(p)}]
+        for word in ('true', 'false'):
+            if word != token:
+                candidates.append({'token': word, 'logprob': math.log((1 - p) / 2)})
+        top = candidates[:max(top_logprobs, 1)]
+        positions.append({'token': token, 'logprob': top[0]['logprob'], 'top_logprobs': top})
+    return {'content': positions}
+
+
+class MockServer:
+    def __init__(self, config: Dict[str, Any], seed: int = 0):
+        self.config = dict(DEFAULT_MOCK_CONFIG, **config)
+        self.rng = random.Random(seed)
+        self.slots = asyncio.Semaphore(self.config['capacity'])
+        self.prefix_blocks = collections.OrderedDict()
+        self.stats = {'requests': 0, 'in_flight': 0, 'errors': 0, 'hangs': 0}
+
+    def prompt_usage(self, messages: List[Dict[str, str]]) -> Dict[str, Any]:
+        """prompt token按4字符1个估计；已见过的前缀块计入 cached_tokens，模拟服务端的前缀缓存"""
+        text = ''.join(m.get('role', '') + ':' + str(m.get('content', '')) for m in messages)
+        block = self.config['prefix_block_chars']
+        cached_chars = 0
+        h = hashlib.sha1()
+        hit = True
+        for start in range(0, len(text) - len(text) % block, block):
+            h.update(text[start:start + block].encode('utf-8'))
+            key = h.hexdigest()
+            if hit and key in self.prefix_blocks:
+                cached_chars += block
+                self.prefix_blocks.move_to_end(key)
+            else:
+                hit = False
+                self.prefix_blocks[key] = None
+                if len(self.prefix_blocks) > self.config['prefix_cache_blocks']:
+                    self.prefix_blocks.popitem(last=False)
+        return {'prompt_tokens': max(1, len(text) // 4), 'prompt_tokens_details': {'cached_tokens': cached_chars // 4}}
+
+    async def chat(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        cfg = self.config
+        self.stats['requests'] += 1
+        if self.rng.random() < cfg['error_rate']:
+            self.stats['errors'] += 1
+            return web.json_response({'error': {'message': 'mock injected error'}}, status=cfg['error_status'])
+        if self.rng.random() < cfg['timeout_rate']:
+            self.stats['hangs'] += 1
+            await asyncio.sleep(cfg['hang_seconds'])
+
+        n = body.get('n', 1)
+        max_tokens = body.get('max_tokens') or 1 << 30
+        tokens = [min(sample_output_tokens(cfg['output_tokens'], self.rng), max_tokens) for _ in range(n)]
+        contents = [make_content(body, i, tokens[i]) for i in range(n)]
+        usage = self.prompt_usage(body.get('messages', []))
+        usage['completion_tokens'] = sum(tokens)
+        usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+        created = int(time.time())
+        response_id = f'chatcmpl-mock-{self.stats["requests"]}'
+
+        async with self.slots:
+            self.stats['in_flight'] += 1
+            try:
+                await asyncio.sleep(sample_delay(cfg['ttft_dist'], cfg['ttft_mean'], cfg['ttft_sigma'], self.rng))
+                if not body.get('stream'):
+                    if cfg['tokens_per_s'] > 0:
+                        await asyncio.sleep(max(tokens) / cfg['tokens_per_s'])
+                    return web.json_response({
+                        'id': response_id,
+                        'object': 'chat.completion',
+                        'created': created,
+                        'model': body.get('model') or cfg['model_name'],
+                        'choices': [{'index': i, 'message': {'role': 'assistant', 'content': contents[i]}, 'finish_reason': 'stop',
+                                     'logprobs': make_logprobs(contents[i], body.get('top_logprobs') or 0, self.rng) if body.get('logprobs') else None}
+                                    for i in range(n)],
+                        'usage': usage,
+                    })
+                return await self.stream(request, body, contents, usage, response_id, created)
+            finally:
+                self.stats['in_flight'] -= 1
+
+    async def stream(self, request: web.Request, body: Dict[str, Any], contents: List[str], usage: Dict[str, Any],
+                     response_id: str, created: int) -> web.StreamResponse:
+        """按OpenAI的SSE格式逐块输出，每块约4个字符（1个token），n>1时各choice交替输出"""
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+        await response.prepare(request)
+        model = body.get('model') or self.config['model_name']
+
+        async def send(choices, extra=None):
+            chunk = {'id': response_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model, 'choices': choices}
+            chunk.update(extra or {})
+            await response.write(f'data: {json.dumps(chunk, ensure_ascii=False)}\n\n'.encode('utf-8'))
+
+        pieces = [[content[i:i + 4] for i in range(0, len(content), 4)] for content in contents]
+        delay = 1 / self.config['tokens_per_s'] if self.config['tokens_per_s'] > 0 else 0
+        # 客户端提前断开（提前终止）时write抛出ConnectionResetError，由aiohttp处理
+        for step in range(max(len(p) for p in pieces)):
+            for i, p in enumerate(pieces):
+                if step < len(p):
+                    await send([{'index': i, 'delta': {'content': p[step]}, 'finish_reason': None}])
+            if delay:
+                await asyncio.sleep(delay)
+        await send([{'index': i, 'delta': {}, 'finish_reason': 'stop'} for i in range(len(contents))])
+        if (body.get('stream_options') or {}).get('include_usage'):
+            await send([], {'usage': usage})
+        await response.write(b'data: [DONE]\n\n')
+        return response
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.json_response({'status': 'ok', **self.stats})
+
+    async def models(self, request: web.Request) -> web.Response:
+        return web.json_response({'object': 'list', 'data': [{'id': self.config['model_name'], 'object': 'model', 'owned_by': 'mock'}]})
+
+
+def make_app(config: Dict[str, Any], seed: int = 0) -> web.Application:
+    server = MockServer(config, seed)
+    app = web.Application(client_max_size=64 * 1024 ** 2)
+    app.router.add_post('/v1/chat/completions', server.chat)
+    app.router.add_get('/health', server.health)
+    app.router.add_get('/v1/models', server.models)
+    app['mock_server'] = server
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='本地模拟的OpenAI兼容推理服务')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7373)
+    parser.add_argument('--seed', type=int, default=0)
+    for key, value in DEFAULT_MOCK_CONFIG.items():
+        parser.add_argument(f'--{key}', type=type(value), default=value)
+    args = parser.parse_args()
+    config = {key: getattr(args, key) for key in DEFAULT_MOCK_CONFIG}
+    print(f'mock服务: http://{args.host}:{args.port}/v1/chat/completions {config}', flush=True)
+    web.run_app(make_app(config, args.seed), host=args.host, port=args.port, print=None, access_log=None)
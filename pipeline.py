@@ -0,0 +1,698 @@
+import os
+import sys
+import json
+import shutil
+import hashlib
+import time
+import queue
+import signal
+import asyncio
+import argparse
+import threading
+import traceback
+import subprocess
+import urllib.request
+from typing import Any, Callable, Dict, Iterator, List
+
+import yaml
+
+import io_tools
+import PreRollout
+from async_client_sglang import process_async_stream, format_stats, DEFAULT_SAMPLING
+from evaluate_2_equiv import (add_eval_args, make_judge_backend, judge_rows, detail_rows, detail_path, metrics_path,
+                              judge_signature, write_eval_results, get_marco_prompt, build_messages_marco,
+                              extract_answer_marco, marco_sampling_params, MARCO_MAX_TOKENS)
+from judge_backends import make_backend, served_model
+from llm_cache import ResponseCache
+
+# 由 run.yaml 驱动的流水线，取代 scripts/EvaluateMarco.sh 中顺序执行、靠 cat / split / sleep+wc -l 轮询衔接的各步骤：
+#
+#   source -> GenMarco -> PreRollout -> Rollout -> Eval      （base模式没有GenMarco）
+#
+# 每个阶段一个线程，阶段之间是有界队列（Stream）：
+# - 上游产出一条，下游就能处理一条：rollout从第一批plan开始发请求，一个题目的k个rollout齐了就交给判定
+# - 队列满时上游阻塞（反压），在途数据量有上限，不会因为某个阶段慢而把整个数据集堆在内存里
+# - 阶段正常结束时显式发出结束信号，下游据此结束，不再靠数行数判断完成；
+#   任一阶段出错时整个流水线中止，下游不会把不完整的数据当作结果写出
+# 端到端耗时接近最慢的阶段，而不是各阶段之和
+#
+# 阶段产物按内容寻址（见 ArtifactStore）：每个阶段的key由上游的key和本阶段的模型路径、prompt模板、采样参数等算出，
+# key相同的产物跨任务共用；只改 models.eval 时GenMarco和rollout直接复用，只重跑判定
+
+# key的计算方式或产物布局变化时加1，旧产物不再命中
+CAS_VERSION = 2
+
+# 结束信号
+END = object()
+
+
+class PipelineAborted(Exception):
+    """其他阶段出错，本阶段随之退出"""
+
+
+class Stream:
+    """阶段之间的有界队列：put 在队列满时阻塞，close 发出结束信号，读取方迭代到结束信号为止"""
+
+    def __init__(self, name: str, maxsize: int, abort: threading.Event):
+        self.name = name
+        self.queue = queue.Queue(maxsize)
+        self.abort = abort
+        self.count = 0
+        self.first_at = None
+
+    def _put(self, item):
+        while True:
+            if self.abort.is_set():
+                raise PipelineAborted(self.name)
+            try:
+                self.queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self):
+        while True:
+            try:
+                return self.queue.get(timeout=0.5)
+            except queue.Empty:
+                if self.abort.is_set():
+                    raise PipelineAborted(self.name)
+
+    def put(self, item):
+        if self.first_at is None:
+            self.first_at = time.time()
+        self.count += 1
+        self._put(item)
+
+    def close(self):
+        self._put(END)
+
+    def __iter__(self) -> Iterator[Any]:
+        while True:
+            item = self._get()
+            if item is END:
+                return
+            yield item
+
+    def batches(self, max_items: int) -> Iterator[List[Any]]:
+        """每批至少1条、最多max_items条：阻塞等第一条，之后只取队列中已有的，不为凑满一批而等待"""
+        while True:
+            item = self._get()
+            if item is END:
+                return
+            batch = [item]
+            while len(batch) < max_items:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is END:
+                    yield batch
+                    return
+                batch.append(item)
+            yield batch
+
+
+class Stage(threading.Thread):
+    """运行一个阶段函数；正常返回时关闭输出流，出错时记录错误并中止整个流水线"""
+
+    def __init__(self, name: str, target: Callable[[], None], outputs: List[Stream], abort: threading.Event):
+        super().__init__(name=name, daemon=True)
+        self.target = target
+        self.outputs = outputs
+        self.abort = abort
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+
+    def run(self):
+        self.started_at = time.time()
+        try:
+            self.target()
+            for stream in self.outputs:
+                stream.close()
+        except PipelineAborted:
+            pass
+        except Exception:
+            self.error = traceback.format_exc()
+            self.abort.set()
+        finally:
+            self.finished_at = time.time()
+
+
+def load_config(path: str) -> Dict[str, Any]:
+    with open(path) as f:
+        cfg = yaml.safe_load(f)
+    for section, key in [('task', 'name_prefix'), ('task', 'output_root'), ('models', 'marco'), ('models', 'rollout'),
+                         ('models', 'eval'), ('data', 'input_jsonl')]:
+        if not (cfg.get(section) or {}).get(key):
+            raise ValueError(f'配置文件中缺少必要参数: {section}.{key}')
+    return cfg
+
+
+def runtime(cfg: Dict[str, Any], key: str, default: Any = None) -> Any:
+    value = (cfg.get('runtime') or {}).get(key)
+    return default if value is None or value == '' else value
+
+
+def service_urls(cfg: Dict[str, Any]) -> List[str]:
+    """rollout服务的根地址，与 EvaluateMarco.sh 相同：remote用 sglang_url，local用本机端口，再加上 sglang_extra_urls"""
+    if runtime(cfg, 'service_mode', 'local') == 'remote':
+        urls = [runtime(cfg, 'sglang_url', 'http://10.202.4.81:8001')]
+    else:
+        urls = [f"http://0.0.0.0:{runtime(cfg, 'sglang_port', 7373)}"]
+    urls += [u.strip() for u in str(runtime(cfg, 'sglang_extra_urls', '')).split(',') if u.strip()]
+    return urls
+
+
+def start_local_service(cfg: Dict[str, Any]) -> subprocess.Popen:
+    """local模式在后台启动sglang，单独的进程组，结束时整组停止"""
+    script = (cfg.get('scripts') or {}).get('run_sglang', '/mnt/new_pfs/liming_team/auroraX/mxd/a_x1/RunSglang/run_sglang.sh')
+    cmd = ['bash', script, str(runtime(cfg, 'sglang_cuda', '0,1,2,3')), cfg['models']['rollout'],
+           str(runtime(cfg, 'sglang_port', 7373))]
+    print(f"启动本地sglang服务: {' '.join(cmd)}")
+    return subprocess.Popen(cmd, start_new_session=True)
+
+
+def stop_local_service(proc: subprocess.Popen):
+    if proc.poll() is None:
+        os.killpg(proc.pid, signal.SIGINT)
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            os.killpg(proc.pid, signal.SIGKILL)
+
+
+def service_ready(url: str) -> bool:
+    for path in ('/health', '/v1/models'):
+        try:
+            with urllib.request.urlopen(url + path, timeout=5):
+                return True
+        except Exception:
+            continue
+    return False
+
+
+def served_models(urls: List[str]) -> str:
+    """remote服务的模型身份：所有副本必须加载同一个模型，否则产物无法按key复用"""
+    models = {url: served_model(url) for url in urls}
+    if len(set(models.values())) > 1:
+        raise ValueError(f'各服务副本加载的模型不一致: {models}')
+    return next(iter(models.values()))
+
+
+def wait_for_service(urls: List[str], max_wait: float, interval: float, abort: threading.Event):
+    """所有副本都可用才返回，超过max_wait秒抛错"""
+    start = time.time()
+    while True:
+        pending = [url for url in urls if not service_ready(url)]
+        if not pending:
+            print(f"✓ sglang服务可用: {', '.join(urls)}")
+            return
+        if time.time() - start >= max_wait:
+            raise RuntimeError(f'sglang服务不可用: {pending}')
+        if abort.is_set():
+            raise PipelineAborted('wait_for_service')
+        print(f"[{time.strftime('%H:%M:%S')}] 等待服务 {pending} ... ({time.time() - start:.0f}s/{max_wait}s)")
+        time.sleep(interval)
+
+
+def eval_args(cfg: Dict[str, Any], output: str) -> argparse.Namespace:
+    """判定参数与 evaluate_2_equiv / eval_launcher 相同，取值来自 run.yaml"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output', type=str)
+    add_eval_args(parser)
+    argv = ['--output', output, '--model_path', cfg['models']['eval'], '--mode', 'EVAL',
+            '--k', str(runtime(cfg, 'copy', 1)),
+            '--judge', runtime(cfg, 'judge_mode', 'think'),
+            '--voting', runtime(cfg, 'judge_voting', 'parallel'),
+            '--vote_budget', str(runtime(cfg, 'vote_budget', 3)),
+            '--backend', runtime(cfg, 'judge_backend', 'vllm')]
+    if runtime(cfg, 'verdict_store'):
+        argv += ['--verdict_store', runtime(cfg, 'verdict_store')]
+    if runtime(cfg, 'judge_url'):
+        argv += ['--llm_url', runtime(cfg, 'judge_url')]
+    return parser.parse_args(argv)
+
+
+def final_answer(llm_output: str) -> str:
+    """与 ProcessedRollout.py 相同：输出不是合法JSON时记为 'json error'"""
+    try:
+        return io_tools.loads(llm_output)['final_answer']
+    except Exception:
+        return 'json error'
+
+
+def file_digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def text_digest(text: str) -> str:
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def stage_recipes(cfg: Dict[str, Any], mode: str, k: int, judge: argparse.Namespace,
+                  served: Dict[str, str] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    决定各阶段产物的全部因素（上游产物由key链传递，这里只列本阶段自己的）：模型、prompt模板、采样参数等。
+    后端、并发、端点地址等只影响速度的配置不参与。
+    served: 请求发往已在运行的服务的阶段 -> 服务实际加载的模型，代替yaml中的模型路径（yaml可能与服务不一致）
+    """
+    served = served or {}
+    recipes = {}
+    if mode == 'plan':
+        recipes['GenMarco'] = {'model': served.get('GenMarco', cfg['models']['marco']), 'prompt': text_digest(get_marco_prompt()),
+                               'sampling': marco_sampling_params()}
+    recipes['PreRollout'] = {'mode': mode, 'prompt': text_digest(PreRollout.get_config(mode)['prompt']),
+                             'expand_count': k, 'schema': PreRollout.SolveDict.model_json_schema()}
+    recipes['Rollout'] = {'model': served.get('Rollout', cfg['models']['rollout']), 'sampling': DEFAULT_SAMPLING}
+    recipes['Eval'] = dict(judge_signature(judge), rules=judge.rules, voting=judge.voting, k=k,
+                           pass_k=judge.pass_k, bootstrap=judge.bootstrap, results_format=judge.results_format)
+    return recipes
+
+
+def stage_manifests(input_path: str, recipes: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """每个阶段的key = hash(上游阶段的key, 本阶段的recipe)，第一个阶段的上游是输入文件的内容hash"""
+    upstream = file_digest(input_path)
+    manifests = {}
+    for name, recipe in recipes.items():
+        manifest = {'version': CAS_VERSION, 'stage': name, 'upstream': upstream, 'recipe': recipe}
+        manifest['key'] = hashlib.sha256(json.dumps(manifest, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+        manifests[name] = manifest
+        upstream = manifest['key']
+    return manifests
+
+
+class ArtifactStore:
+    """
+    按内容地址存放阶段产物：<root>/<阶段>/<key>/ 下是该阶段的输出文件和 manifest.json。
+    阶段先写到临时目录，成功结束后整体改名，目录存在即表示产物完整；不同任务的相同key共用同一份产物
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, stage: str, key: str) -> str:
+        return os.path.join(self.root, stage, key)
+
+    def has(self, stage: str, key: str) -> bool:
+        return os.path.exists(os.path.join(self.path(stage, key), 'manifest.json'))
+
+    def staging(self, stage: str, key: str) -> str:
+        path = f'{self.path(stage, key)}.tmp-{os.getpid()}'
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+        return path
+
+    def commit(self, staging: str, manifest: Dict[str, Any], replace: bool = False):
+        """replace=True 时替换已有的同key产物（已链接到其他任务目录的文件不受影响）"""
+        io_tools.write_json(os.path.join(staging, 'manifest.json'), dict(manifest, created_at=time.strftime('%Y-%m-%d %H:%M:%S')))
+        final = self.path(manifest['stage'], manifest['key'])
+        if replace and os.path.exists(final):
+            old = f'{final}.old-{os.getpid()}'
+            os.rename(final, old)
+            shutil.rmtree(old, ignore_errors=True)
+        try:
+            os.rename(staging, final)
+        except OSError:
+            # 另一个任务已经提交了相同key的产物
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def link(self, stage: str, key: str, dest_dir: str):
+        """把产物链接到任务目录（不能硬链接时复制），任务目录的文件布局与不缓存时相同"""
+        os.makedirs(dest_dir, exist_ok=True)
+        src_dir = self.path(stage, key)
+        for name in os.listdir(src_dir):
+            if name == 'manifest.json':
+                continue
+            dest = os.path.join(dest_dir, name)
+            if os.path.lexists(dest):
+                os.remove(dest)
+            try:
+                os.link(os.path.join(src_dir, name), dest)
+            except OSError:
+                shutil.copy2(os.path.join(src_dir, name), dest)
+
+
+def run_pipeline(cfg: Dict[str, Any], base_dir: str, reuse: bool = True) -> Dict[str, Any]:
+    """
+    按 run.yaml 运行整个流水线，输出文件与 EvaluateMarco.sh 相同：
+    Gen/GenMarco.jsonl、Gen/GenMarco.jsonl.plan、Rollout/merged.jsonl、Rollout/merged_processed.jsonl、Eval/equiv_results.txt 等
+
+    各阶段的产物按key存入 ArtifactStore 后再链接到任务目录。reuse=True 时从最后一个已有产物的阶段接着跑：
+    该阶段直接从产物回放输出，之前的阶段不运行；例如只换了 models.eval，只重跑判定
+
+    Returns:
+        {'metrics': 指标汇总, 'outputs': 输出路径, 'stages': 各阶段的key、状态（computed / replayed / skipped / cached，以及计算了但因产物不完整未提交的 uncached）
+         以及运行过的阶段的起止时间和产出条数}
+    """
+    k = int(runtime(cfg, 'copy', 1))
+    mode = runtime(cfg, 'prerollout_mode', 'plan')
+    buffer = int(runtime(cfg, 'stream_buffer', 1024))
+    checks = cfg.get('checks') or {}
+    dirs = {'GenMarco': os.path.join(base_dir, 'Gen'), 'PreRollout': os.path.join(base_dir, 'Gen'),
+            'Rollout': os.path.join(base_dir, 'Rollout'), 'Eval': os.path.join(base_dir, 'Eval')}
+    paths = {
+        'gen_marco': os.path.join(dirs['GenMarco'], 'GenMarco.jsonl'),
+        'plan': os.path.join(dirs['PreRollout'], 'GenMarco.jsonl.plan'),
+        'rollout_dir': dirs['Rollout'],
+        'eval_dir': dirs['Eval'],
+        'eval_results': os.path.join(dirs['Eval'], 'equiv_results.txt'),
+    }
+    paths['eval_metrics'] = metrics_path(paths['eval_results'])
+
+    judge = eval_args(cfg, paths['eval_results'])
+    # 发往已在运行的服务的阶段按服务实际加载的模型算key（remote模式要先等服务可用）；local模式的服务由本流水线用 models.rollout 启动
+    served = {}
+    if runtime(cfg, 'service_mode', 'local') == 'remote':
+        urls = service_urls(cfg)
+        wait_for_service(urls, float(checks.get('max_wait_time', 300)), float(checks.get('wait_interval', 10)), threading.Event())
+        served['Rollout'] = served_models(urls)
+    if mode == 'plan' and runtime(cfg, 'marco_backend', 'vllm') == 'http':
+        served['GenMarco'] = served_model(runtime(cfg, 'marco_url', ''))
+    manifests = stage_manifests(cfg['data']['input_jsonl'], stage_recipes(cfg, mode, k, judge, served))
+    names = list(manifests)
+    store = ArtifactStore(runtime(cfg, 'cas_dir', os.path.join(cfg['task']['output_root'], 'cas')))
+    hits = [i for i, name in enumerate(names) if reuse and store.has(name, manifests[name]['key'])]
+    # 最后一个有产物的阶段回放，之前的阶段跳过，之后的阶段计算
+    resume = hits[-1] if hits else -1
+    status = {name: 'skipped' if i < resume else 'replayed' if i == resume else 'computed' for i, name in enumerate(names)}
+    if resume == len(names) - 1:
+        status['Eval'] = 'cached'
+    print('各阶段: ' + ', '.join(f"{name}={status[name]}({manifests[name]['key'][:12]})" for name in names))
+
+    marco_backend_name = runtime(cfg, 'marco_backend', 'vllm')
+    computing_vllm = [name for name, backend in (('GenMarco', marco_backend_name), ('Eval', judge.backend))
+                      if status.get(name) == 'computed' and backend == 'vllm']
+    if len(computing_vllm) > 1:
+        raise ValueError('流水线在同一进程内运行GenMarco和判定，marco_backend 与 judge_backend 不能同时为 vllm，'
+                         '请把其中一个改为 http（指向已在运行的服务）')
+    if computing_vllm:
+        # 进程内的vLLM只使用 vllm_cuda 的第一张卡，多卡判定请用 eval_launcher 或 http 后端
+        os.environ.setdefault('CUDA_VISIBLE_DEVICES', str(runtime(cfg, 'vllm_cuda', '0')).split(',')[0])
+
+    staging = {name: store.staging(name, manifests[name]['key']) for name in names if status[name] == 'computed'}
+    if 'Eval' in staging:
+        judge.output = os.path.join(staging['Eval'], 'equiv_results.txt')
+
+    abort = threading.Event()
+    questions = Stream('questions', buffer, abort)
+    marcos = Stream('marcos', buffer, abort)
+    plans = Stream('plans', buffer, abort)
+    groups = Stream('groups', buffer, abort)
+    streams = {'source': questions, 'GenMarco': marcos, 'PreRollout': plans, 'Rollout': groups}
+    if mode != 'plan':
+        streams['GenMarco'] = marcos = questions
+    result = {}
+    incomplete = {}  # 阶段 -> 产物不完整的原因，这些阶段及其下游不提交到产物库
+
+    def artifact(stage, name):
+        """本阶段回放时读取的产物文件"""
+        return os.path.join(store.path(stage, manifests[stage]['key']), name)
+
+    def source():
+        for i, item in enumerate(io_tools.iter_jsonl(cfg['data']['input_jsonl'])):
+            item.setdefault('question_id', str(i))
+            questions.put(item)
+
+    def gen_marco():
+        backend = make_backend(marco_backend_name, cfg['models']['marco'], MARCO_MAX_TOKENS,
+                               llm_url=runtime(cfg, 'marco_url', ''), concurrency=int(runtime(cfg, 'marco_concurrency', 64)))
+        prompt = get_marco_prompt()
+        index = 0
+        with io_tools.JsonlWriter(os.path.join(staging['GenMarco'], 'GenMarco.jsonl')) as writer:
+            for batch in questions.batches(int(runtime(cfg, 'marco_batch', 256))):
+                outputs = backend.chat(build_messages_marco(batch, prompt), marco_sampling_params())
+                for item, output in zip(batch, outputs):
+                    record = {
+                        'index': index,
+                        'question': item.get('question', ''),
+                        'sub_questions': extract_answer_marco(output),
+                        'answer': item.get('answer', ''),
+                        'question_id': item['question_id'],
+                    }
+                    writer.write(record)
+                    marcos.put(record)
+                    index += 1
+
+    def replay_marco():
+        for record in io_tools.iter_jsonl(artifact('GenMarco', 'GenMarco.jsonl')):
+            marcos.put(record)
+
+    def emit_plans(items):
+        schemas = {}
+        for item in items:
+            if 'plan_version' in item:
+                schemas = item['schemas']
+                continue
+            plans.put(dict(item, schema=schemas[item['schema_ref']]))
+
+    def pre_rollout():
+        # 计划文件只作记录（与 PreRollout.py 的compact格式相同），rollout直接从流中取
+        with io_tools.JsonlWriter(os.path.join(staging['PreRollout'], 'GenMarco.jsonl.plan')) as writer:
+            def written():
+                for item in PreRollout.generate_plan(iter(marcos), PreRollout.get_config(mode), k):
+                    writer.write(item)
+                    yield item
+            emit_plans(written())
+
+    def replay_plans():
+        emit_plans(io_tools.iter_jsonl(artifact('PreRollout', 'GenMarco.jsonl.plan')))
+
+    def rollout():
+        service = start_local_service(cfg) if runtime(cfg, 'service_mode', 'local') == 'local' else None
+        try:
+            wait_for_service(service_urls(cfg), float(checks.get('max_wait_time', 300)),
+                             float(checks.get('wait_interval', 10)), abort)
+            run_rollout()
+        finally:
+            if service is not None:
+                stop_local_service(service)
+
+    def run_rollout():
+        llm_urls = [url + '/v1/chat/completions' for url in service_urls(cfg)]
+        pending = {}  # question_id -> 已完成的rollout
+        failed = 0
+        # on_result在事件循环中执行，不能在队列满时阻塞（会卡住所有在途请求）：完成的组先放入不限长的handoff，
+        # 由转发线程放进有界的groups；反压改为在取输入时施加，handoff积压超过buffer组时暂停读取新的plan
+        handoff = queue.Queue()
+
+        def forward():
+            try:
+                while True:
+                    group = handoff.get()
+                    if group is END:
+                        return
+                    groups.put(group)
+            except PipelineAborted:
+                pass
+
+        def rows():
+            # 在线程池中执行（blocking_input），这里等待不会阻塞事件循环
+            for plan in plans:
+                while handoff.qsize() >= buffer:
+                    if abort.is_set():
+                        raise PipelineAborted('Rollout')
+                    time.sleep(0.05)
+                for sample_idx in range(plan['expand_count']):
+                    row = {key: value for key, value in plan.items() if key not in ('expand_count', 'schema_ref')}
+                    row['sample_idx'] = sample_idx
+                    yield row
+
+        def on_result(idx, row, res):
+            nonlocal failed
+            failed += bool(res['error_str'])
+            record = {key: value for key, value in row.items() if key != 'schema'}
+            record['row_idx'] = idx
+            record['llm_output'] = res['content']
+            record['error_info'] = res['error_str']
+            raw.write(record)
+            done = pending.setdefault(row['question_id'], [])
+            done.append(record)
+            if len(done) == k:
+                # 一个题目的k个rollout都完成，按sample_idx排好交给判定
+                group = [{'question': r['question'], 'answer': r['answer'], 'final_answer': final_answer(r['llm_output']),
+                          'question_id': r['question_id']}
+                         for r in sorted(pending.pop(row['question_id']), key=lambda r: r['sample_idx'])]
+                for item in group:
+                    processed.write(item)
+                handoff.put(group)
+
+        forwarder = threading.Thread(target=forward, name='Rollout-forward', daemon=True)
+        forwarder.start()
+        try:
+            with io_tools.JsonlWriter(os.path.join(staging['Rollout'], 'merged.jsonl')) as raw, \
+                    io_tools.JsonlWriter(os.path.join(staging['Rollout'], 'merged_processed.jsonl')) as processed:
+                stats = asyncio.run(process_async_stream(
+                    rows(), int(runtime(cfg, 'concurrency', 500)), llm_urls, '', on_result,
+                    n_per_request=int(runtime(cfg, 'n_per_request', k)), adaptive=bool(runtime(cfg, 'adaptive_concurrency', False)),
+                    prefix_lookahead=int(runtime(cfg, 'prefix_lookahead', 0)),
+                    metrics=os.path.join(staging['Rollout'], 'metrics'), blocking_input=True))
+        finally:
+            handoff.put(END)
+            forwarder.join()
+        if abort.is_set():
+            raise PipelineAborted('Rollout')
+        print(format_stats(stats))
+        if pending:
+            raise RuntimeError(f'{len(pending)}个题目的rollout不足k={k}条')
+        if failed:
+            # 出错多为超时等临时故障，提交后同key的运行会一直回放这些错误行
+            incomplete['Rollout'] = f'{failed}条rollout出错'
+
+    def replay_groups():
+        # merged_processed.jsonl 中同一题目的k行相邻
+        group = []
+        for item in io_tools.iter_jsonl(artifact('Rollout', 'merged_processed.jsonl')):
+            if group and item['question_id'] != group[0]['question_id']:
+                groups.put(group)
+                group = []
+            group.append(item)
+        if group:
+            groups.put(group)
+
+    def evaluate():
+        backend = make_judge_backend(judge)
+        verdict_store = ResponseCache(judge.verdict_store) if judge.verdict_store else None
+        rows, verdicts, judge_outputs, judge_tokens = [], [], {}, {}
+        try:
+            for batch in groups.batches(int(runtime(cfg, 'eval_chunk_groups', 8))):
+                chunk = [item for group in batch for item in group]
+                chunk_verdicts, outputs, tokens = judge_rows(judge, chunk, backend, verdict_store)
+                start = len(rows)
+                rows.extend(chunk)
+                verdicts.extend(chunk_verdicts)
+                judge_outputs.update((start + i, output) for i, output in outputs.items())
+                judge_tokens.update((start + i, n) for i, n in tokens.items())
+        finally:
+            if verdict_store is not None:
+                verdict_store.close()
+        # 组按rollout完成的顺序到达，写结果前按题目在输入文件中的顺序排好（组内保持sample_idx顺序），与逐阶段运行的输出一致
+        position = {item.get('question_id', str(i)): i for i, item in enumerate(io_tools.iter_jsonl(cfg['data']['input_jsonl']))}
+        order = sorted(range(len(rows)), key=lambda i: position.get(rows[i]['question_id'], len(position)))
+        rows = [rows[i] for i in order]
+        verdicts = [verdicts[i] for i in order]
+        judge_outputs = {new: judge_outputs[old] for new, old in enumerate(order) if old in judge_outputs}
+        judge_tokens = {new: judge_tokens[old] for new, old in enumerate(order) if old in judge_tokens}
+        io_tools.write_jsonl(detail_path(judge.output), detail_rows(rows, verdicts, judge_outputs))
+        result['metrics'] = write_eval_results(judge, rows, verdicts, judge_outputs, judge_tokens)
+
+    def committed(name, target):
+        """阶段成功结束后把临时目录提交为该key的产物；本阶段或上游的产物不完整时不提交，只输出到任务目录"""
+        def run():
+            target()
+            reasons = [incomplete[n] for n in names[:names.index(name) + 1] if n in incomplete]
+            if reasons:
+                print(f"⚠ {name} 的产物不提交到产物库（{'；'.join(reasons)}），下次运行将重新计算")
+                status[name] = 'uncached'
+            else:
+                store.commit(staging[name], manifests[name], replace=not reuse)
+        return run
+
+    compute = {'GenMarco': gen_marco, 'PreRollout': pre_rollout, 'Rollout': rollout, 'Eval': evaluate}
+    replay = {'GenMarco': replay_marco, 'PreRollout': replay_plans, 'Rollout': replay_groups}
+    stages = [Stage('source', source, [questions], abort)] if resume < 0 else []
+    for name in names:
+        if status[name] == 'computed':
+            stages.append(Stage(name, committed(name, compute[name]), [streams[name]] if name in streams else [], abort))
+        elif status[name] == 'replayed':
+            stages.append(Stage(name, replay[name], [streams[name]], abort))
+
+    start = time.time()
+    for stage in stages:
+        stage.start()
+    report_interval = float(runtime(cfg, 'report_interval', 60))
+    last_report = time.time()
+    while any(stage.is_alive() for stage in stages):
+        for stage in stages:
+            stage.join(timeout=0.5)
+        if time.time() - last_report >= report_interval:
+            last_report = time.time()
+            print(f"[{time.strftime('%H:%M:%S')}] " + ' | '.join(
+                f"{stage.name}: {'运行中' if stage.is_alive() else '完成'} 产出{streams[stage.name].count}"
+                for stage in stages if stage.name in streams), flush=True)
+
+    errors = [(stage.name, stage.error) for stage in stages if stage.error]
+    if errors:
+        for path in staging.values():
+            shutil.rmtree(path, ignore_errors=True)
+        raise RuntimeError('流水线中止:\n' + '\n'.join(f'[{name}]\n{error}' for name, error in errors))
+
+    for name in names:
+        if status[name] == 'uncached':
+            os.makedirs(dirs[name], exist_ok=True)
+            for file in os.listdir(staging[name]):
+                os.replace(os.path.join(staging[name], file), os.path.join(dirs[name], file))
+            shutil.rmtree(staging[name], ignore_errors=True)
+        elif store.has(name, manifests[name]['key']):
+            store.link(name, manifests[name]['key'], dirs[name])
+    if 'metrics' not in result:
+        result['metrics'] = io_tools.read_json(paths['eval_metrics'])
+
+    timeline = {'source': {}} if resume < 0 else {}
+    timeline.update((name, {'key': manifests[name]['key'], 'status': status[name]}) for name in names)
+    for stage in stages:
+        stream = streams.get(stage.name)
+        timeline.setdefault(stage.name, {}).update({
+            'start': round(stage.started_at - start, 2),
+            'first_output': round(stream.first_at - start, 2) if stream is not None and stream.first_at else None,
+            'end': round(stage.finished_at - start, 2),
+            'items': stream.count if stream is not None else len(result['metrics']['per_question']['qid']),
+        })
+    result.update(outputs=paths, stages=timeline, elapsed=round(time.time() - start, 2))
+    return result
+
+
+def format_timeline(timeline: Dict[str, Dict[str, Any]]) -> str:
+    lines = ['阶段        状态       开始(s)  首个产出(s)  结束(s)  产出条数']
+    for name, t in timeline.items():
+        if 'start' not in t:
+            lines.append(f"{name:<10} {t.get('status', ''):<9}")
+            continue
+        first = '-' if t['first_output'] is None else f"{t['first_output']:.1f}"
+        lines.append(f"{name:<10} {t.get('status', ''):<9} {t['start']:>8.1f} {first:>12} {t['end']:>8.1f} {t['items']:>9}")
+    return '\n'.join(lines)
+
+
+def write_summary(path: str, task_name: str, base_dir: str, result: Dict[str, Any], cfg: Dict[str, Any]):
+    summary = {
+        'result': {
+            'accuracy': round(result['metrics']['avg@k']['mean'], 4),
+            'task_name': task_name,
+            'execution_time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'elapsed_seconds': result['elapsed'],
+        },
+        'outputs': dict(base_dir=base_dir, **result['outputs']),
+        'stages': result['stages'],
+        'original_config': cfg,
+    }
+    with open(path, 'w') as f:
+        yaml.safe_dump(summary, f, allow_unicode=True, sort_keys=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='由run.yaml驱动的流水线：GenMarco -> PreRollout -> Rollout -> Eval，阶段之间流式衔接')
+    parser.add_argument('config', type=str, help='run.yaml 路径')
+    parser.add_argument('--task_name', type=str, default='', help='任务目录名，默认 name_prefix_月日_时分')
+    parser.add_argument('--recompute', action='store_true', help='不复用已有的阶段产物，全部重新计算（结果仍写入产物库）')
+    args = parser.parse_args()
+
+    cfg = load_config(args.config)
+    task_name = args.task_name or f"{cfg['task']['name_prefix']}_{time.strftime('%m%d_%H%M')}"
+    base_dir = os.path.join(cfg['task']['output_root'], task_name)
+    print(f"任务名称: {task_name}\n输出目录: {base_dir}")
+
+    try:
+        result = run_pipeline(cfg, base_dir, reuse=not args.recompute)
+    except Exception as e:
+        sys.exit(str(e))
+
+    summary_path = os.path.join(result['outputs']['eval_dir'], 'summary.yaml')
+    write_summary(summary_path, task_name, base_dir, result, cfg)
+    print(format_timeline(result['stages']))
+    print(f"平均准确率: {result['metrics']['avg@k']['mean']:.4f}，用时{result['elapsed']:.1f}秒")
+    print(f"完整结果保存在: {base_dir}，汇总报告: {summary_path}")
@@ -1,10 +1,10 @@
-import json
 import os
+import io_tools
 # target_dir = "/mnt/new_pfs/liming_team/auroraX/mxd/a_x1/new_0513/data/v1_50_32"
 target_dir = "/mnt/new_pfs/liming_team/auroraX/mxd/a_x1/rollout_verify/tmp1"
 source_path = "/mnt/new_pfs/liming_team/auroraX/mxd/a_x1/new_0513/data/new_50_32.jsonl"
 
-ori = [json.loads(line) for line in open(source_path, 'r')]
+ori = io_tools.read_jsonl(source_path)
 print(f"读取到{len(ori)}条数据")
 batch_size = 5
 batch_num = len(ori) // batch_size
@@ -13,6 +13,4 @@ for i in range(batch_size):
     start = i * batch_num
     end = start + batch_num
     batch = ori[start:end]
-    with open(os.path.join(target_dir, f"batch_{i}.jsonl"), 'w') as f:
-        for item in batch:
-            f.write(json.dumps(item, ensure_ascii=False) + "\n")
+    io_tools.write_jsonl(os.path.join(target_dir, f"batch_{i}.jsonl"), batch)
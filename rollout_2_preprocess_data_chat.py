@@ -1,8 +1,8 @@
 # 输入就是 单纯的problem
 # 输出则是 prompt 并且是chat 版本的
 
-import json
 import argparse
+import io_tools
 
 verify_prompt = """# Task Introduction
 Please solve the sub-problems step by step based on the provided sub-questions, and then solve the original problem.
@@ -50,7 +50,7 @@ IMPORTANT FOR CORRECT NOTATION AND FORMATTING:
 # Output
 """
 def main(data_path):
-    data = [json.loads(line) for line in open(data_path, "r")]
+    data = io_tools.read_jsonl(data_path)
     print(f"读取到{len(data)}条数据")
 
     if 'sub_questions' in data[0]:
@@ -65,9 +65,7 @@ def main(data_path):
     ]
     print(f"生成{len(messages)}条messages")
     
-    with open(data_path.replace('.jsonl', '_chat.jsonl'), 'w') as f:
-        for message in messages:
-            f.write(json.dumps(message, ensure_ascii=False) + "\n")
+    io_tools.write_jsonl(data_path.replace('.jsonl', '_chat.jsonl'), messages)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -62,6 +62,16 @@ COPY="${RUNTIME_COPY:-1}"
 PREROLLOUT_MODE="${RUNTIME_PREROLLOUT_MODE:-plan}"
 SERVICE_MODE="${RUNTIME_SERVICE_MODE:-local}"
 BATCH_SIZE="${RUNTIME_BATCH_SIZE:-8}"
+N_PER_REQUEST="${RUNTIME_N_PER_REQUEST:-$COPY}"
+ADAPTIVE_CONCURRENCY="${RUNTIME_ADAPTIVE_CONCURRENCY:-False}"
+PREFIX_LOOKAHEAD="${RUNTIME_PREFIX_LOOKAHEAD:-0}"
+VERDICT_STORE="${RUNTIME_VERDICT_STORE:-}"
+JUDGE_MODE="${RUNTIME_JUDGE_MODE:-think}"
+JUDGE_VOTING="${RUNTIME_JUDGE_VOTING:-parallel}"
+VOTE_BUDGET="${RUNTIME_VOTE_BUDGET:-3}"
+EVAL_CHUNK_GROUPS="${RUNTIME_EVAL_CHUNK_GROUPS:-8}"
+JUDGE_BACKEND="${RUNTIME_JUDGE_BACKEND:-vllm}"
+JUDGE_URL="${RUNTIME_JUDGE_URL:-}"
 SGLANG_CUDA="${RUNTIME_SGLANG_CUDA:-0,1,2,3}"
 VLLM_CUDA="${RUNTIME_VLLM_CUDA:-4,5,6,7}"
 
@@ -75,6 +85,7 @@ PREROLLOUT_SCRIPT="${SCRIPTS_PREROLLOUT:-/mnt/new_pfs/liming_team/auroraX/mxd/a_
 ASYNC_CLIENT_SCRIPT="${SCRIPTS_ASYNC_CLIENT:-/mnt/new_pfs/liming_team/auroraX/mxd/a_x1/RolloutVerify/async_client_sglang.py}"
 PROCESSED_ROLLOUT_SCRIPT="${SCRIPTS_PROCESSED_ROLLOUT:-/mnt/new_pfs/liming_team/auroraX/mxd/a_x1/RolloutVerify/scripts/ProcessedRollout.py}"
 EVAL_SCRIPT="${SCRIPTS_EVALUATE_EQUIV:-/mnt/new_pfs/liming_team/auroraX/mxd/a_x1/RolloutVerify/evaluate_2_equiv.py}"
+EVAL_LAUNCHER_SCRIPT="${SCRIPTS_EVAL_LAUNCHER:-/mnt/new_pfs/liming_team/auroraX/mxd/a_x1/RolloutVerify/eval_launcher.py}"
 
 # 检查参数
 MAX_CHECKS="${CHECKS_MAX_GEN_CHECKS:-30}"
@@ -94,6 +105,12 @@ else
     SGLANG_URL="http://0.0.0.0:$SGLANG_PORT"
 fi
 
+# 额外的推理副本（逗号分隔），与上面的服务一起做负载均衡
+if [ -n "$RUNTIME_SGLANG_EXTRA_URLS" ]; then
+    SGLANG_URL="$SGLANG_URL,$RUNTIME_SGLANG_EXTRA_URLS"
+fi
+LLM_URLS=$(echo "$SGLANG_URL" | tr ',' '\n' | sed 's|$|/v1/chat/completions|' | paste -sd, -)
+
 echo "=== 配置信息 ==="
 echo "任务名称: $TASK_NAME"
 echo "基础输出目录: $BASE_OUTPUT_DIR"
@@ -224,10 +241,15 @@ if [ "$NEED_WAIT_SERVICE" = true ]; then
     fi
 
     while [ $ELAPSED_TIME -lt $MAX_WAIT_TIME ]; do
-        if curl -s --connect-timeout 5 "$SGLANG_URL/health" > /dev/null 2>&1; then
-            echo "✓ sglang服务可用！"
-            break
-        elif curl -s --connect-timeout 5 "$SGLANG_URL/v1/models" > /dev/null 2>&1; then
+        # 所有副本都可用才继续
+        ALL_READY=true
+        for URL in ${SGLANG_URL//,/ }; do
+            if ! curl -s --connect-timeout 5 "$URL/health" > /dev/null 2>&1 && \
+               ! curl -s --connect-timeout 5 "$URL/v1/models" > /dev/null 2>&1; then
+                ALL_READY=false
+            fi
+        done
+        if [ "$ALL_READY" = true ]; then
             echo "✓ sglang服务可用！"
             break
         else
@@ -259,11 +281,18 @@ python $PREROLLOUT_SCRIPT \
 
 # ---------- Rollout阶段 ----------
 echo "=== 开始Rollout步骤 ==="
+ROLLOUT_EXTRA_ARGS=""
+if [ "$ADAPTIVE_CONCURRENCY" = "True" ]; then
+    ROLLOUT_EXTRA_ARGS="--adaptive"
+fi
 python $ASYNC_CLIENT_SCRIPT \
     --input_file $GenMarcoOutput.plan \
     --output_dir $RolloutOutput \
     --batch_size $BATCH_SIZE \
-    --llm_url $SGLANG_URL/v1/chat/completions
+    --llm_url $LLM_URLS \
+    --n_per_request $N_PER_REQUEST \
+    --prefix_lookahead $PREFIX_LOOKAHEAD \
+    $ROLLOUT_EXTRA_ARGS
 
 # 检查Rollout输出文件数量和完整性
 echo "开始检查Rollout生成结果..."
@@ -274,7 +303,8 @@ for i in $(seq 1 $MAX_BATCH_CHECKS); do
     ACTUAL_BATCHES=$(ls $RolloutOutput/batch_*.jsonl 2>/dev/null | wc -l)
     echo "当前已生成 $ACTUAL_BATCHES/$EXPECTED_BATCHES 个batch文件"
     
-    if [ $ACTUAL_BATCHES -eq $EXPECTED_BATCHES ]; then
+    # 分片按行数切分，数据量大时会多于batch_size个
+    if [ $ACTUAL_BATCHES -ge $EXPECTED_BATCHES ]; then
         echo "✓ 所有Rollout批次文件已生成！"
         break
     elif [ $i -eq $MAX_BATCH_CHECKS ]; then
@@ -315,84 +345,51 @@ if [ ! -f "$EVAL_SCRIPT" ]; then
     exit 1
 fi
 
-# 评测数据分割处理
-echo "=== 开始评测数据分割 ==="
-EVAL_TEMP_DIR="$EVAL_OUTPUT_DIR/temp_split"
-mkdir -p $EVAL_TEMP_DIR
-
+# 多卡评测：按k组切块，每张卡一个常驻worker，从共享队列取块，按顺序合并
+echo "=== 开始多卡评测 ==="
 EVAL_TOTAL_LINES=$(wc -l < $EVAL_INPUT)
-EVAL_LINES_PER_GPU=$((EVAL_TOTAL_LINES / TOTAL_GPUS))
-echo "评测总行数: $EVAL_TOTAL_LINES, 每GPU处理: $EVAL_LINES_PER_GPU 行"
-
-split -l $EVAL_LINES_PER_GPU $EVAL_INPUT $EVAL_TEMP_DIR/eval_split_
-
-# 并行评测处理
-echo "=== 开始并行评测 ==="
-EVAL_GPU_IDX=0
-for i in ${VLLM_CUDA//,/ }
-do
-    EVAL_SPLIT_FILE=$(ls $EVAL_TEMP_DIR/eval_split_* | sed -n "$((EVAL_GPU_IDX+1))p")
-    EVAL_PART_OUTPUT="${EVAL_OUTPUT_FILE%.txt}_part${EVAL_GPU_IDX}.txt"
-    
-    echo "GPU $i 评测处理: $EVAL_SPLIT_FILE -> $EVAL_PART_OUTPUT"
-    
-    CUDA_VISIBLE_DEVICES=$i python $EVAL_SCRIPT \
-        --input $EVAL_SPLIT_FILE \
-        --output $EVAL_PART_OUTPUT \
-        --model_path $EVAL_MODEL_PATH \
-        --mode EVAL \
-        --k $COPY &
-    
-    EVAL_GPU_IDX=$((EVAL_GPU_IDX+1))
-done
-
-# 等待评测完成并合并结果
-echo "=== 等待评测完成 ==="
-wait
+EVAL_EXTRA_ARGS="--judge $JUDGE_MODE --voting $JUDGE_VOTING --vote_budget $VOTE_BUDGET"
+if [ -n "$VERDICT_STORE" ]; then
+    EVAL_EXTRA_ARGS="$EVAL_EXTRA_ARGS --verdict_store $VERDICT_STORE"
+fi
+EVAL_DEVICES=$VLLM_CUDA
+if [ "$JUDGE_BACKEND" = "http" ]; then
+    # 判定请求发往已在运行的服务，不占本机GPU，一个worker即可（并发由 --concurrency 控制）
+    EVAL_EXTRA_ARGS="$EVAL_EXTRA_ARGS --backend http --llm_url $JUDGE_URL"
+    EVAL_DEVICES=0
+fi
+echo "评测总行数: $EVAL_TOTAL_LINES, 每块 $EVAL_CHUNK_GROUPS 组 x k=$COPY"
+
+python $EVAL_LAUNCHER_SCRIPT \
+    --input $EVAL_INPUT \
+    --output $EVAL_OUTPUT_FILE \
+    --devices $EVAL_DEVICES \
+    --chunk_groups $EVAL_CHUNK_GROUPS \
+    --model_path $EVAL_MODEL_PATH \
+    --mode EVAL \
+    --k $COPY \
+    $EVAL_EXTRA_ARGS
 echo "所有GPU评测任务完成"
 
-cat ${EVAL_OUTPUT_FILE%.txt}_part*.txt > $EVAL_OUTPUT_FILE
-
-# 检测评测生成情况
+# 检测评测生成情况：准确率文件每个k组一行
 echo "=== 检测评测生成情况 ==="
-EVAL_EXPECTED_LINES=$EVAL_TOTAL_LINES
-
-for i in $(seq 1 $EVAL_MAX_CHECKS); do
-    EVAL_ACTUAL_LINES=$(wc -l < $EVAL_OUTPUT_FILE 2>/dev/null || echo 0)
-    echo "[$(date +%H:%M:%S)] 评测检查 $i/$EVAL_MAX_CHECKS: 预期条数 $EVAL_EXPECTED_LINES, 实际条数 $EVAL_ACTUAL_LINES"
-    
-    if [ $EVAL_ACTUAL_LINES -eq $EVAL_EXPECTED_LINES ]; then
-        echo "✓ 评测完成！文件条数正确。"
-        break
-    elif [ $i -eq $EVAL_MAX_CHECKS ]; then
-        echo "! 达到评测最大检查次数。最终条数: $EVAL_ACTUAL_LINES/$EVAL_EXPECTED_LINES"
-    else
-        echo "继续等待评测完成，${EVAL_CHECK_INTERVAL}秒后重新检查..."
-        sleep $EVAL_CHECK_INTERVAL
-        cat ${EVAL_OUTPUT_FILE%.txt}_part*.txt > $EVAL_OUTPUT_FILE
-    fi
-done
+EVAL_EXPECTED_LINES=$(( (EVAL_TOTAL_LINES + COPY - 1) / COPY ))
+EVAL_ACTUAL_LINES=$(wc -l < $EVAL_OUTPUT_FILE 2>/dev/null || echo 0)
+if [ $EVAL_ACTUAL_LINES -eq $EVAL_EXPECTED_LINES ]; then
+    echo "✓ 评测完成！文件条数正确。"
+else
+    echo "! 评测结果条数不符: $EVAL_ACTUAL_LINES/$EVAL_EXPECTED_LINES"
+fi
 
 # ---------- 评测结果统计 ----------
 echo "=== 评测结果统计 ==="
 
-if [ -f "$EVAL_OUTPUT_FILE" ]; then
-    # 计算平均准确率
-    TOTAL_ACC=$(awk '{sum+=$1; count++} END {if(count>0) printf "%.4f", sum/count; else print "0"}' $EVAL_OUTPUT_FILE)
+EVAL_METRICS_FILE="${EVAL_OUTPUT_FILE%.txt}_metrics.json"
+if [ -f "$EVAL_METRICS_FILE" ]; then
+    # 指标由 eval_metrics.py 按题目聚合计算（avg@k / pass@k / maj@k 及置信区间）
+    TOTAL_ACC=$(python3 -c 'import json, sys; print("%.4f" % json.load(open(sys.argv[1]))["avg@k"]["mean"])' "$EVAL_METRICS_FILE")
     echo "平均准确率: $TOTAL_ACC"
-    echo "详细评测结果已保存到: $EVAL_OUTPUT_FILE"
-    
-    # 显示准确率分布统计
-    echo "--- 准确率分布统计 ---"
-    awk '{
-        if ($1 == 1) true_count++;
-        else if ($1 == 0) false_count++;
-        total++
-    } END {
-        printf "True (准确): %d (%.2f%%)\n", true_count, true_count/total*100;
-        printf "False (错误): %d (%.2f%%)\n", false_count, false_count/total*100;
-        printf "总数: %d\n", total
-    }' $EVAL_OUTPUT_FILE
+    echo "详细评测结果已保存到: $EVAL_OUTPUT_FILE，指标汇总: $EVAL_METRICS_FILE"
 else
     echo "错误: 评测结果文件不存在"
     TOTAL_ACC="0"
@@ -420,6 +417,7 @@ outputs:
   rollout_dir: "$RolloutOutput"
   eval_dir: "$EVAL_OUTPUT_DIR"
   eval_results: "$EVAL_OUTPUT_FILE"
+  eval_metrics: "$EVAL_METRICS_FILE"
 
 # 原始配置信息
 original_config:
@@ -435,11 +433,6 @@ echo "最终准确率: $TOTAL_ACC"
 echo "完整结果保存在: $BASE_OUTPUT_DIR"
 echo ""
 
-# ---------- 清理临时文件 ----------
-echo "=== 清理临时文件 ==="
-rm -rf $EVAL_TEMP_DIR
-rm -f ${EVAL_OUTPUT_FILE%.txt}_part*.txt
-
 # 最后的清理，只在本地模式下执行
 if [ "$SERVICE_MODE" = "local" ]; then
     trap 'tmux send-keys -t $SESSION_NAME:0 C-c; sleep 2; tmux kill-session -t $SESSION_NAME' EXIT
@@ -6,7 +6,6 @@ conda activate vllmqw25
 cd /mnt/new_pfs/liming_team/auroraX/mxd/a_x1/RolloutVerify
 
 ALL_CUDA_VISIBLE_DEVICES="0,1,2,3,4,5,6,7"
-CUDA_DEVICES_ARRAY=(${ALL_CUDA_VISIBLE_DEVICES//,/ })
 
 BASE_DIR="/mnt/new_pfs/liming_team/auroraX/mxd/a_x1/data/v2/processed"
 SPLIT_PREFIX="${BASE_DIR}/processed"
@@ -23,24 +22,20 @@ if [ -z "$START_IDX" ] || [ -z "$END_IDX" ]; then
 fi
 
 echo "起始编号: ${START_IDX}, 终止编号: ${END_IDX}"
-GPU_NUM=${#CUDA_DEVICES_ARRAY[@]}
-CUR_GPU=0
 
+# 逐个文件评测，每个文件都用上全部GPU：eval_launcher 全局去重后切块，各卡从共享队列取块
 for idx in $(seq -f "%02g" $START_IDX $END_IDX)
 do
     split_file="${SPLIT_PREFIX}_${idx}.jsonl"
     output_file="${OUTPUT_PREFIX}_${idx}"
     echo "正在读取数据: ${split_file}"
     if [ -f "$split_file" ]; then
-        echo "正在执行: CUDA_VISIBLE_DEVICES=${CUDA_DEVICES_ARRAY[$CUR_GPU]} python evaluate_2_equiv.py --input ${split_file} --output ${output_file} --model_path ${MODEL_PATH} --k 32"
-        CUDA_VISIBLE_DEVICES=${CUDA_DEVICES_ARRAY[$CUR_GPU]} \
-        python evaluate_2_equiv.py \
+        echo "正在执行: python eval_launcher.py --input ${split_file} --output ${output_file} --devices ${ALL_CUDA_VISIBLE_DEVICES} --model_path ${MODEL_PATH} --k 32"
+        python eval_launcher.py \
             --input "$split_file" \
             --output "$output_file" \
+            --devices "$ALL_CUDA_VISIBLE_DEVICES" \
             --model_path "$MODEL_PATH" \
-            --k 32 &
-        CUR_GPU=$(( (CUR_GPU+1) % GPU_NUM ))
+            --k 32
     fi
 done
-
-wait
\ No newline at end of file
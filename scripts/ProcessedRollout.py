@@ -1,5 +1,7 @@
 import argparse
-import json
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import io_tools
 
 
@@ -11,9 +13,12 @@ if __name__ == "__main__":
     input_file = args.input_file
 
     ori = io_tools.read_jsonl(input_file)
+    # 流式rollout按完成顺序写出，按row_idx恢复原始顺序，保证k组连续
+    if ori and 'row_idx' in ori[0]:
+        ori.sort(key=lambda item: item['row_idx'])
     for item in ori:
         try:
-            tmp = json.loads(item['llm_output'])
+            tmp = io_tools.loads(item['llm_output'])
         except:
             tmp = {
                 'final_answer': 'json error'
@@ -1,54 +1,193 @@
-from vllm import LLM, SamplingParams
-from vllm.sampling_params import GuidedDecodingParams
 from pydantic import BaseModel
 import argparse
+import hashlib
 import json
+import math
 import os
+import time
+import io_tools
 
-from vllm import LLM, SamplingParams
-from vllm.sampling_params import GuidedDecodingParams
+# 分块、可断点续跑的离线生成：
+# 1. 按prompt长度从长到短排序，按token预算切块（长prompt的块行数少，短prompt的块行数多）
+# 2. 每块生成完立即写入 <output_path>.chunks/chunk_xxxxx.jsonl（带原始行号），崩溃/OOM后重跑只生成缺失的块
+# 3. 全部完成后按原始顺序合并成 output_path，每行一个输出，格式与之前一次性生成相同
+# max_model_len / max_num_seqs 由prompt长度推导，不再固定为 2048 / 1
 
 # 定义枚举类型和Pydantic模型
 class SolveDict(BaseModel):
     analysis: str
     final_answer: str
 
-def main(data_path, output_path, model):
-    # 从Pydantic模型获取JSON模式
-    json_schema = SolveDict.model_json_schema()
-    # 配置引导解码参数
-    guided_decoding_params = GuidedDecodingParams(json=json_schema)
-    sample_params = {
-        "temperature": 1,
-        "top_p": 0.97,
-        "max_tokens": 2048,
-    }
-    sampling_params = SamplingParams(guided_decoding=guided_decoding_params, **sample_params)
-
-    with open(data_path, 'r') as f:
-        messages = [json.loads(line) for line in f]
-
-    llm = LLM(model=model, 
-            max_model_len=2048, 
-            max_num_seqs=1,
-            tensor_parallel_size=1,
-            # guided_decoding_backend="outlines",
-            gpu_memory_utilization=0.95)  # 根据需要设置模型
-
-    outputs = llm.chat(messages,
-                    sampling_params)
+SAMPLE_PARAMS = {
+    "temperature": 1,
+    "top_p": 0.97,
+    "max_tokens": 2048,
+}
+# 每块的token预算（prompt + max_tokens），决定每块的行数
+DEFAULT_CHUNK_TOKENS = 4_000_000
+# 自动推导的并发序列数上限
+MAX_NUM_SEQS_CAP = 256
+
+def token_lengths(messages, model):
+    """用模型的chat模板计算每条messages的prompt token数"""
+    from transformers import AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(model)
+    return [len(tokenizer.apply_chat_template(message, tokenize=True, add_generation_prompt=True)) for message in messages]
+
+def plan_chunks(lengths, max_tokens, chunk_tokens):
+    """
+    按长度降序排列后切块，每块的 sum(prompt长度 + max_tokens) 不超过chunk_tokens（至少1行）
+
+    Returns:
+        [[原始行号, ...], ...]
+    """
+    order = sorted(range(len(lengths)), key=lambda i: (-lengths[i], i))
+    chunks, current, used = [], [], 0
+    for i in order:
+        cost = lengths[i] + max_tokens
+        if current and used + cost > chunk_tokens:
+            chunks.append(current)
+            current, used = [], 0
+        current.append(i)
+        used += cost
+    if current:
+        chunks.append(current)
+    return chunks
+
+def derive_limits(lengths, max_tokens, chunks, max_num_seqs=0):
+    """
+    max_model_len: 最长prompt + max_tokens，向上取整到256
+    max_num_seqs: 未指定时取 min(最大块的行数, MAX_NUM_SEQS_CAP)，KV cache不足时由vLLM自行排队
+    """
+    max_model_len = int(math.ceil((max(lengths) + max_tokens) / 256) * 256)
+    if max_num_seqs <= 0:
+        max_num_seqs = min(max(len(chunk) for chunk in chunks), MAX_NUM_SEQS_CAP)
+    return {'max_model_len': max_model_len, 'max_num_seqs': max_num_seqs}
+
+def chunk_dir(output_path):
+    return output_path + '.chunks'
+
+def chunk_path(output_path, chunk_id):
+    return os.path.join(chunk_dir(output_path), f'chunk_{chunk_id:05d}.jsonl')
+
+def plan_fingerprint(messages, lengths, max_tokens, chunk_tokens, settings=None):
+    """
+    续跑时检查输入内容、切块参数以及模型和采样参数（settings）都没有变化，
+    否则已完成的块与新的计划对不上，或新旧输出混在同一个文件里
+    """
+    h = hashlib.sha1(json.dumps([lengths, max_tokens, chunk_tokens, settings], sort_keys=True).encode('utf-8'))
+    for message in messages:
+        h.update(json.dumps(message, ensure_ascii=False, sort_keys=True).encode('utf-8'))
+    return h.hexdigest()
+
+def check_plan(output_path, fingerprint, num_chunks):
+    """写入或核对切块计划，返回已完成的块号集合"""
+    os.makedirs(chunk_dir(output_path), exist_ok=True)
+    plan_file = os.path.join(chunk_dir(output_path), 'plan.json')
+    if os.path.exists(plan_file):
+        plan = io_tools.read_json(plan_file)
+        if plan['fingerprint'] != fingerprint:
+            raise ValueError(f'{chunk_dir(output_path)} 中的块来自不同的输入、模型或参数，请删除该目录后重跑')
+    else:
+        io_tools.write_json(plan_file, {'fingerprint': fingerprint, 'num_chunks': num_chunks})
+    return {chunk_id for chunk_id in range(num_chunks) if os.path.exists(chunk_path(output_path, chunk_id))}
+
+def write_chunk(output_path, chunk_id, indices, texts):
+    """先写临时文件再改名，块文件存在即表示该块完整"""
+    path = chunk_path(output_path, chunk_id)
+    io_tools.write_jsonl(path + '.tmp', ({'index': i, 'text': text} for i, text in zip(indices, texts)))
+    os.replace(path + '.tmp', path)
 
+def merge_chunks(output_path, num_rows, num_chunks):
+    texts = [None] * num_rows
+    for chunk_id in range(num_chunks):
+        for item in io_tools.iter_jsonl(chunk_path(output_path, chunk_id)):
+            texts[item['index']] = item['text']
     with open(output_path, 'w') as f:
-        for output in outputs:
-            cur = output.outputs[0].text
+        for cur in texts:
             if '\n' in cur:
                 cur = cur.replace('\n', '')
             f.write(cur + "\n")
 
+def generate_chunked(messages, output_path, chat, lengths, max_tokens, chunk_tokens=DEFAULT_CHUNK_TOKENS, settings=None):
+    """
+    Args:
+        messages: 每行一条chat messages
+        output_path: 最终输出文件，块文件放在 <output_path>.chunks/
+        chat: chat(messages_list) -> vLLM的输出列表（每项 .outputs[0].text / .token_ids，可选 .prompt_token_ids），
+            测试时可传入桩函数
+        lengths: 每条messages的prompt token数
+        max_tokens: 每条的最大生成token数
+        chunk_tokens: 每块的token预算
+        settings: 模型路径、采样参数等影响输出的设置，参与续跑时的计划校验
+
+    Returns:
+        本次实际生成的块数
+    """
+    chunks = plan_chunks(lengths, max_tokens, chunk_tokens)
+    done = check_plan(output_path, plan_fingerprint(messages, lengths, max_tokens, chunk_tokens, settings), len(chunks))
+    print(f"共{len(messages)}条，切成{len(chunks)}块，已完成{len(done)}块")
+    generated = 0
+    for chunk_id, indices in enumerate(chunks):
+        if chunk_id in done:
+            continue
+        start = time.time()
+        outputs = chat([messages[i] for i in indices])
+        elapsed = time.time() - start
+        write_chunk(output_path, chunk_id, indices, [output.outputs[0].text for output in outputs])
+        generated += 1
+        prompt_tokens = sum(len(getattr(output, 'prompt_token_ids', None) or []) or lengths[i] for i, output in zip(indices, outputs))
+        completion_tokens = sum(len(output.outputs[0].token_ids) for output in outputs)
+        print(f"[块 {chunk_id + 1}/{len(chunks)}] {len(indices)}条，prompt {prompt_tokens} token，生成 {completion_tokens} token，"
+              f"{elapsed:.1f}秒，{completion_tokens / max(elapsed, 1e-9):.1f} 生成token/秒，"
+              f"{(prompt_tokens + completion_tokens) / max(elapsed, 1e-9):.1f} 总token/秒", flush=True)
+    merge_chunks(output_path, len(messages), len(chunks))
+    return generated
+
+def main(data_path, output_path, model, chunk_tokens=DEFAULT_CHUNK_TOKENS, max_num_seqs=0):
+    from vllm import LLM, SamplingParams
+    from vllm.sampling_params import GuidedDecodingParams
+
+    # 从Pydantic模型获取JSON模式
+    json_schema = SolveDict.model_json_schema()
+    # 配置引导解码参数
+    guided_decoding_params = GuidedDecodingParams(json=json_schema)
+    sampling_params = SamplingParams(guided_decoding=guided_decoding_params, **SAMPLE_PARAMS)
+
+    messages = io_tools.read_jsonl(data_path)
+    if not messages:
+        # 空输入：写出空结果，不加载分词器和模型
+        io_tools.write_jsonl(output_path, [])
+        print(f"{data_path} 没有数据，已写出空结果 {output_path}")
+        return
+    lengths = token_lengths(messages, model)
+    chunks = plan_chunks(lengths, SAMPLE_PARAMS['max_tokens'], chunk_tokens)
+    limits = derive_limits(lengths, SAMPLE_PARAMS['max_tokens'], chunks, max_num_seqs)
+    print(f"prompt长度 最长{max(lengths)} 平均{sum(lengths) / len(lengths):.0f} token，引擎参数: {limits}")
+
+    llm = None
+
+    def chat(batch):
+        # 所有块都已完成时（只需合并）不加载模型
+        nonlocal llm
+        if llm is None:
+            llm = LLM(model=model,
+                      tensor_parallel_size=1,
+                      # guided_decoding_backend="outlines",
+                      gpu_memory_utilization=0.95,  # 根据需要设置模型
+                      **limits)
+        return llm.chat(batch, sampling_params, use_tqdm=False)
+
+    settings = {'model': os.path.abspath(model), 'sampling': SAMPLE_PARAMS, 'guided_json': json_schema}
+    generate_chunked(messages, output_path, chat, lengths, SAMPLE_PARAMS['max_tokens'], chunk_tokens, settings)
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('--data_path', type=str, default='', help='输入数据')
     parser.add_argument('--output_path', type=str, default='', help='输出数据')
     parser.add_argument('--model', type=str, default='', help='模型')
+    parser.add_argument('--chunk_tokens', type=int, default=DEFAULT_CHUNK_TOKENS,
+                        help='每块的token预算（prompt + max_tokens），每块完成后落盘，重跑时跳过已完成的块')
+    parser.add_argument('--max_num_seqs', type=int, default=0, help='vLLM同时解码的序列数，0表示按块大小自动推导')
     args = parser.parse_args()
-    main(args.data_path, args.output_path, args.model)
+    main(args.data_path, args.output_path, args.model, args.chunk_tokens, args.max_num_seqs)